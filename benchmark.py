@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+try:
+    import ultima
+    from ultima import *
+except ImportError:
+    print("benchmark.py requires ultima.py to run!")
+    exit()
+
+import random
+
+
+def legacyCompareStreams(stream1, stream2):
+    """Line by line comparator used by ultima before compareOutputs."""
+    while True:
+        line1 = stream1.readline()
+        line2 = stream2.readline()
+        if not line1 and not line2:
+            return True
+        if line1.split() != line2.split():
+            return False
+
+
+def legacyAdvancedCompareStreams(compared, model):
+    def compareLines(compared_line, model_line):
+        length = min(len(model_line), len(compared_line))
+        for i in range(0, length):
+            if compared_line[i] != model_line[i]:
+                return i
+        return None
+
+    line = 1
+    while True:
+        comparedLine = compared.readline().split()
+        modelLine = model.readline().split()
+        if not comparedLine and not modelLine:
+            return None
+
+        cmpResult = compareLines(comparedLine, modelLine)
+        if cmpResult is not None or len(comparedLine) != len(modelLine):
+            return "Line %s" % line, line
+
+        line += 1
+
+
+def legacyCheck(compared, model):
+    """Failing test was compared twice: once for verdict, once for message."""
+    if legacyCompareStreams(io.BytesIO(compared), io.BytesIO(model)):
+        return None
+    return legacyAdvancedCompareStreams(io.BytesIO(compared), io.BytesIO(model))
+
+
+def singlePassCheck(compared, model):
+    return compareOutputs(io.BytesIO(compared), io.BytesIO(model))
+
+
+def generateOutput(megabytes, tokensPerLine=10):
+    random.seed(0)
+    lines = list()
+    size = 0
+    while size < megabytes * 1024 * 1024:
+        line = " ".join(str(random.randint(0, 10 ** 9)) for _ in range(tokensPerLine)) + "\n"
+        lines.append(line)
+        size += len(line)
+    return "".join(lines).encode()
+
+
+def measure(function, *args):
+    startTime = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - startTime
+
+
+def benchmarkCompare(args):
+    model = generateOutput(args.size)
+    # Outputs differing only in whitespace are accepted, they are compared token by token.
+    cases = (
+        ("identical", model),
+        ("trailing", model.replace(b"\n", b" \n")),
+        ("crlf", model.replace(b"\n", b"\r\n")),
+        ("both", model.replace(b"\n", b" \r\n")),
+        ("double", model.replace(b" ", b"  ")),
+        ("tabs", model.replace(b" ", b"\t")),
+        ("last token", model[:-2] + b"X\n"),
+    )
+
+    megabytes = len(model) / 1024 / 1024
+    print("Model output: %.1f MB" % megabytes)
+    print("%-12s %14s %14s" % ("case", "legacy MB/s", "single MB/s"))
+    for name, compared in cases:
+        legacyTime = measure(legacyCheck, compared, model)
+        singlePassTime = measure(singlePassCheck, compared, model)
+        print("%-12s %14.1f %14.1f" % (name, megabytes / legacyTime, megabytes / singlePassTime))
+
+
+def systemCallCounts():
+    """Returns couple (read calls, write calls) made by this process so far, or None."""
+    try:
+        with open("/proc/self/io") as ioFile:
+            counters = dict(line.split(": ") for line in ioFile.read().splitlines())
+        return int(counters["syscr"]), int(counters["syscw"])
+    except (IOError, KeyError, ValueError):
+        return None
+
+
+def runProcesses(command, inputData, processes):
+    """Runs processes at once, returns total size of their outputs."""
+    outputs = [io.BytesIO() for _ in range(processes)]
+    threads = [threading.Thread(target=callProcess, args=(command, io.BytesIO(inputData), output))
+               for output in outputs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(len(output.getvalue()) for output in outputs)
+
+
+def benchmarkIo(args):
+    inputData = generateOutput(args.size)
+    megabytes = len(inputData) / 1024 / 1024 * args.processes
+    print("%s processes, %.1f MB of input and output each" % (args.processes, len(inputData) / 1024 / 1024))
+    print("%-12s %10s %10s %12s %12s" % ("engine", "seconds", "MB/s", "read calls", "write calls"))
+
+    for engine, multiplexed in (("threads", False), ("multiplexer", True)):
+        if multiplexed and os.name != 'posix':
+            continue
+        ultima.useMultiplexer = multiplexed
+        callsBefore = systemCallCounts()
+        startTime = time.perf_counter()
+        outputSize = runProcesses(args.command, inputData, args.processes)
+        seconds = time.perf_counter() - startTime
+        callsAfter = systemCallCounts()
+        assert outputSize == len(inputData) * args.processes
+
+        if callsBefore is None:
+            calls = ("n/a", "n/a")
+        else:
+            calls = (callsAfter[0] - callsBefore[0], callsAfter[1] - callsBefore[1])
+        print("%-12s %10.2f %10.1f %12s %12s" % (engine, seconds, 2 * megabytes / seconds, calls[0], calls[1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs ultima benchmarks.')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    compareParser = subparsers.add_parser('compare', help='throughput of output comparison')
+    compareParser.add_argument('--size', help='size of compared outputs', type=float, default=64, metavar='MB')
+    compareParser.set_defaults(function=benchmarkCompare)
+
+    ioParser = subparsers.add_parser('io', help='throughput of relaying process input and output')
+    ioParser.add_argument('--size', help='size of input of each process', type=float, default=64, metavar='MB')
+    ioParser.add_argument('--processes', help='number of processes run at once', type=int, default=8)
+    ioParser.add_argument('--command', help='program copying its input to output', default='cat')
+    ioParser.set_defaults(function=benchmarkIo)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nKeyboardInterrupt - Exiting...")
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+try:
+    from ultima import *
+except ImportError:
+    print("cache.py requires ultima.py to run!")
+    exit()
+
+
+def showStats(cache, args):
+    entries = list(cache.entries())
+    size = sum(entrySize for _, entrySize, _ in entries)
+    print("Cache folder: %s" % cache.folder)
+    print("Entries: %s" % len(entries))
+    print("Size: %.1f MB" % (size / 1024.0 / 1024.0))
+
+
+def prune(cache, args):
+    removed = cache.prune(int(args.size * 1024 * 1024))
+    print("Removed %s entries, cache size: %.1f MB" % (removed, cache.size / 1024.0 / 1024.0))
+
+
+def clear(cache, args):
+    removed = cache.prune(0)
+    print("Removed %s entries" % removed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manages cache of generated tests used by ultima --cache.')
+    parser.add_argument('--folder', help='cache folder, %s by default' % TestDataCache.defaultFolder)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    statsParser = subparsers.add_parser('stats', help='show number of entries and size of cache')
+    statsParser.set_defaults(function=showStats)
+
+    pruneParser = subparsers.add_parser('prune', help='remove least recently used entries')
+    pruneParser.add_argument('--size', help='size of cache to keep', type=float, required=True, metavar='MB')
+    pruneParser.set_defaults(function=prune)
+
+    clearParser = subparsers.add_parser('clear', help='remove all entries')
+    clearParser.set_defaults(function=clear)
+
+    args = parser.parse_args()
+    if args.folder is not None:
+        assertFolderExist(args.folder)
+    cache = TestDataCache(args.folder)
+    args.function(cache, args)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nKeyboardInterrupt - Exiting...")
@@ -36,36 +36,279 @@ def getProviderListFromArgs(args, parser):
     return testProviderList
 
 
+COMPRESSION_METHODS = {
+    "deflate": zipfile.ZIP_DEFLATED,
+    "stored": zipfile.ZIP_STORED,
+    "zstd": ZIP_ZSTANDARD,
+}
+
+
+def createCompressor(method, level):
+    """Returns streaming compressor for zip compression method, None for stored files."""
+    if method == zipfile.ZIP_DEFLATED:
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+                                zlib.DEFLATED, -zlib.MAX_WBITS)
+    if method == ZIP_ZSTANDARD:
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+    return None
+
+
+class CompressedEntry:
+    """
+    Zip archive entry compressed in advance, in worker thread, so writing
+    it to archive is only copying. Data given as bytes is compressed
+    to memory, data given as file (ie large output) to temporary file.
+    If info of file from other archive is given, data is already compressed.
+    """
+    chunk_size = 1024 * 1024
+
+    def __init__(self, name, method, level=None, data=None, filename=None, info=None):
+        self.name = name
+        self.method = method
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.flag_bits = 0
+        self.data = None
+        self.filename = None
+        self.temporary = False
+
+        compressor = createCompressor(method, level)
+        if info is not None:
+            self.crc = info.CRC
+            self.file_size = info.file_size
+            self.compress_size = info.compress_size
+            # Data descriptor is not copied.
+            self.flag_bits = info.flag_bits & ~0x08
+            self.data = data
+        elif filename is None:
+            parts = list()
+            self.compress(compressor, (data,), parts.append)
+            self.data = b"".join(parts)
+        elif compressor is None:
+            with open(filename, "rb") as source:
+                self.compress(None, iter(lambda: source.read(self.chunk_size), b""), lambda chunk: None)
+            self.filename = filename
+        else:
+            handle, self.filename = tempfile.mkstemp(prefix="cpack", suffix=".tmp")
+            self.temporary = True
+            with open(filename, "rb") as source, os.fdopen(handle, "wb") as sink:
+                self.compress(compressor, iter(lambda: source.read(self.chunk_size), b""), sink.write)
+
+    def compress(self, compressor, chunks, write):
+        for chunk in chunks:
+            self.crc = zlib.crc32(chunk, self.crc)
+            self.file_size += len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            self.compress_size += len(chunk)
+            write(chunk)
+
+        if compressor is not None:
+            chunk = compressor.flush()
+            self.compress_size += len(chunk)
+            write(chunk)
+
+    def append_to(self, zip_file):
+        """
+        Appends entry to archive, caller must ensure nobody else writes to it.
+        Returns ZipInfo of appended file.
+        """
+        info = zipfile.ZipInfo(self.name, time.localtime(time.time())[:6])
+        info.compress_type = self.method
+        info.flag_bits = self.flag_bits
+        info.external_attr = 0o600 << 16
+        info.file_size = self.file_size
+        info.compress_size = self.compress_size
+        info.CRC = self.crc
+        if self.method == ZIP_ZSTANDARD:
+            info.create_version = info.extract_version = 63
+        zip64 = max(self.file_size, self.compress_size) > zipfile.ZIP64_LIMIT
+
+        # ZipFile can't write data compressed elsewhere, entry is written
+        # the same way ZipFile.writestr does it.
+        zip_file.fp.seek(zip_file.start_dir)
+        info.header_offset = zip_file.fp.tell()
+        zip_file._didModify = True
+        zip_file.fp.write(info.FileHeader(zip64))
+        if self.filename is None:
+            zip_file.fp.write(self.data)
+        else:
+            with open(self.filename, "rb") as source:
+                shutil.copyfileobj(source, zip_file.fp, self.chunk_size)
+        zip_file.start_dir = zip_file.fp.tell()
+        zip_file.filelist.append(info)
+        zip_file.NameToInfo[info.filename] = info
+        return info
+
+    def close(self):
+        if self.temporary:
+            tryDeleteFile(self.filename)
+        self.data = None
+
+
+class Manifest:
+    """
+    Journal of files in archive, kept next to it while cpack writes to it.
+    ZipFile writes central directory of archive only when it is closed,
+    so archive left by interrupted cpack can't be read. It is rebuilt
+    from manifest on next run.
+    """
+    fields = ("header_offset", "compress_type", "CRC", "compress_size", "file_size", "flag_bits",
+              "external_attr", "create_system", "create_version", "extract_version")
+
+    def __init__(self, archive_name):
+        self.filename = archive_name + ".manifest"
+        self.file = None
+
+    def exists(self):
+        return os.path.isfile(self.filename)
+
+    def start(self, zip_file):
+        """Starts new manifest with files already in archive."""
+        self.file = open(self.filename, "w")
+        self.record(zip_file.infolist(), zip_file.start_dir)
+
+    def record(self, infos, end):
+        """Records files written to archive, which data ends before offset end."""
+        for info in infos:
+            record = dict((field, getattr(info, field)) for field in self.fields)
+            record.update(filename=info.filename, date_time=info.date_time, end=end)
+            self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def read(self):
+        """Returns list of couples (ZipInfo, end) of recorded files."""
+        entries = list()
+        with open(self.filename) as manifest_file:
+            for line in manifest_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Line written partially when cpack was interrupted.
+                    break
+                info = zipfile.ZipInfo(record["filename"], tuple(record["date_time"]))
+                for field in self.fields:
+                    setattr(info, field, record[field])
+                entries.append((info, record["end"]))
+        return entries
+
+    def recover(self, archive_name):
+        """Cuts archive after last recorded file and writes its central directory."""
+        entries = self.read()
+        if not entries:
+            # Nothing tells where data of archive ends, it is kept as it is.
+            try:
+                zipfile.ZipFile(archive_name).close()
+            except zipfile.BadZipFile:
+                raise CriticalError("Archive %s can't be recovered, %s has no files recorded."
+                                    % (archive_name, self.filename))
+            return
+        end = max(entry_end for _, entry_end in entries)
+        with open(archive_name, "r+b") as archive:
+            archive.truncate(end)
+
+        # Truncated archive isn't zip file any more, ZipFile starts new one after its data.
+        zip_file = zipfile.ZipFile(archive_name, 'a', zipfile.ZIP_DEFLATED, True)
+        for info, _ in entries:
+            zip_file.filelist.append(info)
+            zip_file.NameToInfo[info.filename] = info
+        zip_file._didModify = True
+        zip_file.close()
+
+    def close(self):
+        """Removes manifest after archive was closed."""
+        if self.file is not None:
+            self.file.close()
+            tryDeleteFile(self.filename)
+
+
+def open_archive(filename):
+    """
+    Opens archive for appending, with manifest of its files. Archive of
+    interrupted cpack is recovered first.
+    """
+    manifest = Manifest(filename)
+    if os.path.isfile(filename) and manifest.exists():
+        # Central directory left in archive may describe only part of it.
+        print("Archive was not closed properly, recovering it from %s" % manifest.filename)
+        manifest.recover(filename)
+
+    zip_file = zipfile.ZipFile(filename, 'a', zipfile.ZIP_DEFLATED, True)
+    manifest.start(zip_file)
+    return zip_file, manifest
+
+
 class TestExecutor(Functor):
-    def __init__(self, runner, zip_file, break_after_error):
+    def __init__(self, runner, zip_file, break_after_error, compression=zipfile.ZIP_DEFLATED, level=None,
+                 manifest=None, write_inputs=True):
         Functor.__init__(self)
         self.runner = runner
         self.zip_file = zip_file
         self.break_after_error = break_after_error
+        self.compression = compression
+        self.level = level
+        self.manifest = manifest
+        self.write_inputs = write_inputs
         self.keyboard_interrupt_happened = False
         self.should_break = False
         self.done_number = 0
         self.error_number = 0
+        # Tests which were not written to archive because of error.
+        self.failed_tests = list()
         self.output_lock = threading.Lock()
 
+    def compress_entries(self, test, runResult):
+        """Compresses test input and output, outside of output lock."""
+        entries = list()
+        input_name = "in/%s.in" % test.testName
+        output_name = "out/%s.out" % test.testName
+        if not self.write_inputs:
+            pass
+        elif isinstance(test, TestFromFolder):
+            entries.append(CompressedEntry(input_name, self.compression, self.level, filename=test.inFilename))
+        elif isinstance(test, TestFromZip) and test.zipReader.infos[test.inFilename].compress_type == self.compression:
+            # Input was read (and its CRC checked) by the test, it is copied without compressing again.
+            info, data = test.zipReader.readCompressed(test.inFilename)
+            entries.append(CompressedEntry(input_name, self.compression, data=data, info=info))
+        else:
+            entries.append(CompressedEntry(input_name, self.compression, self.level, data=test.inputData))
+
+        if runResult.output.spilled:
+            entries.append(CompressedEntry(output_name, self.compression, self.level,
+                                           filename=runResult.output.outputFile()))
+        else:
+            entries.append(CompressedEntry(output_name, self.compression, self.level, data=runResult.outputData))
+        return entries
+
     def work(self, test):
         runResult = self.runner.run(test)
-
-        with self.output_lock:
-            if runResult.result not in ("OK", "IGNORE"):
+        failed = runResult.result not in ("OK", "IGNORE")
+        if failed and self.break_after_error:
+            with self.output_lock:
                 print("Error when doing test %s" % test.testName)
                 self.error_number += 1
-                if self.break_after_error:
-                    return
-            else:
-                self.done_number += 1
+                self.failed_tests.append(test)
+            return
 
-            sys.stdout.write("\r%s tests done, %s errors." % (self.done_number, self.error_number))
+        entries = self.compress_entries(test, runResult)
+        try:
+            with self.output_lock:
+                if failed:
+                    print("Error when doing test %s" % test.testName)
+                    self.error_number += 1
+                else:
+                    self.done_number += 1
 
-            input_name = "in/%s.in" % test.testName
-            output_name = "out/%s.out" % test.testName
-            self.zip_file.writestr(input_name, test.inputData)
-            self.zip_file.writestr(output_name, runResult.outputData)
+                sys.stdout.write("\r%s tests done, %s errors." % (self.done_number, self.error_number))
+                infos = [entry.append_to(self.zip_file) for entry in entries]
+                if self.manifest is not None:
+                    # Files are recorded only after their data reached the disk.
+                    self.zip_file.fp.flush()
+                    self.manifest.record(infos, self.zip_file.start_dir)
+        finally:
+            for entry in entries:
+                entry.close()
 
     def keyboard_interrupt(self):
         print("\nKeyboardInterrupt - going to close...")
@@ -75,24 +318,182 @@ class TestExecutor(Functor):
         return not self.keyboard_interrupt_happened and not self.should_break
 
 
-def mainLoop(testProviderList, args):
+class TestSelector:
+    """
+    Chooses tests to add to archive. Tests already in archive are skipped
+    and, when deduplicating, generated tests with the same input as some
+    earlier test. Inputs are remembered by hash, inputs from archive are
+    found by CRC and size and compared.
+    """
+    max_duplicates_in_row = 100
+
+    def __init__(self, zip_file, deduplicate=False):
+        self.names = set(zip_file.namelist())
+        self.deduplicate = deduplicate
+        self.digests = set()
+        self.archived_inputs = dict()
+        self.archive_reader = None
+        for info in zip_file.infolist():
+            if deduplicate and info.filename.startswith("in/"):
+                self.archived_inputs.setdefault((info.CRC, info.file_size), list()).append(info.filename)
+        if self.archived_inputs:
+            self.archive_reader = ZipReader(zip_file.filename)
+        self.start()
+
+    def start(self, limit=None):
+        """Starts selecting tests of next source, with limit of unique tests in archive."""
+        self.limit = limit
+        self.archived = 0
+        self.selected = 0
+        self.duplicates = 0
+
+    def limit_reached(self):
+        return self.limit is not None and self.archived + self.selected >= self.limit
+
+    def new_tests(self, tests):
+        """Yields tests which input and output are not both in archive yet."""
+        for test in tests:
+            if self.limit_reached():
+                return
+            if "in/%s.in" % test.testName in self.names and "out/%s.out" % test.testName in self.names:
+                self.archived += 1
+                continue
+            yield test
+
+    def is_duplicate(self, data):
+        digest = hashlib.sha256(data).digest()
+        if digest in self.digests:
+            return True
+        self.digests.add(digest)
+        for name in self.archived_inputs.get((zlib.crc32(data), len(data)), ()):
+            if self.archive_reader.read(name) == data:
+                return True
+        return False
+
+    def unique_tests(self, tests):
+        """Yields tests without duplicated generated inputs."""
+        duplicates_in_row = 0
+        for test in tests:
+            if isinstance(test, RandomTest) and self.is_duplicate(test.inputData):
+                self.duplicates += 1
+                duplicates_in_row += 1
+                if duplicates_in_row >= self.max_duplicates_in_row:
+                    print("\n%s generated tests in a row were duplicates, stopping." % duplicates_in_row)
+                    return
+                continue
+            duplicates_in_row = 0
+            self.selected += 1
+            yield test
+            if self.limit_reached():
+                return
+
+
+def run_tests(tests, zip_file, args, manifest=None, write_inputs=True, selector=None, failed_tests=None):
+    """
+    Runs tests, writing them to archive. Returns False if it was interrupted.
+    Tests not written because of error are added to failed_tests list, if given.
+    """
     runner = BasicRunner(args.program)
     runner.ignoreOutput = True
+    depth = args.pipeline
+    if selector is not None:
+        tests = selector.new_tests(tests)
+        if depth is None and selector.deduplicate:
+            # Duplicates are found before tests reach workers, so inputs are still generated in parallel.
+            depth = args.threads
+    if depth is not None:
+        tests = pipelineTests(tests, depth, modelOutputs=False)
+    if selector is not None and selector.deduplicate:
+        tests = selector.unique_tests(tests)
+
+    test_executor = TestExecutor(runner, zip_file, args.break_after_error, COMPRESSION_METHODS[args.compression],
+                                 args.level, manifest, write_inputs)
+    if args.threads == 1:
+        executor = SequentialExecutor(test_executor, tests)
+    else:
+        executor = ParallelExecutor(test_executor, tests, args.threads)
+    executor.process()
+    if failed_tests is not None:
+        failed_tests.extend(test_executor.failed_tests)
+    return not test_executor.keyboard_interrupt_happened
+
+
+def mainLoop(testProviderList, args):
+    zip_file, manifest = open_archive(args.output)
+    try:
+        selector = TestSelector(zip_file, args.dedup)
+        for testProviderArgs in testProviderList:
+            TestProviderClass = testProviderArgs[0]
+            testProviderArgs = testProviderArgs[1]
+            print("Processing tests from \"%s\"" % (testProviderArgs,))
+            testProvider = TestProviderClass(*testProviderArgs)
 
-    zip_file = zipfile.ZipFile(args.output, 'a', zipfile.ZIP_DEFLATED, True)
+            if args.until_unique and isinstance(testProvider, RandomTestProvider):
+                # Generator runs until it gives enough unique tests.
+                selector.start(testProvider.testLimit)
+                testProvider.testLimit = None
+            else:
+                selector.start()
+            tests = testProvider.getTests()
+            if args.shard is not None:
+                tests = shardTests(tests, args.shard)
+            completed = run_tests(tests, zip_file, args, manifest, selector=selector)
+
+            skipped = list()
+            if selector.archived > 0:
+                skipped.append("%s tests already in archive" % selector.archived)
+            if args.dedup:
+                skipped.append("%s duplicated generated tests" % selector.duplicates)
+            if skipped:
+                print("\nSkipped %s." % ", ".join(skipped))
+            if not completed:
+                break
+    finally:
+        # Manifest is removed only when archive was closed, if cpack is
+        # killed before it stays and archive is recovered on next run.
+        zip_file.close()
+        manifest.close()
 
-    for testProviderArgs in testProviderList:
-        TestProviderClass = testProviderArgs[0]
-        testProviderArgs = testProviderArgs[1]
-        print("Processing tests from \"%s\"" % (testProviderArgs,))
-        testProvider = TestProviderClass(*testProviderArgs)
 
-        test_executor = TestExecutor(runner, zip_file, args.break_after_error)
-        if args.threads == 1:
-            executor = SequentialExecutor(test_executor, testProvider.getTests())
+def rebuild_outputs(args):
+    """
+    Creates outputs of tests in archive again, with new model solution.
+    Inputs and other files are copied as they are, new archive replaces
+    old one when all tests are done. Tests on which model solution failed
+    keep their old outputs.
+    """
+    test_provider = TestFromZipProvider(args.output)
+    tests = list(test_provider.getTests())
+    outputs = set("out/%s.out" % test.testName for test in tests)
+    outputs.update(test.modelOutFilename for test in tests if test.modelOutFilename is not None)
+
+    temporary_name = args.output + ".rebuild"
+    zip_file = zipfile.ZipFile(temporary_name, 'w', zipfile.ZIP_DEFLATED, True)
+    done = False
+    try:
+        reader = test_provider.zipReader
+        for name in reader.namelist():
+            if name not in outputs:
+                info, data = reader.readCompressed(name)
+                CompressedEntry(name, info.compress_type, data=data, info=info).append_to(zip_file)
+
+        print("Rebuilding outputs of %s tests" % len(tests))
+        failed_tests = list()
+        done = run_tests(tests, zip_file, args, write_inputs=False, failed_tests=failed_tests)
+        if done and failed_tests:
+            failed_tests.sort(key=lambda test: TestProvider.testSortKey(test.testName))
+            print("\nError: model solution failed on %s tests, their old outputs are kept: %s"
+                  % (len(failed_tests), ", ".join(test.testName for test in failed_tests)))
+            for test in failed_tests:
+                if test.modelOutFilename is not None:
+                    info, data = reader.readCompressed(test.modelOutFilename)
+                    CompressedEntry(test.modelOutFilename, info.compress_type, data=data, info=info).append_to(zip_file)
+    finally:
+        zip_file.close()
+        if done:
+            os.replace(temporary_name, args.output)
         else:
-            executor = ParallelExecutor(test_executor, testProvider.getTests(), args.threads)
-        executor.process()
+            tryDeleteFile(temporary_name)
 
 
 def main():
@@ -115,13 +516,41 @@ def main():
                         action='store_false', default=True)
 
     parser.add_argument('--threads', '-t', help='number of parallel tasks', type=int, default=1)
+    parser.add_argument('--pipeline', help='generate or unpack inputs of up to N tests ahead, in background',
+                        type=int, metavar='N')
+    parser.add_argument('--compression', help='compression of archive files, stored is fastest, '
+                                              'zstd requires zstandard module', choices=sorted(COMPRESSION_METHODS),
+                        default='deflate')
+    parser.add_argument('--level', help='compression level, ie 1 (fast) to 9 (small) for deflate', type=int)
+    parser.add_argument('--shard', help='pack only i-th of N parts of tests, divided by hash of test name; '
+                                        'parts are joined by merge.py packs', type=parseShard, metavar='i/N')
+    parser.add_argument('--dedup', help='skip generated tests with the same input as earlier test',
+                        action='store_true', default=False)
+    parser.add_argument('--until_unique', help='with --dedup, generate tests until given number of them is unique',
+                        action='store_true', default=False)
+    parser.add_argument('--rebuild_outputs', help='create outputs of tests already in output archive again, '
+                                                  'keeping their inputs', action='store_true', default=False)
 
     args = parser.parse_args()    
     assertFileExist(args.program)
 
+    if args.until_unique and not args.dedup:
+        parser.error("--until_unique requires --dedup")
+    if args.shard is not None and (args.until_unique or args.rebuild_outputs):
+        parser.error("--shard can't be used with --until_unique or --rebuild_outputs")
+    if args.compression == 'zstd' and zstandard is None:
+        parser.error("zstd compression requires zstandard module")
+
     if getFileNameExtension(args.output) != "zip":
         args.output += ".zip"
     
+    if args.rebuild_outputs:
+        if args.zip or args.folder or args.generator or args.generator2:
+            parser.error("test sources can't be used with --rebuild_outputs")
+        assertFileExist(args.output)
+        rebuild_outputs(args)
+        return
+
     if os.path.isfile(args.output):
         print("Output file already exists, will be adding new files to archive.")
 
@@ -134,3 +563,5 @@ if __name__ == "__main__":
         main()
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt - Exiting...")
+    except CriticalError as error:
+        print("\nCritical Error. %s Exiting." % error)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+try:
+    from ultima import *
+except ImportError:
+    print("history.py requires ultima.py to run!")
+    exit()
+
+
+def showRuns(history, args):
+    print("%6s  %-16s %6s %9s %10s  %s" % ("run", "time", "tests", "failures", "CPU time", "program"))
+    for runId, startTime, program, programHash, tests, failures, cpuTime in history.runs(args.limit):
+        print("%6s  %-16s %6s %9s %10.2f  %s (%s)" % (runId, time.strftime("%Y-%m-%d %H:%M", time.localtime(startTime)),
+                                                     tests, failures or 0, cpuTime or 0.0, program, programHash[:8]))
+
+
+def compareRuns(history, args):
+    if history.run(args.run) is None:
+        print("There is no run %s in history." % args.run)
+        return
+    history.printComparison(args.run, args.baseline, args.slowdown / 100.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shows history of runs saved by ultima --history.')
+    parser.add_argument('--file', help='history database, %s by default' % RunHistory.defaultFilename)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    runsParser = subparsers.add_parser('runs', help='list saved runs, newest first')
+    runsParser.add_argument('--limit', help='show only N last runs', type=int, default=20, metavar='N')
+    runsParser.set_defaults(function=showRuns)
+
+    compareParser = subparsers.add_parser('compare', help='report tests slower than in baseline run')
+    compareParser.add_argument('run', help='compared run', type=int)
+    compareParser.add_argument('baseline', help='baseline run', type=int)
+    compareParser.add_argument('--slowdown', help='report tests which got slower by more than PERCENT (default 10)',
+                               type=float, default=10, metavar='PERCENT')
+    compareParser.set_defaults(function=compareRuns)
+
+    args = parser.parse_args()
+    if sqlite3 is None:
+        parser.error("history requires sqlite3 module")
+    if args.file is not None:
+        assertFileExist(args.file)
+    history = RunHistory(args.file)
+    args.function(history, args)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nKeyboardInterrupt - Exiting...")
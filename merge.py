@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+try:
+    from ultima import *
+    from cpack import CompressedEntry, Manifest
+except ImportError:
+    print("merge.py requires ultima.py and cpack.py to run!")
+    exit()
+
+
+def readReport(filename):
+    """Returns couple (list of test records, summary record or None) from report written by ultima --report."""
+    tests = list()
+    summary = None
+    with open(filename) as reportFile:
+        for number, line in enumerate(reportFile, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Last line could be cut if ultima was killed.
+                print("%s:%s: broken record, skipped." % (filename, number))
+                continue
+            if record.get("type") == "test":
+                tests.append(record)
+            elif record.get("type") == "summary":
+                summary = record
+    return tests, summary
+
+
+def checkShards(shards):
+    """Prints warning if given shards i/N don't cover all tests exactly once."""
+    counts = set(count for _, count in shards)
+    if len(counts) != 1:
+        print("Warning: shards of different partitions: %s" % ", ".join("%s/%s" % shard for shard in shards))
+        return
+    count = counts.pop()
+    indexes = [index for index, _ in shards]
+    missing = sorted(set(range(1, count + 1)) - set(indexes))
+    repeated = sorted(set(index for index in indexes if indexes.count(index) > 1))
+    if missing:
+        print("Warning: missing shards %s of %s." % (", ".join(map(str, missing)), count))
+    if repeated:
+        print("Warning: shards %s given more than once." % ", ".join(map(str, repeated)))
+
+
+def mergeReports(args):
+    tests = list()
+    shards = list()
+    total = ignored = failures = 0
+    completed = True
+    for filename in args.reports:
+        assertFileExist(filename)
+        records, summary = readReport(filename)
+        if summary is None:
+            print("Warning: %s has no summary, testing was not finished." % filename)
+            completed = False
+        else:
+            total += summary["total"]
+            ignored += summary["ignored"]
+            failures += summary["failures"]
+            completed = completed and summary["completed"] and not summary["stopped"]
+            if summary.get("shard") is not None:
+                shards.append(parseShard(summary["shard"]))
+        tests.extend(records)
+    if shards:
+        checkShards(shards)
+
+    # Tests of the same name from different sources are all kept, they are in the same shard.
+    tests.sort(key=lambda record: TestProvider.testSortKey(record["name"]))
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            for record in tests:
+                output.write(json.dumps(record) + "\n")
+            output.write(json.dumps({"type": "summary", "total": total, "ignored": ignored, "failures": failures,
+                                     "stopped": False, "completed": completed, "shard": None}) + "\n")
+
+    for record in tests:
+        if record["verdict"] not in ("OK", "IGNORE"):
+            print("%s: %s %s" % (record["name"], record["verdict"], record["message"] or ""))
+    print("Total tests: " + str(total))
+    print("Ignored: " + str(ignored))
+    print("Run: " + str(total - ignored))
+    print("Successes: " + str(total - ignored - failures))
+    print("Failures: " + str(failures))
+
+
+def mergePacks(args):
+    if os.path.exists(args.output):
+        print("Output file %s already exists." % args.output)
+        return
+    readers = list()
+    for filename in args.packs:
+        assertFileExist(filename)
+        if Manifest(filename).exists():
+            print("%s was not finished, run cpack on it again to recover it." % filename)
+            return
+        readers.append(ZipReader(filename))
+
+    copied = dict()
+    with zipfile.ZipFile(args.output, 'w', zipfile.ZIP_DEFLATED, True) as zipFile:
+        for reader in readers:
+            for name in reader.namelist():
+                info, data = reader.readCompressed(name)
+                if name in copied:
+                    if copied[name] != (info.CRC, info.file_size):
+                        print("Warning: %s differs in %s, copy from earlier pack kept." % (name, reader.filename))
+                    continue
+                # Files are copied compressed, as they are.
+                CompressedEntry(name, info.compress_type, data=data, info=info).append_to(zipFile)
+                copied[name] = (info.CRC, info.file_size)
+    print("Merged %s files from %s packs into %s." % (len(copied), len(readers), args.output))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merges results of tests run in shards (--shard i/N).')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    reportsParser = subparsers.add_parser('reports', help='merge reports written by ultima --report')
+    reportsParser.add_argument('reports', help='reports of shards', nargs='+', metavar='REPORT')
+    reportsParser.add_argument('--output', help='write merged report to FILE', metavar='FILE')
+    reportsParser.set_defaults(function=mergeReports)
+
+    packsParser = subparsers.add_parser('packs', help='merge archives packed by cpack --shard')
+    packsParser.add_argument('output', help='merged archive')
+    packsParser.add_argument('packs', help='archives of shards', nargs='+', metavar='PACK')
+    packsParser.set_defaults(function=mergePacks)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nKeyboardInterrupt - Exiting...")
+    except CriticalError as error:
+        print("\nCritical Error. %s Exiting." % error)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Spawner - small helper process starting programs for ultima.
+
+Peak memory of a process reported by the system includes memory of the
+process which forked it, so ultima starts programs from this process,
+which stays small. Requests come through unix socket given as argument,
+together with descriptors to use as standard input and output.
+"""
+import sys
+import os
+import select
+import signal
+import socket
+import json
+import math
+import errno
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def send(connection, message):
+    connection.send(json.dumps(message).encode())
+
+
+def limitResources(request):
+    if request.get("cpus") is not None:
+        os.sched_setaffinity(0, request["cpus"])
+    if resource is None:
+        return
+    if request.get("cpuTimeLimit") is not None:
+        seconds = int(math.ceil(request["cpuTimeLimit"]))
+        # SIGXCPU after soft limit, SIGKILL after hard one.
+        resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + 1))
+    if request.get("addressSpaceLimit") is not None:
+        limit = request["addressSpaceLimit"]
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if request.get("fileSizeLimit") is not None:
+        limit = request["fileSizeLimit"]
+        resource.setrlimit(resource.RLIMIT_FSIZE, (limit, limit))
+
+
+def spawn(request, descriptors):
+    """Returns pid of started process, or raises OSError if it could not be executed."""
+    errorReader, errorWriter = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(errorReader)
+            os.dup2(descriptors[0], 0)
+            os.dup2(descriptors[1], 1)
+            # Python ignores SIGPIPE and SIGXFSZ, ignored signals are inherited over exec.
+            for signalNumber in (signal.SIGCHLD, signal.SIGPIPE, signal.SIGXFSZ, signal.SIGINT):
+                signal.signal(signalNumber, signal.SIG_DFL)
+            limitResources(request)
+            os.execvp(request["args"][0], request["args"])
+        except BaseException as error:
+            # Child must never return into the loop of spawner, whatever failed.
+            try:
+                errorNumber = error.errno if isinstance(error, OSError) and error.errno else errno.EINVAL
+                os.write(errorWriter, str(errorNumber).encode())
+            finally:
+                os._exit(127)
+
+    os.close(errorWriter)
+    # Descriptor is closed on successful exec.
+    error = os.read(errorReader, 64)
+    os.close(errorReader)
+    if error:
+        os.waitpid(pid, 0)
+        errorNumber = int(error)
+        raise OSError(errorNumber, os.strerror(errorNumber), request["args"][0])
+    return pid
+
+
+def reapChildren(connection, running):
+    while running:
+        try:
+            pid, status, usage = os.wait4(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        running.discard(pid)
+        send(connection, {"pid": pid, "status": status, "userTime": usage.ru_utime,
+                          "systemTime": usage.ru_stime, "maxrss": usage.ru_maxrss})
+
+
+def main():
+    connection = socket.socket(fileno=int(sys.argv[1]))
+    connection.set_inheritable(False)
+    receiveFlags = getattr(socket, 'MSG_CMSG_CLOEXEC', 0)
+    wakeupReader, wakeupWriter = os.pipe()
+    os.set_blocking(wakeupReader, False)
+    os.set_blocking(wakeupWriter, False)
+    signal.set_wakeup_fd(wakeupWriter)
+    signal.signal(signal.SIGCHLD, lambda signalNumber, frame: None)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    running = set()
+    while True:
+        readable, _, _ = select.select([connection, wakeupReader], [], [])
+        if wakeupReader in readable:
+            os.read(wakeupReader, 1024)
+            reapChildren(connection, running)
+        if connection not in readable:
+            continue
+
+        data, descriptors, _, _ = socket.recv_fds(connection, 1024 * 1024, 2, receiveFlags)
+        if not data:
+            break
+        request = json.loads(data.decode())
+
+        if request["request"] == "spawn":
+            try:
+                pid = spawn(request, descriptors)
+                running.add(pid)
+                send(connection, {"id": request["id"], "pid": pid})
+            except OSError as error:
+                send(connection, {"id": request["id"], "errno": error.errno})
+            finally:
+                for descriptor in descriptors:
+                    os.close(descriptor)
+
+        elif request["request"] == "kill" and request["pid"] in running:
+            os.kill(request["pid"], signal.SIGKILL)
+
+    # Ultima exited, nobody would wait for the programs.
+    for pid in running:
+        os.kill(pid, signal.SIGKILL)
+
+
+if __name__ == "__main__":
+    main()
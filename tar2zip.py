@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
+import time
+import zlib
+import shutil
 import zipfile
 import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 if sys.version_info < (3, 0):
     print("Python version should be 3.0 or more.")
@@ -24,15 +29,107 @@ def getFileNameExtension(filename):
     return os.path.splitext(filename)[1][1:].lower()
 
 
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# Files up to this size are compressed by worker threads, larger ones are
+# copied to archive in chunks of this size.
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def getTarBaseName(filename):
+    """Returns filename without tar extension, or None if it has none."""
+    for extension in TAR_EXTENSIONS:
+        if filename.lower().endswith(extension):
+            return filename[:-len(extension)]
+    return None
+
+
+def compressData(data):
+    """Returns couple (crc, deflated data), called in worker thread."""
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    return zlib.crc32(data), compressor.compress(data) + compressor.flush()
+
+
+def newZipInfo(member):
+    info = zipfile.ZipInfo(member.name, time.localtime(time.time())[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o600 << 16
+    info.file_size = member.size
+    return info
+
+
+def writeCompressed(sink, member, compressed):
+    """Appends file compressed in advance to archive."""
+    crc, data = compressed
+    info = newZipInfo(member)
+    info.CRC = crc
+    info.compress_size = len(data)
+    info.header_offset = sink.fp.tell()
+    sink.fp.write(info.FileHeader(False))
+    sink.fp.write(data)
+    sink.start_dir = sink.fp.tell()
+    sink.filelist.append(info)
+    sink.NameToInfo[info.filename] = info
+    sink._didModify = True
+
+
+def copyMembers(source, sink, workers):
+    """
+    Copies files from tar read as stream to zip archive. Small files are
+    compressed in parallel and written in their order, large ones are
+    copied in chunks. Returns couple (number of files, their total size).
+    """
+    pool = ThreadPoolExecutor(workers)
+    pending = deque()
+    pendingSize = 0
+    numberOfFiles = 0
+    totalSize = 0
+
+    def writePending():
+        nonlocal pendingSize
+        member, work = pending.popleft()
+        writeCompressed(sink, member, work.result())
+        pendingSize -= member.size
+
+    try:
+        for member in source:
+            if not member.isfile():
+                continue
+            if member.size <= CHUNK_SIZE:
+                data = source.extractfile(member).read()
+                pending.append((member, pool.submit(compressData, data)))
+                pendingSize += member.size
+                while pendingSize > 2 * workers * CHUNK_SIZE:
+                    writePending()
+            else:
+                while pending:
+                    writePending()
+                with source.extractfile(member) as memberFile, sink.open(newZipInfo(member), 'w') as zipMemberFile:
+                    shutil.copyfileobj(memberFile, zipMemberFile, CHUNK_SIZE)
+
+            numberOfFiles += 1
+            totalSize += member.size
+            sys.stdout.write('\r%s files copied.' % numberOfFiles)
+
+        while pending:
+            writePending()
+    finally:
+        for _, work in pending:
+            work.cancel()
+        pool.shutdown()
+    return numberOfFiles, totalSize
+
+
 def main():
-    if len(sys.argv) not in range(2, 4) or not os.path.isfile(sys.argv[1]) or getFileNameExtension(sys.argv[1]) != 'tar':
+    if len(sys.argv) not in range(2, 4) or not os.path.isfile(sys.argv[1]) or getTarBaseName(sys.argv[1]) is None:
         print("Usage: tar2zip.py TAR_FILE [OUTPUT]")
+        print("TAR_FILE could be compressed, ie .tar.gz or .tar.xz")
         return
 
     source = sys.argv[1]
 
     if len(sys.argv) == 2:
-        sink = replaceExtension(source, "zip")
+        sink = getTarBaseName(source) + ".zip"
     else:
         sink = sys.argv[2]
 
@@ -48,17 +145,15 @@ def main():
         print("I will not overwrite existing file!")
         return
 
-    source = tarfile.open(source)
-    sink = zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED, True)
-
-    number_of_files = 0
-    for member in source.getmembers():
-        if member.isfile():
-            sink.writestr(member.name, source.extractfile(member).read())
-            number_of_files += 1
-            sys.stdout.write('\r%s files copied.' % number_of_files)
+    startTime = time.perf_counter()
+    # Tar is read as stream, so compressed one is decompressed on the fly.
+    with tarfile.open(source, 'r|*') as source, zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED, True) as sink:
+        number_of_files, total_size = copyMembers(source, sink, os.cpu_count() or 1)
+    seconds = time.perf_counter() - startTime
 
-    print("\nSuccessfully done. %s files packed." % number_of_files)
+    megabytes = total_size / 1024 / 1024
+    print("\nSuccessfully done. %s files packed, %.1f MB in %.1f s (%.1f MB/s)."
+          % (number_of_files, megabytes, seconds, megabytes / max(seconds, 1e-9)))
         
 if __name__ == "__main__":
     main()
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+import ultima
+
+
+class MemoryTest(ultima.Test):
+    """Test with input given as bytes and no model output."""
+    def __init__(self, testName, inputData):
+        ultima.Test.__init__(self, testName)
+        self._inputData = inputData
+
+    @property
+    def haveModelOutput(self):
+        return False
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ultima
+from helpers import MemoryTest
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "sched_getaffinity"), reason="CPU affinity is not supported")
+
+
+def test_cpu_slots_are_disjoint(monkeypatch):
+    monkeypatch.setattr(ultima.os, "sched_getaffinity", lambda pid: set(range(8)))
+    slots = ultima.CpuSlots(3, reserveCpu=True)
+    cpus = [slots.get() for _ in range(3)]
+    assert cpus == [[1, 2], [3, 4], [5, 6]]
+    with pytest.raises(ValueError):
+        ultima.CpuSlots(8, reserveCpu=True)
+
+
+def test_parallel_runs_hold_cpu_slots(tmp_path, monkeypatch):
+    """More tasks than slots, like -p larger than --cpu_affinity allows, never share CPUs."""
+    monkeypatch.setattr(ultima.os, "sched_getaffinity", lambda pid: set(range(6)))
+    program = tmp_path / "prog.py"
+    program.write_text("")
+    runner = ultima.BasicRunner(str(program))
+    runner.cpuSlots = ultima.CpuSlots(3)
+    lock = threading.Lock()
+    busy = list()
+    peak = [0]
+
+    def measure(command, test, cpus=None):
+        with lock:
+            assert not set(cpus) & set(itertools.chain.from_iterable(busy))
+            busy.append(cpus)
+            peak[0] = max(peak[0], len(busy))
+        time.sleep(0.02)
+        with lock:
+            busy.remove(cpus)
+        runResult = ultima.RunResult()
+        runResult.result = "TLE"
+        return runResult
+
+    monkeypatch.setattr(runner, "measure", measure)
+    with ThreadPoolExecutor(6) as pool:
+        results = list(pool.map(lambda number: runner.doRun(runner.programName, MemoryTest("t%s" % number, b"")),
+                                range(24)))
+    assert sorted(set(tuple(runResult.cpus) for runResult in results)) == [(0, 1), (2, 3), (4, 5)]
+    assert peak[0] <= 3
+    assert runner.cpuSlots.slots.qsize() == 3
+
+
+def test_program_runs_on_cpus_of_its_slot(tmp_path):
+    program = tmp_path / "prog.py"
+    program.write_text("import os\nprint(sorted(os.sched_getaffinity(0)))\n")
+    runner = ultima.BasicRunner(str(program))
+    runner.ignoreOutput = True
+    runner.cpuSlots = ultima.CpuSlots(1)
+    cpus = runner.cpuSlots.slots.queue[0]
+    runResult = runner.doRun(runner.programName, MemoryTest("t", b""))
+    assert runResult.cpus == cpus
+    assert runResult.outputData.decode().strip() == str(cpus)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import os
+
+import ultima
+
+
+def test_cache_returns_created_data(tmp_path):
+    cache = ultima.TestDataCache(str(tmp_path))
+    calls = list()
+
+    def create():
+        calls.append(None)
+        return b"data"
+
+    key = cache.key("in", 1)
+    assert cache.getOrCreate(key, create) == b"data"
+    assert cache.getOrCreate(key, create) == b"data"
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert ultima.TestDataCache(str(tmp_path)).size == 4
+
+
+def test_cache_keys_follow_file_contents(tmp_path):
+    generator = tmp_path / "gen.py"
+    generator.write_bytes(b"print(1)\n")
+    cache = ultima.TestDataCache(str(tmp_path / "cache"))
+    key = cache.inputKey(str(generator), 1, "")
+    assert cache.inputKey(str(generator), 1, "") == key
+    assert cache.inputKey(str(generator), 2, "") != key
+    assert cache.modelOutputKey(str(generator), b"1") != cache.modelOutputKey(str(generator), b"2")
+
+    generator.write_bytes(b"print(2)\n")
+    os.utime(str(generator), ns=(0, 0))
+    assert cache.inputKey(str(generator), 1, "") != key
+
+
+def test_cache_removes_least_recently_used_entries(tmp_path):
+    cache = ultima.TestDataCache(str(tmp_path), sizeLimit=250)
+    for number in range(3):
+        cache.put(cache.key(number), bytes(100))
+        os.utime(cache.entryPath(cache.key(number)), (number, number))
+    # Size over limit prunes cache to 9/10 of it.
+    assert cache.get(cache.key(0)) is None
+    assert cache.get(cache.key(1)) == bytes(100)
+    assert cache.get(cache.key(2)) == bytes(100)
+    assert cache.size == 200
+    assert cache.prune(0) == 2
+    assert cache.size == 0
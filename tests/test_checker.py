@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import os
+
+import ultima
+
+# Logs its import and each check with id of process.
+CHECKER = """import os
+LOG = %r
+with open(LOG, "a") as log:
+    log.write("import %%s\\n" %% os.getpid())
+
+def check(inS, outS, modelS):
+    with open(LOG, "a") as log:
+        log.write("check %%s\\n" %% os.getpid())
+    return "OK" if outS.read() == modelS.read() else "WA"
+"""
+
+
+def test_checker_pool_imports_checker_once_per_process(tmp_path, monkeypatch):
+    log = tmp_path / "checker.log"
+    (tmp_path / "logchecker.py").write_text(CHECKER % str(log))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    tests = list()
+    for number in range(6):
+        inputPath, outputPath = tmp_path / ("t%d.in" % number), tmp_path / ("t%d.out" % number)
+        inputPath.write_bytes(b"%d\n" % number)
+        outputPath.write_bytes(b"%d\n" % number)
+        tests.append(ultima.TestFromFolder(str(inputPath), str(outputPath)))
+
+    pool = ultima.CheckerPool("logchecker", 2)
+    try:
+        results = list()
+        for number, test in enumerate(tests):
+            runResult = ultima.RunResult()
+            runResult.output.write(b"%d\n" % (number if number != 4 else 5))
+            results.append(pool.fullResultCheck(test, runResult))
+            runResult.output.close()
+    finally:
+        pool.shutdown()
+
+    assert [correct for correct, _ in results] == [True, True, True, True, False, True]
+    assert results[4][1] == "WA"
+    entries = [line.split() for line in log.read_text().splitlines()]
+    imports = [pid for event, pid in entries if event == "import"]
+    checks = [pid for event, pid in entries if event == "check"]
+    assert len(checks) == len(tests)
+    # Each worker imported module once and checked tests after it, module is not imported per test.
+    assert len(imports) == len(set(imports)) <= 2
+    assert set(checks) <= set(imports)
+    assert str(os.getpid()) not in imports
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import argparse
+import io
+import socket
+import threading
+import time
+
+import pytest
+
+import ultima
+import worker
+
+from helpers import MemoryTest
+
+
+def test_channel_streams_compressed_data():
+    left, right = socket.socketpair()
+    sender, receiver = ultima.Channel(left), ultima.Channel(right)
+    data = b"0123456789" * 500000
+    thread = threading.Thread(target=sender.send, args=({"type": "test", "name": "a"}, io.BytesIO(data)))
+    thread.start()
+    sink = io.BytesIO()
+    message = receiver.receive(sink)
+    thread.join()
+    assert message["name"] == "a"
+    assert sink.getvalue() == data
+
+    sender.close()
+    with pytest.raises(ConnectionError):
+        receiver.receive()
+    receiver.close()
+
+
+def test_parse_address():
+    assert ultima.parseAddress("4000") == ("", 4000)
+    assert ultima.parseAddress("example.com:4000") == ("example.com", 4000)
+    with pytest.raises(argparse.ArgumentTypeError):
+        ultima.parseAddress("example.com")
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    program = tmp_path / "reverse.py"
+    program.write_text("import sys\nsys.stdout.buffer.write(sys.stdin.buffer.read()[::-1])\n")
+    runner = ultima.BasicRunner(str(program))
+    cluster = ultima.Cluster(("", 0), runner)
+    yield cluster
+    cluster.close()
+
+
+def test_cluster_listens_only_locally_by_default(cluster):
+    assert cluster.address[0] == "127.0.0.1"
+
+
+def test_cluster_runs_tests_on_worker(cluster):
+    programs = worker.ProgramStore()
+    args = argparse.Namespace(retry=5, verbose=False)
+    slot = threading.Thread(target=worker.runSlot, args=(cluster.address, programs, args), daemon=True)
+    slot.start()
+    try:
+        for number in range(3):
+            runResult = cluster.measure(MemoryTest("t%s" % number, b"input %d" % number))
+            assert runResult.result is None
+            assert runResult.returnCode == 0
+            assert runResult.outputData == b"%d tupni" % number
+    finally:
+        cluster.close()
+        slot.join(10)
+        programs.remove()
+    assert not slot.is_alive()
+
+
+def waitFor(condition):
+    deadline = time.monotonic() + 10
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("lostBy", ["disconnect", "timeout"])
+def test_cluster_runs_again_test_of_lost_worker(cluster, lostBy):
+    if lostBy == "timeout":
+        cluster.replyTimeout = 0.5
+    lost = socket.create_connection(cluster.address)
+    lostChannel = ultima.Channel(lost)
+    lostChannel.receive()
+    lostChannel.send({"type": "ready"})
+    waitFor(lambda: cluster.slots == 1)
+
+    results = []
+    measure = threading.Thread(target=lambda: results.append(cluster.measure(MemoryTest("t", b"input"))))
+    measure.start()
+    assert lostChannel.receive(io.BytesIO())["name"] == "t"
+
+    programs = worker.ProgramStore()
+    args = argparse.Namespace(retry=5, verbose=False)
+    slot = threading.Thread(target=worker.runSlot, args=(cluster.address, programs, args), daemon=True)
+    slot.start()
+    try:
+        if lostBy == "disconnect":
+            # Test is not run again while its worker is connected, even if idle slot waits.
+            waitFor(lambda: cluster.slots == 2)
+            measure.join(1.5)
+            assert not results
+            lostChannel.close()
+        measure.join(30)
+        assert not measure.is_alive()
+        assert results[0].outputData == b"tupni"
+    finally:
+        cluster.close()
+        slot.join(10)
+        programs.remove()
+        lostChannel.close()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import io
+import random
+import re
+
+import pytest
+
+import ultima
+
+
+def compare(compared, model, chunkSize=1024 * 1024):
+    return ultima.compareOutputs(io.BytesIO(compared), io.BytesIO(model), chunkSize)
+
+
+@pytest.mark.parametrize("chunkSize", [1, 3, 1024])
+def test_whitespace_is_ignored(chunkSize):
+    assert compare(b"1 2\r\n3\t4  \n\n", b"1 2\n3 4\n", chunkSize) is None
+    assert compare(b"", b"\n", chunkSize) is None
+
+
+@pytest.mark.parametrize("chunkSize", [1, 3, 1024])
+def test_first_different_line_is_reported(chunkSize):
+    message, line = compare(b"1\n2\n3 4\n5\n", b"1\n2\n3 5\n5\n", chunkSize)
+    assert line == 3
+    assert "read 4 expected 5" in message
+
+
+def test_missing_output_is_different():
+    assert compare(b"1\n", b"1\n2\n") is not None
+    assert compare(b"1\n2\n", b"1\n") is not None
+
+
+@pytest.mark.parametrize("chunkSize", [1, 3, 1024])
+def test_output_past_end_of_model_output_is_reported(chunkSize):
+    assert compare(b"1\n\n2\n", b"1\n", chunkSize) == ("Line 3: read 2, model output ends at line 1", 3)
+    assert compare(b"1\n2 3\n", b"1", chunkSize) == ("Line 2: read 2, model output ends at line 1", 2)
+
+
+@pytest.mark.parametrize("chunkSize", [1, 3, 1024])
+def test_missing_output_past_its_end_is_reported(chunkSize):
+    assert compare(b"1\n", b"1\n\n2\n", chunkSize) == ("Line 3: end of output, expected 2", 3)
+    assert compare(b"", b"\n\n 7 8\n", chunkSize) == ("Line 3: end of output, expected 7", 3)
+
+
+def referenceDifference(compared, model):
+    """Returns first line with different tokens, empty lines at the end don't count."""
+    comparedLines = [line.split() for line in compared.split(b"\n")]
+    modelLines = [line.split() for line in model.split(b"\n")]
+    length = max(len(comparedLines), len(modelLines))
+    comparedLines += [[]] * (length - len(comparedLines))
+    modelLines += [[]] * (length - len(modelLines))
+    for line, (comparedTokens, modelTokens) in enumerate(zip(comparedLines, modelLines), 1):
+        if comparedTokens != modelTokens:
+            return line
+    return None
+
+
+def test_random_outputs_are_compared_by_tokens_of_lines():
+    random.seed(0)
+    pieces = [b"1", b"2", b"12", b" ", b"  ", b"\t", b"\n", b"\r\n", b" \n", b"\x00"]
+    for _ in range(3000):
+        model = b"".join(random.choice(pieces) for _ in range(random.randint(0, 12)))
+        compared = b"".join(random.choice(pieces) if random.random() < 0.1 else piece
+                            for piece in re.split(b"(\n)", model))
+        for chunkSize in (1, 2, 5, 1024):
+            result = compare(compared, model, chunkSize)
+            assert (result and result[1]) == referenceDifference(compared, model)
+            assert result is None or result[0]
+
+
+def test_file_streams_are_compared(tmp_path):
+    compared = tmp_path / "a.out"
+    model = tmp_path / "b.out"
+    compared.write_bytes(b"1 2 3\n" * 100000)
+    model.write_bytes(b"1 2 3\n" * 99999 + b"1 2 4\n")
+    with open(compared, "rb") as comparedStream, open(model, "rb") as modelStream:
+        _, line = ultima.compareOutputs(comparedStream, modelStream)
+    assert line == 100000
+
+
+def compareFloats(compared, model, absoluteEps=0.0, relativeEps=0.0):
+    return ultima.compareFloatOutputs(io.BytesIO(compared), io.BytesIO(model), absoluteEps, relativeEps)
+
+
+def test_float_outputs_within_eps_are_equal():
+    assert compareFloats(b"1.0001 2\n", b"1.0 2\n", absoluteEps=1e-3) is None
+    assert compareFloats(b"1000.5\n", b"1000\n", relativeEps=1e-3) is None
+    assert compareFloats(b"1 2\n3\n", b"1\n2 3\n") is None
+
+
+def test_float_outputs_over_eps_are_different():
+    assert compareFloats(b"1.01\n", b"1.0\n", absoluteEps=1e-3) is not None
+    assert compareFloats(b"abc\n", b"abd\n", absoluteEps=1.0) is not None
+    assert compareFloats(b"nan\n", b"1\n", absoluteEps=1.0) is not None
+    assert compareFloats(b"1\n", b"1 2\n") is not None
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import argparse
+import os
+import zipfile
+
+import pytest
+
+import cpack
+
+
+def packArgs(program, output, **options):
+    args = dict(program=program, output=output, threads=1, pipeline=None, compression="deflate", level=None,
+                break_after_error=True)
+    args.update(options)
+    return argparse.Namespace(**args)
+
+
+@pytest.fixture
+def package(tmp_path):
+    filename = str(tmp_path / "pk.zip")
+    with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as zipFile:
+        for number in range(10):
+            zipFile.writestr("in/pk%s.in" % number, "%s\n" % number)
+            zipFile.writestr("out/pk%s.out" % number, "old %s\n" % number)
+        zipFile.writestr("README", "package")
+    return filename
+
+
+@pytest.fixture
+def model(tmp_path):
+    path = tmp_path / "model.py"
+    path.write_text("import sys\nn = int(input())\nif n == 7: sys.exit(1)\nprint('new', n)\n")
+    return str(path)
+
+
+def test_rebuild_outputs_keeps_old_output_of_failed_test(package, model, capsys):
+    cpack.rebuild_outputs(packArgs(model, package))
+    with zipfile.ZipFile(package) as zipFile:
+        assert len(zipFile.namelist()) == 21
+        assert zipFile.read("README") == b"package"
+        assert zipFile.read("in/pk3.in") == b"3\n"
+        assert zipFile.read("out/pk3.out") == b"new 3\n"
+        assert zipFile.read("out/pk7.out") == b"old 7\n"
+    assert "old outputs are kept: pk7" in capsys.readouterr().out
+
+
+def test_manifest_recovers_archive_of_interrupted_build(tmp_path):
+    filename = str(tmp_path / "pack.zip")
+    zipFile, manifest = cpack.open_archive(filename)
+    entries = [cpack.CompressedEntry("in/a%s.in" % number, zipfile.ZIP_DEFLATED, data=b"%d" % number)
+               for number in range(3)]
+    infos = [entry.append_to(zipFile) for entry in entries]
+    zipFile.fp.flush()
+    manifest.record(infos, zipFile.start_dir)
+    # Archive is left without central directory, like after kill.
+    zipFile.fp.close()
+    zipFile.fp = None
+    manifest.file.close()
+
+    zipFile, manifest = cpack.open_archive(filename)
+    assert sorted(zipFile.namelist()) == ["in/a0.in", "in/a1.in", "in/a2.in"]
+    assert zipFile.read("in/a1.in") == b"1"
+    zipFile.close()
+    manifest.close()
+    assert not manifest.exists()
+
+
+def test_manifest_without_entries_keeps_archive(package):
+    size = os.path.getsize(package)
+    open(cpack.Manifest(package).filename, "w").close()
+
+    zipFile, manifest = cpack.open_archive(package)
+    assert len(zipFile.namelist()) == 21
+    zipFile.close()
+    manifest.close()
+    assert os.path.getsize(package) == size
+
+
+def test_manifest_without_entries_does_not_recover_broken_archive(tmp_path):
+    filename = str(tmp_path / "pack.zip")
+    with open(filename, "wb") as archive:
+        archive.write(b"PK\x03\x04 data of file without central directory")
+    with open(cpack.Manifest(filename).filename, "w") as manifestFile:
+        manifestFile.write('{"filename": "in/a0.in", "date_')
+
+    with pytest.raises(cpack.CriticalError):
+        cpack.open_archive(filename)
+    assert os.path.getsize(filename) > 0
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import weakref
+
+import pytest
+
+import ultima
+
+
+class RecordingFunctor(ultima.Functor):
+    """Sleeps element / 100 seconds in work, stops after stopAfter finished elements."""
+    def __init__(self, stopAfter=None):
+        ultima.Functor.__init__(self)
+        self.stopAfter = stopAfter
+        self.lock = threading.Lock()
+        self.started = list()
+        self.finished = list()
+
+    def work(self, element):
+        with self.lock:
+            self.started.append(element)
+        time.sleep(element / 100.0)
+        return element * 2
+
+    def finish(self, element, result):
+        assert result == element * 2
+        self.finished.append(element)
+
+    def is_good(self):
+        return self.stopAfter is None or len(self.finished) < self.stopAfter
+
+
+ELEMENTS = [1, 5, 2, 4, 3, 1, 2]
+
+
+def test_sequential_executor_keeps_order():
+    functor = RecordingFunctor()
+    ultima.SequentialExecutor(functor, ELEMENTS).process()
+    assert functor.finished == ELEMENTS
+
+
+def test_parallel_executor_finishes_in_order():
+    functor = RecordingFunctor()
+    ultima.ParallelExecutor(functor, iter(ELEMENTS), 3).process()
+    assert functor.finished == ELEMENTS
+
+
+def test_scheduled_executor_starts_costly_first_and_finishes_in_order():
+    functor = RecordingFunctor()
+    ultima.ScheduledExecutor(functor, iter(ELEMENTS), lambda elements: [float(element) for element in elements],
+                             2).process()
+    assert sorted(functor.started[:2]) == [4, 5]
+    assert functor.finished == ELEMENTS
+
+
+def test_scheduled_executor_stops_when_functor_stops():
+    elements = list(range(1, 21))
+    functor = RecordingFunctor(stopAfter=2)
+    ultima.ScheduledExecutor(functor, elements, lambda elements: [0.0] * len(elements), 2).process()
+    assert functor.finished == [1, 2]
+    # Elements already running when functor stopped are dropped, no new ones are started.
+    assert len(functor.started) <= 4
+
+
+def test_scheduled_executor_runs_only_limited_elements():
+    functor = RecordingFunctor()
+    executor = ultima.ScheduledExecutor(functor, iter(ELEMENTS), lambda elements: elements, 2, limit=4)
+    executor.process()
+    assert functor.finished == ELEMENTS[:4]
+    assert sorted(functor.started) == sorted(ELEMENTS[:4])
+    assert executor.limited
+
+    executor = ultima.ScheduledExecutor(RecordingFunctor(), iter(ELEMENTS), lambda elements: elements, 2, limit=7)
+    executor.process()
+    assert not executor.limited
+
+
+class Element:
+    def __init__(self, number):
+        self.number = number
+        self.data = bytes(1000)
+
+
+class ReleaseCheckingFunctor(ultima.Functor):
+    """Checks that elements finished before are no longer referenced, except last few scheduled ones."""
+    def __init__(self):
+        ultima.Functor.__init__(self)
+        self.finishedElements = list()
+
+    def work(self, element):
+        return element.number
+
+    def finish(self, element, result):
+        assert sum(reference() is not None for reference in self.finishedElements) <= 2
+        self.finishedElements.append(weakref.ref(element))
+
+
+def test_scheduled_executor_releases_finished_elements():
+    functor = ReleaseCheckingFunctor()
+    elements = (Element(number) for number in range(20))
+    ultima.ScheduledExecutor(functor, elements, lambda elements: [element.number for element in elements],
+                             3).process()
+    assert len(functor.finishedElements) == 20
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_prefetch_keeps_order_and_calls_function(workers):
+    prepared = list()
+    result = list(ultima.prefetch(ELEMENTS, prepared.append, workers, 2))
+    assert result == ELEMENTS
+    assert sorted(prepared) == sorted(ELEMENTS)
+
+
+def test_prefetch_raises_error_of_function():
+    def prepare(element):
+        if element == 3:
+            raise ValueError(element)
+
+    with pytest.raises(ValueError):
+        list(ultima.prefetch(ELEMENTS, prepare, 2, 2))
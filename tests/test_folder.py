@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import os
+
+import ultima
+
+
+def writeFiles(folder, files):
+    for name, data in files.items():
+        path = os.path.join(folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fileHandle:
+            fileHandle.write(data)
+
+
+def relativeTests(folder, tests):
+    return [(os.path.relpath(inFile, folder), modelOutFile and os.path.relpath(modelOutFile, folder))
+            for inFile, modelOutFile in tests]
+
+
+def test_folder_tests_are_paired_and_sorted(tmp_path):
+    folder = str(tmp_path)
+    writeFiles(folder, {"abc10.in": b"", "abc10.out": b"", "abc2.in": b"", "abc0ocen.in": b"",
+                        "abc0ocen.out": b"", "in/abc1.in": b"", "out/abc1.out": b"", ".in": b"", "abc.txt": b""})
+    tests = ultima.findFolderTests(folder, ultima.scanFolderTree(folder)[0])
+    assert relativeTests(folder, tests) == [
+        ("abc0ocen.in", "abc0ocen.out"), ("in/abc1.in", "out/abc1.out"),
+        ("abc2.in", None), ("abc10.in", "abc10.out")]
+
+
+def test_unchanged_tree_is_not_read_again(tmp_path):
+    folder = str(tmp_path)
+    writeFiles(folder, {"a/1.in": b"", "b/2.in": b""})
+    listings, changed = ultima.scanFolderTree(folder)
+    assert changed
+    assert set(listings) == {"", "a", "b"}
+    # Listings made after all modifications are trusted.
+    assert ultima.scanFolderTree(folder, listings, trustedBefore=2 ** 63) == (listings, False)
+
+    os.remove(os.path.join(folder, "b", "2.in"))
+    os.rmdir(os.path.join(folder, "b"))
+    listings, changed = ultima.scanFolderTree(folder, listings, trustedBefore=2 ** 63)
+    assert changed
+    assert set(listings) == {"", "a"}
+
+
+def test_folder_index_follows_changes(tmp_path):
+    folder = str(tmp_path / "tests")
+    indexFolder = str(tmp_path / "index")
+    writeFiles(folder, {"t1.in": b"", "t1.out": b""})
+    index = ultima.FolderIndex(folder, indexFolder)
+    assert relativeTests(folder, index.getTests()) == [("t1.in", "t1.out")]
+    assert os.path.isfile(index.filename)
+    assert relativeTests(folder, index.getTests()) == [("t1.in", "t1.out")]
+
+    writeFiles(folder, {"sub/t2.in": b""})
+    assert relativeTests(folder, ultima.FolderIndex(folder, indexFolder).getTests()) == [
+        ("t1.in", "t1.out"), ("sub/t2.in", None)]
+
+
+def test_broken_folder_index_is_rebuilt(tmp_path):
+    folder = str(tmp_path / "tests")
+    writeFiles(folder, {"t1.in": b""})
+    index = ultima.FolderIndex(folder, str(tmp_path / "index"))
+    os.makedirs(os.path.dirname(index.filename))
+    with open(index.filename, "w") as indexFile:
+        indexFile.write("{broken")
+    assert relativeTests(folder, index.getTests()) == [("t1.in", None)]
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+import ultima
+
+
+def test_sign_test_p_value_of_small_runs():
+    assert ultima.RunHistory.signTestPValue(0, 0) == 1.0
+    assert ultima.RunHistory.signTestPValue(3, 0) == pytest.approx(0.125)
+    assert ultima.RunHistory.signTestPValue(2, 2) == pytest.approx(11 / 16.0)
+
+
+@pytest.mark.parametrize("tests", [1100, 2000, 5000])
+def test_sign_test_p_value_of_large_runs(tests):
+    assert ultima.RunHistory.signTestPValue(tests // 2, tests - tests // 2) == pytest.approx(0.5, abs=0.02)
+    assert ultima.RunHistory.signTestPValue(tests, 0) == 0.0
+    assert ultima.RunHistory.signTestPValue(0, tests) == 1.0
+
+
+def runResult(cpuTime):
+    result = ultima.RunResult()
+    result.result = "OK"
+    result.processTime = cpuTime
+    result.wallTime = cpuTime
+    return result
+
+
+def test_compare_runs_of_large_package(tmp_path):
+    program = tmp_path / "program.py"
+    program.write_text("print(1)\n")
+    history = ultima.RunHistory(str(tmp_path / "history.sqlite"))
+    baselineId = history.startRun(str(program))
+    for number in range(1200):
+        history.addResult("t%s" % number, "hash", runResult(1.0))
+    runId = history.startRun(str(program))
+    for number in range(1200):
+        history.addResult("t%s" % number, "hash", runResult(2.0 if number == 0 else 1.5))
+
+    slowdowns, summary = history.compare(runId, baselineId)
+    assert len(slowdowns) == 1200
+    assert slowdowns[0] == ("t0", 1.0, 2.0)
+    assert summary["compared"] == 1200
+    assert summary["slower"] == 1200
+    assert summary["pValue"] == 0.0
+
+
+def test_repeated_runs_are_saved_once_per_test(tmp_path):
+    program = tmp_path / "program.py"
+    program.write_text("print(1)\n")
+    history = ultima.RunHistory(str(tmp_path / "history.sqlite"))
+    baselineId = history.startRun(str(program))
+    for number in range(20):
+        history.addResult("t%s" % number, "hash", runResult(1.0))
+    runId = history.startRun(str(program))
+    for number in range(20):
+        result = runResult(3.0)
+        result.cpuTimes = [3.0, 1.0, 2.0]
+        if number % 5 == 0:
+            result.result = "WA"
+        history.addResult("t%s" % number, "hash", result)
+
+    run = history.runs(1)[0]
+    assert run[0] == runId
+    assert run[4:] == (20, 4, pytest.approx(40.0))
+    samples = history.samples(runId)
+    assert len(samples) == 16
+    assert samples["t1", "hash"] == [3.0, 1.0, 2.0]
+    slowdowns, summary = history.compare(runId, baselineId)
+    assert summary["compared"] == 16
+    # Median of repeated times is compared with baseline time.
+    assert slowdowns[0] == ("t1", 1.0, 2.0)
+
+
+def test_history_without_repeated_times_is_upgraded(tmp_path):
+    filename = str(tmp_path / "history.sqlite")
+    connection = sqlite3.connect(filename)
+    connection.execute("CREATE TABLE results (run INTEGER, test TEXT, inputHash TEXT, verdict TEXT, "
+                       "cpuTime REAL, wallTime REAL, peakMemory INTEGER)")
+    connection.execute("INSERT INTO results VALUES (1, 't1', 'hash', 'OK', 1.0, 1.0, 0)")
+    connection.commit()
+    connection.close()
+
+    history = ultima.RunHistory(filename)
+    history.runId = 1
+    result = runResult(2.0)
+    result.cpuTimes = [2.0, 2.5]
+    history.addResult("t2", "hash", result)
+    assert history.samples(1) == {("t1", "hash"): [1.0], ("t2", "hash"): [2.0, 2.5]}
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+import ultima
+
+from helpers import MemoryTest
+
+
+@pytest.fixture
+def echoProgram(tmp_path):
+    path = tmp_path / "echo.py"
+    path.write_text("import sys\nsys.stdout.buffer.write(sys.stdin.buffer.read())\n")
+    return str(path)
+
+
+def test_output_buffer_keeps_small_output_in_memory():
+    output = ultima.OutputBuffer(spillSize=10)
+    output.write(b"12345")
+    assert not output.spilled
+    assert output.getvalue() == b"12345"
+    output.close()
+
+
+def test_output_buffer_spills_large_output_to_file():
+    output = ultima.OutputBuffer(spillSize=10)
+    output.write(b"12345")
+    output.write(b"678901")
+    assert output.spilled
+    filename = output.outputFile()
+    with output.openStream() as stream:
+        assert stream.read() == b"12345678901"
+    output.close()
+    assert not os.path.exists(filename)
+
+
+def test_output_buffer_limit():
+    output = ultima.OutputBuffer(sizeLimit=4)
+    with pytest.raises(ultima.OutputLimitExceeded):
+        output.write(b"123456")
+    assert output.overflow
+    assert output.getvalue() == b"1234"
+
+
+def test_small_output_of_program_is_not_spilled(echoProgram):
+    runner = ultima.BasicRunner(echoProgram)
+    runResult = runner.runProcess(echoProgram, MemoryTest("memory0", b"ab"))
+    assert runResult.outputData == b"ab"
+    assert not runResult.output.spilled
+
+
+def test_program_writes_directly_after_large_output(echoProgram):
+    runner = ultima.BasicRunner(echoProgram)
+    runner.outputSpillSize = 4
+    runResult = runner.runProcess(echoProgram, MemoryTest("memory0", b"large output"))
+    assert runResult.outputData == b"large output"
+    assert runner.largeOutputs
+    runResult = runner.runProcess(echoProgram, MemoryTest("memory0", b"ab"))
+    assert runResult.output.spilled
+    assert runResult.outputData == b"ab"
+
+
+def test_direct_output_could_be_disabled(echoProgram):
+    runner = ultima.BasicRunner(echoProgram)
+    runner.outputSpillSize = 4
+    runner.directOutput = False
+    runner.runProcess(echoProgram, MemoryTest("memory0", b"large output"))
+    runResult = runner.runProcess(echoProgram, MemoryTest("memory0", b"ab"))
+    assert not runResult.output.spilled
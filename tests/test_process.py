@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import io
+import sys
+import threading
+
+import pytest
+
+import ultima
+
+
+@pytest.fixture(params=[True, False], ids=["multiplexer", "threads"])
+def popenFallback(request, monkeypatch):
+    monkeypatch.setattr(ultima, "useSpawner", False)
+    monkeypatch.setattr(ultima, "useMultiplexer", request.param)
+
+
+def test_killed_process_is_reaped_with_resource_usage(popenFallback):
+    command = (sys.executable, "-c", "while True: pass")
+    processResult = ultima.callProcess(command, io.BytesIO(b""), io.BytesIO(), timeLimit=0.5)
+    assert processResult.timedOut
+    assert processResult.returnCode < 0
+    assert processResult.userTime is not None
+    assert processResult.peakMemory > 0
+
+
+def test_output_and_return_code(popenFallback):
+    command = (sys.executable, "-c", "import sys; sys.stdout.write(sys.stdin.read()[::-1]); sys.exit(3)")
+    output = io.BytesIO()
+    processResult = ultima.callProcess(command, io.BytesIO(b"abc"), output, timeLimit=10)
+    assert output.getvalue() == b"cba"
+    assert processResult.returnCode == 3
+    assert not processResult.timedOut
+
+
+def test_process_is_killed_without_waitid(popenFallback, monkeypatch, tmp_path):
+    # Without os.waitid process is polled by os.wait4, kill must not wait for it.
+    monkeypatch.delattr(ultima.os, "waitid", raising=False)
+    results = list()
+    with open(str(tmp_path / "in"), "w+b") as inputFile, open(str(tmp_path / "out"), "w+b") as outputFile:
+        command = (sys.executable, "-c", "while True: pass")
+        thread = threading.Thread(target=lambda: results.append(
+            ultima.callProcess(command, inputFile, outputFile, timeLimit=0.5)), daemon=True)
+        thread.start()
+        thread.join(30)
+    assert not thread.is_alive()
+    assert results[0].timedOut
+    assert results[0].userTime is not None
+
+
+def test_finished_process_is_reaped_without_waitid(popenFallback, monkeypatch):
+    monkeypatch.delattr(ultima.os, "waitid", raising=False)
+    command = (sys.executable, "-c", "import sys; sys.exit(5)")
+    processResult = ultima.callProcess(command, io.BytesIO(b""), io.BytesIO(), timeLimit=10)
+    assert processResult.returnCode == 5
+    assert not processResult.timedOut
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import collections
+import json
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+import ultima
+
+ULTIMA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ultima.py")
+
+# Adds numbers in each line; tests with earlier numbers take longer, so they finish last.
+PROGRAM = """import sys, time
+lines = sys.stdin.read().split("\\n")
+time.sleep(0.02 * (8 - int(lines[0])))
+for line in lines[1:]:
+    if line.split():
+        print(sum(map(int, line.split())) + (1 if int(lines[0]) in (3, 6) else 0))
+"""
+
+
+@pytest.fixture
+def problem(tmp_path):
+    program = tmp_path / "prog.py"
+    program.write_text(PROGRAM)
+    folder = tmp_path / "tests"
+    folder.mkdir()
+    for number in range(8):
+        (folder / ("abc%d.in" % number)).write_text("%d\n1 2\n3 4\n" % number)
+        (folder / ("abc%d.out" % number)).write_text("3\n7\n")
+    return tmp_path
+
+
+def runUltima(problem, *args):
+    process = subprocess.run([sys.executable, ULTIMA, str(problem / "prog.py"), "-f", str(problem / "tests")]
+                             + list(args), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                             universal_newlines=True, timeout=60)
+    return process.stdout
+
+
+def verdicts(output):
+    return re.findall(r"^(abc\d+) ([A-Z]+)", output, re.MULTILINE)
+
+
+def test_parallel_results_are_reported_in_order(problem):
+    sequential = runUltima(problem)
+    output = runUltima(problem, "-p", "4")
+    expected = [("abc%d" % number, "WA" if number in (3, 6) else "OK") for number in range(8)]
+    assert verdicts(output) == verdicts(sequential) == expected
+    assert "Failures: 2" in output
+
+
+@pytest.mark.parametrize("threads", ["1", "3"])
+def test_testing_stops_after_failures(problem, threads):
+    output = runUltima(problem, "-p", threads, "-b", "1")
+    assert [name for name, _ in verdicts(output)] == ["abc0", "abc1", "abc2", "abc3"]
+
+
+def readReport(problem, *args):
+    """Returns couple (test records, summary record) of report written by run with args."""
+    report = str(problem / "report.jsonl")
+    runUltima(problem, "--report", report, *args)
+    with open(report) as reportFile:
+        records = [json.loads(line) for line in reportFile]
+    return records[:-1], records[-1]
+
+
+def test_report_lists_tests_in_order(problem):
+    tests, summary = readReport(problem, "-p", "4")
+    assert [(test["name"], test["verdict"]) for test in tests] == verdicts(runUltima(problem))
+    assert tests[3]["message"] == "Line 1: read 4 expected 3"
+    assert (summary["type"], summary["total"], summary["failures"]) == ("summary", 8, 2)
+    assert (summary["stopped"], summary["completed"]) == (False, True)
+
+
+def test_repeated_runs_are_reported(problem):
+    tests, _ = readReport(problem, "-n", "2", "--repeat", "3", "--warmup", "1")
+    assert [test["name"] for test in tests] == ["abc0", "abc1"]
+    assert [len(test["cpuTimes"]) for test in tests] == [3, 3]
+
+
+def test_repeated_runs_are_saved_in_history_once(problem):
+    filename = str(problem / "history.sqlite")
+    runUltima(problem, "--repeat", "3", "--history", filename)
+    runs = ultima.RunHistory(filename).runs()
+    assert [run[4:6] for run in runs] == [(8, 2)]
+
+
+@pytest.mark.parametrize("args", [("-p", "3", "--pipeline", "2"), ("-p", "3"), ("--pipeline", "4")])
+def test_tests_over_limit_are_not_generated(tmp_path, args):
+    generator = tmp_path / "gen.py"
+    generator.write_text("import sys\nopen(%r, 'a').write('1')\nprint(sys.stdin.read().strip() or 0)\n"
+                         % str(tmp_path / "generated"))
+    model = tmp_path / "model.py"
+    model.write_text("import sys\nopen(%r, 'a').write('1')\nprint(sys.stdin.read())\n" % str(tmp_path / "solved"))
+    process = subprocess.run([sys.executable, ULTIMA, str(model), "-g", str(generator), str(model), "-n", "5"]
+                             + list(args), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                             universal_newlines=True, timeout=60)
+    assert len(verdicts(process.stdout.replace(str(tmp_path / "model"), "abc"))) == 5
+    assert (tmp_path / "generated").read_text() == "1" * 5
+    # Model solution is also the tested program.
+    assert (tmp_path / "solved").read_text() == "1" * 10
+
+
+def profiledCalls(output):
+    """Returns dictionary of calls of phases in --profile report."""
+    return dict((name, int(calls)) for name, calls in re.findall(r"^  ([a-z ]+?) +[\d.]+ +(\d+) +[\d.]+$",
+                                                                   output, re.MULTILINE))
+
+
+@pytest.mark.parametrize("args", [(), ("-p", "3"), ("--repeat", "2", "--warmup", "1")])
+def test_profile_counts_calls_of_phases(problem, args):
+    program = problem / "prog.py"
+    program.write_text("open(%r, 'a').write('1')\n" % str(problem / "runs") + program.read_text())
+    trace = str(problem / "trace.json")
+    calls = profiledCalls(runUltima(problem, "--profile_trace", trace, *args))
+    runs = len((problem / "runs").read_text())
+    assert runs == 8 * (3 if "--repeat" in args else 1)
+    assert (calls["program"], calls["check"], calls["test discovery"]) == (runs, 8, 1)
+    with open(trace) as traceFile:
+        events = [event for event in json.load(traceFile)["traceEvents"] if event["ph"] == "X"]
+    assert sorted(calls.items()) == sorted(collections.Counter(event["name"] for event in events).items())
+
+
+CRASHING_GENERATOR = """import os, sys
+count = %r
+number = os.path.getsize(count) if os.path.exists(count) else 0
+open(count, "a").write("1")
+if number == 2:
+    sys.exit(3)
+print(number)
+"""
+
+
+@pytest.mark.parametrize("args", [("--pipeline", "2"), ("-p", "2", "--pipeline", "2")])
+def test_generator_crash_in_pipeline_stops_testing(tmp_path, args):
+    generator = tmp_path / "gen.py"
+    # Third call of generator crashes.
+    generator.write_text(CRASHING_GENERATOR % str(tmp_path / "generated"))
+    model = tmp_path / "model.py"
+    model.write_text("print(input())\n")
+    process = subprocess.run([sys.executable, ULTIMA, str(model), "-g", str(generator), str(model), "-n", "8"]
+                             + list(args), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                             universal_newlines=True, timeout=60)
+    assert "Critical Error. Input generator crash." in process.stdout
+    assert verdicts(process.stdout.replace(str(tmp_path / "model"), "abc")) == [("abc1", "OK"), ("abc2", "OK")]
+    # Stage stops taking tests after crash, only tests already prepared at once with it were generated.
+    assert 3 <= os.path.getsize(str(tmp_path / "generated")) <= 4
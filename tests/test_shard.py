@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import zipfile
+
+import pytest
+
+import cpack
+import merge
+import ultima
+
+
+class NamedTest(ultima.Test):
+    def __init__(self, testName):
+        ultima.Test.__init__(self, testName)
+
+
+def test_parse_shard():
+    assert ultima.parseShard("2/5") == (2, 5)
+    for text in ("0/5", "6/5", "1/0", "a/b", "3"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            ultima.parseShard(text)
+
+
+def test_shards_partition_tests():
+    names = ["abc%s" % number for number in range(200)]
+    shards = [[test.testName for test in ultima.shardTests(map(NamedTest, names), (index, 3))]
+              for index in (1, 2, 3)]
+    assert sorted(sum(shards, [])) == sorted(names)
+    assert all(shard for shard in shards)
+    # Partition depends only on names, not on order of tests.
+    again = [test.testName for test in ultima.shardTests(map(NamedTest, reversed(names)), (2, 3))]
+    assert sorted(again) == sorted(shards[1])
+
+
+def writeReport(filename, tests, shard):
+    with open(filename, "w") as report:
+        for name, verdict in tests:
+            report.write(json.dumps({"type": "test", "name": name, "verdict": verdict, "message": None}) + "\n")
+        failures = sum(verdict != "OK" for _, verdict in tests)
+        report.write(json.dumps({"type": "summary", "total": len(tests), "ignored": 0, "failures": failures,
+                                 "stopped": False, "completed": True, "shard": shard}) + "\n")
+
+
+def test_merge_reports(tmp_path, capsys):
+    first, second, merged = (str(tmp_path / name) for name in ("1.jsonl", "2.jsonl", "merged.jsonl"))
+    writeReport(first, [("abc2", "OK"), ("abc10", "WA")], "1/2")
+    writeReport(second, [("abc0ocen", "OK"), ("abc3", "OK")], "2/2")
+    merge.mergeReports(argparse.Namespace(reports=[first, second], output=merged))
+
+    records = [json.loads(line) for line in open(merged)]
+    assert [record["name"] for record in records[:-1]] == ["abc0ocen", "abc2", "abc3", "abc10"]
+    assert records[-1]["total"] == 4 and records[-1]["failures"] == 1 and records[-1]["completed"]
+    output = capsys.readouterr().out
+    assert "Failures: 1" in output and "Warning" not in output
+
+
+def test_merge_reports_warns_about_missing_shard(tmp_path, capsys):
+    first = str(tmp_path / "1.jsonl")
+    writeReport(first, [("abc1", "OK")], "1/3")
+    merge.mergeReports(argparse.Namespace(reports=[first], output=None))
+    assert "missing shards 2, 3 of 3" in capsys.readouterr().out
+
+
+def test_merge_packs(tmp_path):
+    packs = list()
+    for number in range(2):
+        filename = str(tmp_path / ("pack%s.zip" % number))
+        with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as zipFile:
+            zipFile.writestr("in/a%s.in" % number, "input %s" % number)
+            zipFile.writestr("out/a%s.out" % number, "output %s" % number)
+        packs.append(filename)
+    output = str(tmp_path / "merged.zip")
+    merge.mergePacks(argparse.Namespace(output=output, packs=packs))
+    with zipfile.ZipFile(output) as zipFile:
+        assert zipFile.testzip() is None
+        assert sorted(zipFile.namelist()) == ["in/a0.in", "in/a1.in", "out/a0.out", "out/a1.out"]
+        assert zipFile.read("out/a1.out") == b"output 1"
+
+
+def test_merge_packs_refuses_unfinished_pack(tmp_path, capsys):
+    filename = str(tmp_path / "pack.zip")
+    zipfile.ZipFile(filename, "w").close()
+    open(cpack.Manifest(filename).filename, "w").close()
+    output = str(tmp_path / "merged.zip")
+    merge.mergePacks(argparse.Namespace(output=output, packs=[filename]))
+    assert "was not finished" in capsys.readouterr().out
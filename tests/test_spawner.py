@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import errno
+import os
+
+import pytest
+
+import spawner
+
+
+@pytest.fixture
+def descriptors():
+    reader, writer = os.pipe()
+    yield reader, writer
+    os.close(reader)
+    os.close(writer)
+
+
+def test_program_is_started(descriptors):
+    pid = spawner.spawn({"args": ["true"]}, descriptors)
+    assert os.waitpid(pid, 0)[1] == 0
+
+
+def test_missing_program_is_reported(descriptors):
+    with pytest.raises(OSError) as error:
+        spawner.spawn({"args": ["/nonexistent/program"]}, descriptors)
+    assert error.value.errno == errno.ENOENT
+
+
+def test_any_error_in_child_is_reported(descriptors):
+    # Bad limit raises TypeError in child, which exits instead of returning into spawner.
+    with pytest.raises(OSError) as error:
+        spawner.spawn({"args": ["true"], "cpuTimeLimit": "1"}, descriptors)
+    assert error.value.errno == errno.EINVAL
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+import tar2zip
+
+
+@pytest.mark.parametrize("mode", ["w|", "w|gz", "w|xz"])
+def test_tar_is_copied_to_zip(tmp_path, monkeypatch, mode):
+    # Files over chunk size are copied in chunks, others by worker threads.
+    monkeypatch.setattr(tar2zip, "CHUNK_SIZE", 1000)
+    files = [("dir", None)] + [("dir/t%d.in" % number, os.urandom(number * 300)) for number in range(8)]
+    tarPath = str(tmp_path / "tests.tar")
+    with tarfile.open(tarPath, mode) as tarFile:
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            if data is None:
+                info.type = tarfile.DIRTYPE
+                tarFile.addfile(info)
+            else:
+                info.size = len(data)
+                tarFile.addfile(info, io.BytesIO(data))
+
+    zipPath = str(tmp_path / "tests.zip")
+    with tarfile.open(tarPath, "r|*") as source, zipfile.ZipFile(zipPath, "w", zipfile.ZIP_DEFLATED, True) as sink:
+        assert tar2zip.copyMembers(source, sink, 2) == (8, sum(len(data) for _, data in files[1:]))
+
+    with zipfile.ZipFile(zipPath) as zipFile:
+        assert zipFile.testzip() is None
+        assert zipFile.namelist() == [name for name, _ in files[1:]]
+        for name, data in files[1:]:
+            assert zipFile.read(name) == data
+
+
+def test_tar_base_name():
+    assert tar2zip.getTarBaseName("tests.tar.gz") == "tests"
+    assert tar2zip.getTarBaseName("tests.TGZ") == "tests"
+    assert tar2zip.getTarBaseName("tests.zip") is None
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import os
+import zipfile
+
+import pytest
+
+import ultima
+
+
+@pytest.fixture
+def archive(tmp_path):
+    filename = str(tmp_path / "tests.zip")
+    with zipfile.ZipFile(filename, "w") as zipFile:
+        zipFile.writestr("t2.in", b"2\n" * 1000, zipfile.ZIP_DEFLATED)
+        zipFile.writestr("t2.out", b"4\n", zipfile.ZIP_STORED)
+        zipFile.writestr("t1ocen.in", b"1\n", zipfile.ZIP_DEFLATED)
+        zipFile.writestr("t3.in", b"", zipfile.ZIP_DEFLATED)
+        zipFile.writestr("t2.bz2", b"x" * 100, zipfile.ZIP_BZIP2)
+    return filename
+
+
+def corruptStoredFile(archive, name):
+    with zipfile.ZipFile(archive) as zipFile:
+        info = zipFile.getinfo(name)
+    with open(archive, "r+b") as fileHandle:
+        # Stored file starts right after local header and its name.
+        fileHandle.seek(info.header_offset + 30 + len(name))
+        data = fileHandle.read(1)
+        fileHandle.seek(-1, os.SEEK_CUR)
+        fileHandle.write(bytes([data[0] ^ 1]))
+
+
+def test_zip_provider_pairs_tests(archive):
+    tests = list(ultima.TestFromZipProvider(archive).getTests())
+    assert [(test.inFilename, test.modelOutFilename) for test in tests] == [
+        ("t1ocen.in", None), ("t2.in", "t2.out"), ("t3.in", None)]
+    assert tests[1].inputData == b"2\n" * 1000
+    assert tests[1].modelOutputData == b"4\n"
+
+
+def test_corrupt_file_stops_its_test_only(archive):
+    corruptStoredFile(archive, "t2.out")
+    tests = list(ultima.TestFromZipProvider(archive).getTests())
+    assert tests[1].inputData == b"2\n" * 1000
+    with pytest.raises(ultima.CriticalError, match="t2.out"):
+        tests[1].modelOutputData
+
+
+def test_verifier_reports_corrupt_files(archive):
+    corruptStoredFile(archive, "t2.out")
+    verifier = ultima.ZipVerifier(archive)
+    verifier.start()
+    verifier.join()
+    assert verifier.corruptFiles == ["t2.out"]
+
+
+def test_zip_reader_reads_every_method(archive):
+    reader = ultima.ZipReader(archive)
+    assert sorted(reader.namelist()) == ["t1ocen.in", "t2.bz2", "t2.in", "t2.out", "t3.in"]
+    assert reader.read("t2.in") == b"2\n" * 1000
+    assert reader.read("t2.out") == b"4\n"
+    assert reader.read("t3.in") == b""
+    assert reader.read("t2.bz2") == b"x" * 100
+
+
+def test_zip_reader_returns_data_as_stored(archive):
+    reader = ultima.ZipReader(archive)
+    info, data = reader.readCompressed("t2.in")
+    assert info.compress_type == zipfile.ZIP_DEFLATED
+    assert len(data) == info.compress_size < info.file_size
+    assert reader.readCompressed("t2.out")[1] == b"4\n"
+
+
+def test_zip_reader_detects_corrupt_file(archive):
+    corruptStoredFile(archive, "t2.out")
+    with pytest.raises(zipfile.BadZipFile):
+        ultima.ZipReader(archive).read("t2.out")
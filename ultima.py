@@ -2,8 +2,10 @@
 import sys
 
 
-if sys.version_info < (3, 3):
-    print("Python version should be 3.3 or more.")
+# contextlib.nullcontext needs 3.7, math.comb and socket.create_server 3.8.
+# Programs are started by spawner.py only where socket.send_fds exists (3.9).
+if sys.version_info < (3, 8):
+    print("Python version should be 3.8 or more.")
     exit()
 
 
@@ -12,84 +14,460 @@ import subprocess
 import time
 import threading
 import zipfile
+import zlib
+import struct
 import re
 import io
 import collections
+import itertools
+import math
+import mmap
+import signal
+import selectors
+import socket
+import json
 import argparse
 import importlib
-from concurrent.futures import ThreadPoolExecutor
+import shutil
+import tempfile
+import hashlib
+import contextlib
+import statistics
+import queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from collections import deque
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import resource
+    import fcntl
+except ImportError:
+    resource = None
+    fcntl = None
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
 """
 Ultima - script for testing programs in programing contests.
 Jakub Staroń, 2013 - 2015, for Surykatki FTW
 """
 
 
-def compareStreams(stream1, stream2):
-    """Checks, if streams are the same within the meaning of OI comparator."""
-    result = True
+def _firstDifference(data1, data2):
+    """Returns index of first byte where data1 and data2 differ."""
+    low, high = 0, min(len(data1), len(data2))
+    if data1[:high] == data2[:high]:
+        return high
+    # Invariant: data1[:low] == data2[:low] and data1[:high] != data2[:high]
+    while high - low > 1:
+        middle = (low + high) // 2
+        if data1[low:middle] == data2[low:middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+class _LineReader:
+    """
+    Reads whole lines from head followed by the rest of stream. Last line
+    of stream gets line end, if it has none.
+    """
+    def __init__(self, head, stream, chunkSize):
+        self.buffer = head
+        self.lineEnds = head.count(b"\n")
+        self.stream = stream
+        self.chunkSize = chunkSize
+        self.finished = False
+
+    def _fill(self):
+        chunk = self.stream.read(self.chunkSize)
+        if not chunk:
+            self.finished = True
+            if self.buffer and not self.buffer.endswith(b"\n"):
+                self.buffer += b"\n"
+                self.lineEnds += 1
+            return
+        self.buffer += chunk
+        self.lineEnds += chunk.count(b"\n")
+
+    def _take(self, size, lines):
+        block = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        self.lineEnds -= lines
+        return block, lines
+
+    def readBlock(self):
+        """
+        Returns couple (about chunkSize bytes of whole lines, number of
+        lines), data is empty at the end of stream.
+        """
+        if len(self.buffer) < self.chunkSize and not self.finished:
+            self._fill()
+        while self.lineEnds == 0 and not self.finished:
+            self._fill()
+        return self._take(self.buffer.rfind(b"\n") + 1, self.lineEnds)
+
+    def readLines(self, count):
+        """Returns couple (count lines, or fewer at the end of stream, number of lines)."""
+        while self.lineEnds < count and not self.finished:
+            self._fill()
+        if self.lineEnds <= count:
+            return self._take(self.buffer.rfind(b"\n") + 1, self.lineEnds)
+        # Lines over count are split off from the end, usually there are few of them.
+        head = self.buffer.rsplit(b"\n", self.lineEnds - count + 1)[0]
+        return self._take(len(head) + 1, count)
+
+
+_WHITESPACE_TO_SPACE = bytes.maketrans(b"\t\r\x0b\x0c", b"    ")
+
+
+def _replaceAll(data, old, new):
+    """Replaces old with new in data until there is no old left."""
     while True:
-        line1 = stream1.readline()
-        line2 = stream2.readline()    
-        if not line1 and not line2:
-            break
-        
-        if line1.split() != line2.split():
-            result = False
+        replaced = data.replace(old, new)
+        if len(replaced) == len(data):
+            return data
+        data = replaced
+
+
+def _withoutCarriageReturns(block):
+    return block.replace(b"\r\n", b"\n") if b"\r" in block else block
+
+
+def _withSpacesOnly(block):
+    if any(character in block for character in (b"\t", b"\r", b"\x0b", b"\x0c")):
+        return block.translate(_WHITESPACE_TO_SPACE)
+    return block
+
+
+def _withoutTrailingSpace(block):
+    return block.replace(b" \n", b"\n")
+
+
+def _withSingleSpaces(block):
+    return block.replace(b"  ", b" ")
+
+
+def _normalizedLines(block):
+    """Returns block of whole lines with tokens of each line joined by single space."""
+    block = _replaceAll(_withSpacesOnly(block), b"  ", b" ")
+    if block.startswith(b" "):
+        block = block[1:]
+    return block.replace(b" \n", b"\n").replace(b"\n ", b"\n")
+
+
+# Each step keeps tokens of every line, cheap ones which fix common differences go first.
+_NORMALIZATION_STEPS = (_withoutCarriageReturns, _withSpacesOnly, _withoutTrailingSpace, _withSingleSpaces,
+                        _normalizedLines)
+
+
+def _sameTokens(comparedBlock, modelBlock):
+    """
+    Checks if blocks of the same number of lines have the same tokens in each
+    line. Whole blocks are normalized by bytes methods, not token by token.
+    Model output is usually normalized already, so compared block is checked
+    against it after each normalization step, before model block is normalized.
+    """
+    if comparedBlock == modelBlock:
+        return True
+    for normalize in _NORMALIZATION_STEPS:
+        comparedBlock = normalize(comparedBlock)
+        if comparedBlock == modelBlock:
+            return True
+    return comparedBlock == _normalizedLines(modelBlock)
+
+
+def _compareChunks(compared, model, chunkSize):
+    """
+    Compares raw bytes of two streams. If they differ, returns triple
+    (line, comparedHead, modelHead), where heads are data read from
+    beginning of first different line. Otherwise returns None.
+    """
+    line = 1
+    lineHead = b""
+    while True:
+        comparedChunk = compared.read(chunkSize)
+        modelChunk = model.read(chunkSize)
+        if comparedChunk != modelChunk:
             break
-        
-    return result
+        if not comparedChunk:
+            return None
 
+        lastLineEnd = comparedChunk.rfind(b"\n")
+        if lastLineEnd == -1:
+            lineHead += comparedChunk
+        else:
+            line += comparedChunk.count(b"\n")
+            lineHead = comparedChunk[lastLineEnd + 1:]
 
-def advancedCompareStreams(compared, model):
+    lastLineEnd = comparedChunk.rfind(b"\n", 0, _firstDifference(comparedChunk, modelChunk))
+    if lastLineEnd != -1:
+        line += comparedChunk.count(b"\n", 0, lastLineEnd + 1)
+        lineHead = b""
+    return line, lineHead + comparedChunk[lastLineEnd + 1:], lineHead + modelChunk[lastLineEnd + 1:]
+
+
+def _describeDifference(comparedLine, modelLine, line):
     """
-    Compare two streams and return couple (message, different_line)
-    If streams are the same, return none
+    Returns message describing first difference between token lists,
+    or None if they are the same.
     """
-    
-    def compareLines(compared_line, model_line):
-        length = min(len(model_line), len(compared_line))
-        for i in range(0, length):
-            if compared_line[i] != model_line[i]:
-                return i            
+    length = min(len(comparedLine), len(modelLine))
+    for i in range(0, length):
+        if comparedLine[i] != modelLine[i]:
+            return "Line %s: read %s expected %s" % (line, comparedLine[i].decode(), modelLine[i].decode())
+
+    if len(comparedLine) < len(modelLine):
+        return "Line %s: end of line, expected %s" % (line, modelLine[len(comparedLine)].decode())
+    elif len(comparedLine) > len(modelLine):
+        return "Line %s: rubbish at the end of line." % line
+    return None
+
+
+def _fileDescriptor(stream):
+    """Returns descriptor of file behind stream, or None if stream is not backed by a file."""
+    try:
+        return stream.fileno()
+    except (AttributeError, io.UnsupportedOperation, OSError):
         return None
 
-    line = 1
+
+def _mappedStream(stream):
+    """
+    Returns read-only memory map of file behind stream, positioned like
+    stream, or stream itself if it can't be mapped (ie is empty).
+    """
+    descriptor = _fileDescriptor(stream)
+    if descriptor is None:
+        return stream
+    try:
+        mapped = mmap.mmap(descriptor, 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        return stream
+    mapped.seek(stream.tell())
+    return mapped
+
+
+def _findTokens(reader, line):
+    """
+    Returns couple (line, tokens) of first line with tokens read from reader,
+    starting at given line number, or None if rest of stream is whitespace.
+    """
     while True:
-        comparedLine = compared.readline().split()
-        modelLine = model.readline().split()
-        if not comparedLine and not modelLine:
+        block, lines = reader.readBlock()
+        if not block:
             return None
+        if block.split():
+            for number, text in enumerate(block.split(b"\n"), line):
+                if text.split():
+                    return number, text.split()
+        line += lines
 
-        cmpResult = compareLines(comparedLine, modelLine)
-        if cmpResult is not None:
-            message = "Line %s: read %s expected %s" % (line,
-                                                        comparedLine[cmpResult].decode(),
-                                                        modelLine[cmpResult].decode())
-            return message, line
 
-        if len(comparedLine) < len(modelLine):
-            message = "Line %s: end of line, expected %s" % (line, modelLine[len(comparedLine)].decode())
-            return message, line
+def compareOutputs(compared, model, chunkSize=1024 * 1024):
+    """
+    Compare two streams within the meaning of OI comparator, in one pass.
+    Return couple (message, different_line), or None if streams are the same.
+
+    Streams are compared as raw bytes as long as they are identical.
+    From the beginning of the first different line they are compared
+    in blocks of the same number of lines, by tokens of each line. Empty
+    lines at the end of streams are ignored. Streams backed by files are
+    memory mapped, so they are not copied into file buffers.
+    """
+    compared = _mappedStream(compared)
+    model = _mappedStream(model)
+    difference = _compareChunks(compared, model, chunkSize)
+    if difference is None:
+        return None
+    line, comparedHead, modelHead = difference
 
-        elif len(comparedLine) > len(modelLine):
-            message = "Line %s: rubbish at the end of line." % line
-            return message, line
+    compared = _LineReader(comparedHead, compared, chunkSize)
+    model = _LineReader(modelHead, model, chunkSize)
+    modelEnd = None
+    while True:
+        comparedBlock, lines = compared.readBlock()
+        if not comparedBlock:
+            extra = _findTokens(model, line)
+            if extra is None:
+                return None
+            extraLine, tokens = extra
+            return "Line %s: end of output, expected %s" % (extraLine, tokens[0].decode()), extraLine
+
+        modelBlock, modelLines = model.readLines(lines)
+        if modelLines < lines:
+            # Model output ended, the rest of output has to be empty.
+            if modelEnd is None:
+                modelEnd = line + modelLines - 1
+            modelBlock += b"\n" * (lines - modelLines)
+        if not _sameTokens(comparedBlock, modelBlock):
+            break
+        line += lines
 
+    for comparedLine, modelLine in zip(comparedBlock.split(b"\n"), modelBlock.split(b"\n")):
+        comparedTokens = comparedLine.split()
+        modelTokens = modelLine.split()
+        if comparedTokens != modelTokens:
+            break
         line += 1
+    if modelEnd is not None and line > modelEnd:
+        return "Line %s: read %s, model output ends at line %s" % (line, comparedTokens[0].decode(), modelEnd), line
+    return _describeDifference(comparedTokens, modelTokens, line), line
+
+
+_TOKEN = re.compile(rb"\S+")
+
+
+def _tokenPosition(data, index):
+    """Returns couple (line, column) of index-th token in data, counted from 1."""
+    token = next(itertools.islice(_TOKEN.finditer(data), index, None))
+    start = token.start()
+    return data.count(b"\n", 0, start) + 1, start - data.rfind(b"\n", 0, start)
+
+
+def _parseFloats(tokens):
+    """
+    Returns couple (values, isNumber) of sequences parallel to tokens.
+    Tokens which are not numbers get value nan.
+    """
+    if numpy is not None:
+        try:
+            values = numpy.array(tokens).astype(numpy.float64)
+            return values, numpy.ones(len(tokens), dtype=bool)
+        except ValueError:
+            pass
+
+    values = list()
+    isNumber = list()
+    for token in tokens:
+        try:
+            values.append(float(token))
+            isNumber.append(True)
+        except ValueError:
+            values.append(float("nan"))
+            isNumber.append(False)
+
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.float64), numpy.array(isNumber, dtype=bool)
+    return values, isNumber
+
+
+def _firstFloatMismatch(comparedTokens, modelTokens, absoluteEps, relativeEps):
+    """
+    Returns index of first token pair which differs by more than both
+    absoluteEps and relativeEps times model value, or None.
+    Tokens which are not numbers must be the same.
+    """
+    comparedValues, comparedIsNumber = _parseFloats(comparedTokens)
+    modelValues, modelIsNumber = _parseFloats(modelTokens)
+
+    if numpy is not None:
+        with numpy.errstate(invalid='ignore'):
+            difference = numpy.abs(comparedValues - modelValues)
+            close = (difference <= absoluteEps) | (difference <= relativeEps * numpy.abs(modelValues))
+            close &= comparedIsNumber & modelIsNumber
+            # Infinities and tokens which are not numbers have to be equal.
+            close |= numpy.array(comparedTokens) == numpy.array(modelTokens)
+        wrong = numpy.flatnonzero(~close)
+        return int(wrong[0]) if len(wrong) > 0 else None
+
+    for i, (comparedValue, modelValue) in enumerate(zip(comparedValues, modelValues)):
+        if comparedIsNumber[i] and modelIsNumber[i]:
+            difference = abs(comparedValue - modelValue)
+            if difference <= absoluteEps or difference <= relativeEps * abs(modelValue):
+                continue
+        if comparedTokens[i] != modelTokens[i]:
+            return i
+    return None
 
 
-def _resultCheck(_, outputStream, modelOutputStream):
-    return compareStreams(outputStream, modelOutputStream)
+def compareFloatOutputs(compared, model, absoluteEps=0.0, relativeEps=0.0):
+    """
+    Compare two streams token by token, numbers may differ by absoluteEps
+    or by relativeEps relative to model value. Line breaks are ignored.
+    Return couple (message, different_line), or None if streams are the same.
+    """
+    comparedData = compared.read()
+    modelData = model.read()
+    comparedTokens = comparedData.split()
+    modelTokens = modelData.split()
+    length = min(len(comparedTokens), len(modelTokens))
+
+    index = _firstFloatMismatch(comparedTokens[:length], modelTokens[:length], absoluteEps, relativeEps)
+    if index is not None:
+        line, column = _tokenPosition(comparedData, index)
+        message = "Line %s, column %s: read %s expected %s" % (line, column,
+                                                               comparedTokens[index].decode(),
+                                                               modelTokens[index].decode())
+        return message, line
+
+    if len(comparedTokens) < len(modelTokens):
+        line = comparedData.count(b"\n") + 1
+        message = "Line %s: end of output, expected %s" % (line, modelTokens[length].decode())
+        return message, line
+    elif len(comparedTokens) > len(modelTokens):
+        line, column = _tokenPosition(comparedData, length)
+        message = "Line %s, column %s: rubbish at the end of output." % (line, column)
+        return message, line
+    return None
 
 
-def _advancedResultCheck(_, outputStream, modelOutputStream):
-    return advancedCompareStreams(outputStream, modelOutputStream)[0]
+def compareStreams(stream1, stream2):
+    """Checks, if streams are the same within the meaning of OI comparator."""
+    return compareOutputs(stream1, stream2) is None
 
 
-resultCheck = _resultCheck
-advancedResultCheck = _advancedResultCheck
+def advancedCompareStreams(compared, model):
+    """
+    Compare two streams and return couple (message, different_line)
+    If streams are the same, return none
+    """
+    return compareOutputs(compared, model)
+
+
+def useComparator(compare):
+    """
+    Sets resultCheck, advancedResultCheck and fullResultCheck to use
+    compare function, which has the same interface as compareOutputs.
+    """
+    def comparatorResultCheck(_, outputStream, modelOutputStream):
+        return compare(outputStream, modelOutputStream) is None
+
+    def comparatorAdvancedResultCheck(_, outputStream, modelOutputStream):
+        result = compare(outputStream, modelOutputStream)
+        if result is None:
+            return None
+        return result[0]
+
+    def comparatorFullResultCheck(_, outputStream, modelOutputStream):
+        """Returns couple (is_correct, message), comparing streams only once."""
+        result = compare(outputStream, modelOutputStream)
+        if result is None:
+            return True, None
+        return False, result[0]
+
+    global resultCheck
+    global advancedResultCheck
+    global fullResultCheck
+    resultCheck = comparatorResultCheck
+    advancedResultCheck = comparatorAdvancedResultCheck
+    fullResultCheck = comparatorFullResultCheck
+
+
+useComparator(compareOutputs)
 
 
 def replaceExtension(filename, newExtension):
@@ -134,7 +512,7 @@ def getFilesFromFolder(folder, extensions=None, subdirectories=False):
 
 
 class AsynchronousStreamRelay(threading.Thread):
-    def __init__(self, sourceStream, sinkStream, closeStreamAfterDone=True):
+    def __init__(self, sourceStream, sinkStream, closeStreamAfterDone=True, onError=None):
         assert callable(sourceStream.read)
         assert callable(sinkStream.write)
         threading.Thread.__init__(self)
@@ -142,6 +520,7 @@ class AsynchronousStreamRelay(threading.Thread):
         self.sinkStream = sinkStream
         self.chunkSize = 1024
         self.closeStreamAfterDone = closeStreamAfterDone
+        self.onError = onError
         
     def run(self):
         try:
@@ -153,47 +532,618 @@ class AsynchronousStreamRelay(threading.Thread):
             if self.closeStreamAfterDone:   
                 self.sinkStream.close()
         except IOError:
-            pass
+            if self.onError is not None:
+                self.onError()
 
     def readChunk(self):
         return self.sourceStream.read(self.chunkSize)
 
 
-def callProcess(commandLine, inputStream, outputStream, timeLimit=float("inf")):
-    def timeLimiter(processHandle):
-        startTime = time.time()
+class OutputLimitExceeded(IOError):
+    pass
+
+
+class OutputBuffer:
+    """
+    Write-only stream collecting program output.
+    Data is kept in memory until it grows over spillSize bytes,
+    then it is moved to temporary file. If sizeLimit is given,
+    writing more than sizeLimit bytes raises OutputLimitExceeded.
+    """
+    def __init__(self, spillSize=16 * 1024 * 1024, sizeLimit=None):
+        self.spillSize = spillSize
+        self.sizeLimit = sizeLimit
+        self.size = 0
+        self.overflow = False
+        self.filename = None
+        self._memory = io.BytesIO()
+        self._file = None
+
+    @property
+    def spilled(self):
+        return self.filename is not None
+
+    def write(self, data):
+        if self.sizeLimit is not None and self.size + len(data) > self.sizeLimit:
+            self.overflow = True
+            data = data[:self.sizeLimit - self.size]
+
+        if not self.spilled and self.size + len(data) > self.spillSize:
+            self._spill()
+
+        if self.spilled:
+            self._file.write(data)
+        else:
+            self._memory.write(data)
+        self.size += len(data)
+
+        if self.overflow:
+            raise OutputLimitExceeded()
+        return len(data)
+
+    def _spill(self):
+        handle, self.filename = tempfile.mkstemp(prefix="ultima", suffix=".out")
+        self._file = os.fdopen(handle, "wb")
+        self._file.write(self._memory.getbuffer())
+        self._memory = None
+
+    def flush(self):
+        if self.spilled:
+            self._file.flush()
+
+    def outputFile(self):
+        """Returns name of file with output, moving output to disk if needed."""
+        if not self.spilled:
+            self._spill()
+        self.flush()
+        return self.filename
+
+    def directFile(self):
+        """
+        Returns output file, so process could write to it directly.
+        Afterwards updateSize must be called.
+        """
+        self.outputFile()
+        return self._file
+
+    def updateSize(self):
+        """Updates size after process wrote to output file directly."""
+        if self.spilled:
+            # Data written through this buffer could still be in file buffer.
+            self._file.flush()
+            self.size = os.fstat(self._file.fileno()).st_size
+            if self.sizeLimit is not None and self.size > self.sizeLimit:
+                self.overflow = True
+                self.size = self.sizeLimit
+                os.ftruncate(self._file.fileno(), self.size)
+
+    def getvalue(self):
+        """Returns whole output as bytes, reading it from disk if needed."""
+        if not self.spilled:
+            return self._memory.getvalue()
+        self.flush()
+        with open(self.filename, "rb") as fileHandle:
+            return fileHandle.read()
+
+    def openStream(self):
+        """Returns new readable stream, positioned at output beginning."""
+        if not self.spilled:
+            return io.BytesIO(self._memory.getvalue())
+        self.flush()
+        return open(self.filename, "rb")
+
+    def saveToFile(self, filename):
+        if not self.spilled:
+            saveToFile(self._memory.getbuffer(), filename)
+            return
+        self.flush()
         try:
-            processHandle.wait(timeout=timeLimit)
-        except subprocess.TimeoutExpired:
+            shutil.copyfile(self.filename, filename)
+        except IOError:
+            print("Error when writing to file %s" % filename)
+
+    def close(self):
+        if self.spilled:
+            self._file.close()
+            tryDeleteFile(self.filename)
+            self.filename = None
+        self._memory = io.BytesIO()
+        self.size = 0
+
+    def __del__(self):
+        self.close()
+
+
+class ProcessResult:
+    def __init__(self):
+        self.returnCode = None
+        self.wallTime = None
+        self.userTime = None
+        self.systemTime = None
+        self.peakMemory = None
+        # Process was killed because of wall time or CPU time limit.
+        self.timedOut = False
+
+    @property
+    def cpuTime(self):
+        """User and system CPU time, or wall time if CPU time is unknown."""
+        if self.userTime is None:
+            return self.wallTime
+        return self.userTime + self.systemTime
+
+
+def _limitResources(cpuTimeLimit, addressSpaceLimit, fileSizeLimit, cpus=None):
+    """Returns function setting resource limits and CPU affinity in child process before exec."""
+    def setLimits():
+        if cpus is not None:
+            os.sched_setaffinity(0, cpus)
+        if resource is not None and cpuTimeLimit is not None:
+            seconds = int(math.ceil(cpuTimeLimit))
+            # SIGXCPU after soft limit, SIGKILL after hard one.
+            resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + 1))
+        if resource is not None and addressSpaceLimit is not None:
+            resource.setrlimit(resource.RLIMIT_AS, (addressSpaceLimit, addressSpaceLimit))
+        if resource is not None and fileSizeLimit is not None:
+            resource.setrlimit(resource.RLIMIT_FSIZE, (fileSizeLimit, fileSizeLimit))
+    return setLimits
+
+
+class _ProcessGuard:
+    """
+    Reaps process and fills ProcessResult with its resource usage.
+    Until process is reaped, it could be killed from any thread.
+    Process started by Popen is reaped only by os.wait4 where it exists;
+    Popen.kill and Popen.poll are not used, they could reap it first.
+    """
+    def __init__(self, process, processResult):
+        self.process = process
+        self.processResult = processResult
+        self.lock = threading.Lock()
+        self.reaped = False
+
+    def kill(self, timedOut=False):
+        with self.lock:
+            if self.reaped:
+                return
+            if timedOut:
+                self.processResult.timedOut = True
             try:
-                processHandle.terminate()
+                if isinstance(self.process, _SpawnedProcess) or not hasattr(os, 'wait4'):
+                    self.process.kill()
+                else:
+                    os.kill(self.process.pid, signal.SIGKILL)
             except OSError:
-                # The process finished between exception and `terminate()`
+                # The process finished in the meantime.
                 pass
 
-        return time.time() - startTime
-  
+    def reap(self):
+        process = self.process
+        processResult = self.processResult
+        if isinstance(process, _SpawnedProcess):
+            status, usage = process.wait4()
+        elif hasattr(os, 'wait4'):
+            if hasattr(os, 'waitid'):
+                # Exit is awaited without reaping, so pid is not reused while kill could still signal it.
+                os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+                with self.lock:
+                    self.reaped = True
+                    _, status, usage = os.wait4(process.pid, 0)
+            else:
+                # Without waitid (ie macOS) process is polled, lock is never held while waiting, so kill isn't blocked.
+                delay = 0.001
+                while True:
+                    with self.lock:
+                        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+                        if pid != 0:
+                            self.reaped = True
+                            break
+                    time.sleep(delay)
+                    delay = min(delay * 2, 0.05)
+        else:
+            process.wait()
+            with self.lock:
+                self.reaped = True
+            processResult.returnCode = process.returncode
+            return
+
+        with self.lock:
+            self.reaped = True
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+            if os.WTERMSIG(status) == signal.SIGXCPU:
+                processResult.timedOut = True
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+        processResult.userTime = usage.ru_utime
+        processResult.systemTime = usage.ru_stime
+        # ru_maxrss is in kilobytes, except on macOS where it is in bytes.
+        processResult.peakMemory = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+        processResult.returnCode = process.returncode
+
+
+def _relayCommunicate(process, guard, inputStream, outputStream, timeLimit):
+    """Relays process input and output using two threads, time limit is enforced by timer."""
+    timer = None
+    if timeLimit != float("inf"):
+        timer = threading.Timer(timeLimit, guard.kill, (True,))
+        timer.start()
+
+    relays = list()
+    if process.stdin is not None:
+        relays.append(AsynchronousStreamRelay(inputStream, process.stdin))
+    if process.stdout is not None:
+        relays.append(AsynchronousStreamRelay(process.stdout, outputStream, False, guard.kill))
+    for relay in relays:
+        relay.start()
+
+    guard.reap()
+    if timer is not None:
+        timer.cancel()
+
+    for relay in relays:
+        relay.join()
+    if process.stdout is not None:
+        process.stdout.close()
+
+
+class _MultiplexedProcess:
+    def __init__(self, process, guard, inputStream, outputStream, deadline):
+        self.process = process
+        self.guard = guard
+        self.inputStream = inputStream
+        self.outputStream = outputStream
+        self.deadline = deadline
+        self.pendingInput = memoryview(b"")
+        self.pipes = [pipe for pipe in (process.stdin, process.stdout) if pipe is not None]
+        self.openStreams = len(self.pipes)
+        self.streamsClosed = threading.Event()
+        if self.openStreams == 0:
+            self.streamsClosed.set()
+
+
+class ProcessMultiplexer(threading.Thread):
+    """
+    Single thread relaying input and output of many processes at once,
+    using selectors and large buffers. It also kills processes which
+    exceed their time limit.
+    """
+    bufferSize = 1024 * 1024
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.newProcesses = list()
+        self.processes = list()
+        self.wakeupReader, self.wakeupWriter = os.pipe()
+        os.set_blocking(self.wakeupReader, False)
+        self.selector.register(self.wakeupReader, selectors.EVENT_READ)
+        self.readCalls = 0
+        self.writeCalls = 0
+
+    def communicate(self, process, guard, inputStream, outputStream, timeLimit):
+        """Relays process input and output, returns after process is reaped."""
+        deadline = time.perf_counter() + timeLimit if timeLimit != float("inf") else None
+        item = _MultiplexedProcess(process, guard, inputStream, outputStream, deadline)
+        with self.lock:
+            self.newProcesses.append(item)
+        os.write(self.wakeupWriter, b"\0")
+
+        item.streamsClosed.wait()
+        guard.reap()
+        os.write(self.wakeupWriter, b"\0")
+
+    def run(self):
+        while True:
+            self.addNewProcesses()
+            for key, events in self.selector.select(self.timeout()):
+                if key.data is None:
+                    os.read(self.wakeupReader, self.bufferSize)
+                elif events & selectors.EVENT_WRITE:
+                    self.writeInput(key.data, key.fileobj)
+                else:
+                    self.readOutput(key.data, key.fileobj)
+            self.enforceDeadlines()
+
+    def addNewProcesses(self):
+        with self.lock:
+            newProcesses, self.newProcesses = self.newProcesses, list()
+
+        for item in newProcesses:
+            for pipe in item.pipes:
+                os.set_blocking(pipe.fileno(), False)
+                _enlargePipe(pipe.fileno(), self.bufferSize)
+                event = selectors.EVENT_WRITE if pipe is item.process.stdin else selectors.EVENT_READ
+                self.selector.register(pipe, event, item)
+            self.processes.append(item)
+
+    def timeout(self):
+        deadlines = [item.deadline for item in self.processes if item.deadline is not None]
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.perf_counter())
+
+    def enforceDeadlines(self):
+        now = time.perf_counter()
+        for item in self.processes:
+            if item.deadline is not None and item.deadline <= now:
+                item.guard.kill(True)
+                item.deadline = None
+        self.processes = [item for item in self.processes if not item.guard.reaped]
+
+    def closeStream(self, item, pipe):
+        self.selector.unregister(pipe)
+        pipe.close()
+        item.openStreams -= 1
+        if item.openStreams == 0:
+            item.streamsClosed.set()
+
+    def writeInput(self, item, pipe):
+        try:
+            if not item.pendingInput:
+                item.pendingInput = memoryview(item.inputStream.read(self.bufferSize))
+                if not item.pendingInput:
+                    self.closeStream(item, pipe)
+                    return
+            self.writeCalls += 1
+            written = os.write(pipe.fileno(), item.pendingInput)
+            item.pendingInput = item.pendingInput[written:]
+        except IOError:
+            # Process doesn't read its input any more.
+            self.closeStream(item, pipe)
+
+    def readOutput(self, item, pipe):
+        try:
+            self.readCalls += 1
+            chunk = os.read(pipe.fileno(), self.bufferSize)
+            if not chunk:
+                self.closeStream(item, pipe)
+                return
+            item.outputStream.write(chunk)
+        except IOError:
+            item.guard.kill()
+            self.closeStream(item, pipe)
+
+
+def _enlargePipe(fileDescriptor, size):
+    """Raises pipe capacity on Linux, so less system calls are needed."""
+    if hasattr(fcntl, 'F_SETPIPE_SZ'):
+        try:
+            fcntl.fcntl(fileDescriptor, fcntl.F_SETPIPE_SZ, size)
+        except OSError:
+            pass
+
+
+_multiplexer = None
+_multiplexerLock = threading.Lock()
+
+
+def getProcessMultiplexer():
+    """Returns process multiplexer, starting it at first use."""
+    global _multiplexer
+    with _multiplexerLock:
+        if _multiplexer is None:
+            _multiplexer = ProcessMultiplexer()
+            _multiplexer.start()
+        return _multiplexer
+
+
+# Selectors don't support pipes on Windows, threads are used there.
+useMultiplexer = os.name == 'posix'
+
+
+class _SpawnerReply:
+    def __init__(self):
+        self.event = threading.Event()
+        self.message = None
+
+
+_ResourceUsage = collections.namedtuple('_ResourceUsage', 'ru_utime ru_stime ru_maxrss')
+
+
+class ProcessSpawner(threading.Thread):
+    """
+    Starts programs through spawner.py helper process and collects their
+    exit status. Peak memory reported by the system for a process includes
+    memory of the process which forked it, so programs forked by ultima
+    itself would be charged for all outputs held in its memory.
+    """
+    def __init__(self, spawnerPath):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.connection, helperConnection = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.helper = subprocess.Popen((sys.executable, '-S', spawnerPath, str(helperConnection.fileno())),
+                                           pass_fds=(helperConnection.fileno(),))
+        finally:
+            helperConnection.close()
+        self.lock = threading.Lock()
+        self.requestIds = itertools.count()
+        self.spawnReplies = dict()
+        self.exitReplies = dict()
+        self.alive = True
+
+    def spawn(self, args, stdinDescriptor, stdoutDescriptor, cpuTimeLimit=None, addressSpaceLimit=None,
+              fileSizeLimit=None, cpus=None):
+        """Returns pid of started program, raises OSError if it could not be started."""
+        reply = _SpawnerReply()
+        with self.lock:
+            if not self.alive:
+                raise OSError("Spawner process is not running")
+            requestId = next(self.requestIds)
+            self.spawnReplies[requestId] = reply
+
+        request = {"request": "spawn", "id": requestId, "args": list(args),
+                   "cpuTimeLimit": cpuTimeLimit, "addressSpaceLimit": addressSpaceLimit,
+                   "fileSizeLimit": fileSizeLimit, "cpus": cpus}
+        socket.send_fds(self.connection, (json.dumps(request).encode(),), (stdinDescriptor, stdoutDescriptor))
+        reply.event.wait()
+
+        if reply.message is None:
+            raise OSError("Spawner process is not running")
+        if "errno" in reply.message:
+            errorNumber = reply.message["errno"]
+            raise OSError(errorNumber, os.strerror(errorNumber), args[0])
+        return reply.message["pid"]
+
+    def wait(self, pid):
+        """Waits for program to exit, returns message with its status and resource usage."""
+        with self.lock:
+            reply = self.exitReplies[pid]
+        reply.event.wait()
+        with self.lock:
+            self.exitReplies.pop(pid, None)
+        if reply.message is None:
+            raise OSError("Spawner process is not running")
+        return reply.message
+
+    def kill(self, pid):
+        self.connection.send(json.dumps({"request": "kill", "pid": pid}).encode())
+
+    def run(self):
+        while True:
+            try:
+                data = self.connection.recv(64 * 1024)
+            except OSError:
+                data = b""
+            if not data:
+                break
+
+            message = json.loads(data.decode())
+            with self.lock:
+                if "id" in message:
+                    reply = self.spawnReplies.pop(message["id"])
+                    # Exit of a program is always reported after its start.
+                    if "pid" in message:
+                        self.exitReplies[message["pid"]] = _SpawnerReply()
+                else:
+                    reply = self.exitReplies[message["pid"]]
+            reply.message = message
+            reply.event.set()
+
+        # Helper process exited, release everybody waiting for it.
+        with self.lock:
+            self.alive = False
+            replies = list(self.spawnReplies.values()) + list(self.exitReplies.values())
+        for reply in replies:
+            reply.event.set()
+
+
+class _SpawnedProcess:
+    """
+    Program started by ProcessSpawner, behaving like subprocess.Popen where
+    callProcess needs it. Standard input and output are given descriptors,
+    or new pipes if descriptors are None.
+    """
+    def __init__(self, spawner, args, stdinDescriptor, stdoutDescriptor, cpuTimeLimit, addressSpaceLimit,
+                 fileSizeLimit, cpus=None):
+        self.spawner = spawner
+        self.returncode = None
+        self.stdin = None
+        self.stdout = None
+        childEnds = list()
+        try:
+            if stdinDescriptor is None:
+                stdinDescriptor, stdinWriter = os.pipe()
+                childEnds.append(stdinDescriptor)
+                self.stdin = os.fdopen(stdinWriter, 'wb')
+            if stdoutDescriptor is None:
+                stdoutReader, stdoutDescriptor = os.pipe()
+                childEnds.append(stdoutDescriptor)
+                self.stdout = os.fdopen(stdoutReader, 'rb')
+            self.pid = spawner.spawn(args, stdinDescriptor, stdoutDescriptor, cpuTimeLimit, addressSpaceLimit,
+                                     fileSizeLimit, cpus)
+        except BaseException:
+            for pipe in (self.stdin, self.stdout):
+                if pipe is not None:
+                    pipe.close()
+            raise
+        finally:
+            for descriptor in childEnds:
+                os.close(descriptor)
+
+    def kill(self):
+        self.spawner.kill(self.pid)
+
+    def wait4(self):
+        """Returns couple (status, resource usage), like os.wait4."""
+        message = self.spawner.wait(self.pid)
+        return message["status"], _ResourceUsage(message["userTime"], message["systemTime"], message["maxrss"])
+
+
+_spawner = None
+_spawnerLock = threading.Lock()
+
+
+def getProcessSpawner():
+    """Returns process spawner, starting it at first use, or None if it is not available."""
+    global _spawner
+    with _spawnerLock:
+        if _spawner is None:
+            spawnerPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spawner.py')
+            _spawner = False
+            if os.path.isfile(spawnerPath):
+                try:
+                    _spawner = ProcessSpawner(spawnerPath)
+                    _spawner.start()
+                except OSError:
+                    _spawner = False
+        return _spawner or None
+
+
+# Passing descriptors to the helper process needs unix sockets.
+useSpawner = os.name == 'posix' and hasattr(socket, 'send_fds') and hasattr(socket, 'SOCK_SEQPACKET')
+
+
+def callProcess(commandLine, inputStream, outputStream, timeLimit=float("inf"),
+                cpuTimeLimit=None, addressSpaceLimit=None, outputLimit=None, cpus=None):
+    """
+    Runs process with data from inputStream as its input, writing its output
+    to outputStream. Process is killed after timeLimit seconds of wall time.
+    CPU time and address space limits are applied before exec, if supported,
+    as well as affinity to list of cpus.
+    Streams backed by files are given to process directly, without copying
+    data through ultima; size of output file is then limited to outputLimit.
+    Returns ProcessResult.
+    """
     if isinstance(commandLine, str):
         commandLine = (commandLine,)
         
     if getFileNameExtension(commandLine[0]) == 'py':
         commandLine = (sys.executable,) + commandLine
 
-    popenArgs = {'args': commandLine, 'stdin': subprocess.PIPE, 'stdout': subprocess.PIPE}
-    process = subprocess.Popen(**popenArgs)
-        
-    stdin_writer = AsynchronousStreamRelay(inputStream, process.stdin)
-    stdin_writer.start()
-    stdout_reader = AsynchronousStreamRelay(process.stdout, outputStream, False)
-    stdout_reader.start()
+    stdinDescriptor = _fileDescriptor(inputStream)
+    stdoutDescriptor = _fileDescriptor(outputStream)
+    fileSizeLimit = None
+    if stdoutDescriptor is not None and outputLimit is not None:
+        # One byte over the limit is let through, so exceeding it is visible in file size.
+        fileSizeLimit = outputLimit + 1
+
+    spawner = getProcessSpawner() if useSpawner else None
+    popenArgs = {'args': commandLine,
+                 'stdin': subprocess.PIPE if stdinDescriptor is None else stdinDescriptor,
+                 'stdout': subprocess.PIPE if stdoutDescriptor is None else stdoutDescriptor}
+    if resource is not None and (cpuTimeLimit is not None or addressSpaceLimit is not None or fileSizeLimit is not None) \
+            or cpus is not None:
+        popenArgs['preexec_fn'] = _limitResources(cpuTimeLimit, addressSpaceLimit, fileSizeLimit, cpus)
+
+    processResult = ProcessResult()
+    startTime = time.perf_counter()
+    if spawner is not None:
+        process = _SpawnedProcess(spawner, commandLine, stdinDescriptor, stdoutDescriptor,
+                                  cpuTimeLimit, addressSpaceLimit, fileSizeLimit, cpus)
+    else:
+        process = subprocess.Popen(**popenArgs)
+    guard = _ProcessGuard(process, processResult)
 
-    processTime = timeLimiter(process)
+    if useMultiplexer:
+        getProcessMultiplexer().communicate(process, guard, inputStream, outputStream, timeLimit)
+    else:
+        _relayCommunicate(process, guard, inputStream, outputStream, timeLimit)
 
-    stdin_writer.join()    
-    stdout_reader.join()    
-    process.stdout.close()   
-   
-    return process.poll(), processTime
+    processResult.wallTime = time.perf_counter() - startTime
+    return processResult
 
 
 def createFolder(folderName):
@@ -260,12 +1210,19 @@ class Functor:
     def work(self, data):
         pass
 
+    def finish(self, data, result):
+        """
+        Called with result of work, in the order in which data was given,
+        always from the thread which runs executor.
+        """
+        pass
+
     def keyboard_interrupt(self):
         pass
 
     def execute(self, data):
         try:
-            self.work(data)
+            return self.work(data)
         except KeyboardInterrupt:
             self.keyboard_interrupt()
 
@@ -289,7 +1246,8 @@ class SequentialExecutor(Executor):
         for element in self.iterable:
             if not self.functor.is_good():
                 break
-            self.functor.execute(element)
+            result = self.functor.execute(element)
+            self.functor.finish(element, result)
 
 
 class ParallelExecutor(Executor):
@@ -300,22 +1258,251 @@ class ParallelExecutor(Executor):
         self.threads = threads
 
     def process(self):
-        for data in self.iterable:
-            if not self.functor.is_good():
+        elements = iter(self.iterable)
+        try:
+            while True:
+                try:
+                    data = next(elements)
+                except StopIteration:
+                    break
+                except Exception:
+                    # Data taken before iterable failed is finished first.
+                    while len(self.queue) > 0:
+                        self.finish_first()
+                    raise
+
+                if not self.functor.is_good():
+                    break
+
+                if len(self.queue) >= 2 * self.threads:
+                    self.finish_first()
+
+                work = self.pool.submit(self.functor.execute, data)
+                self.queue.append((data, work))
+
+                while len(self.queue) > 0 and self.queue[0][1].done():
+                    self.finish_first()
+
+            while len(self.queue) > 0:
+                self.finish_first()
+        finally:
+            for _, work in self.queue:
+                work.cancel()
+            self.shutdown()
+
+    def finish_first(self):
+        data, work = self.queue.popleft()
+        self.functor.finish(data, work.result())
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+class DistributedExecutor(ParallelExecutor):
+    """
+    Runs elements on workers of cluster, with twice as many elements in
+    flight as there are worker slots connected, so workers which join
+    while testing goes on get work too.
+    """
+    def __init__(self, functor, iterable, cluster):
+        Executor.__init__(self, functor, iterable)
+        self.pool = ThreadPoolExecutor(2 * Cluster.maxSlots)
+        self.queue = deque()
+        self.cluster = cluster
+
+    @property
+    def threads(self):
+        return max(self.cluster.slots, 1)
+
+    def shutdown(self):
+        # Elements waiting for workers would never finish, ie after KeyboardInterrupt.
+        self.cluster.cancel()
+        self.pool.shutdown()
+
+
+class ScheduledExecutor(Executor):
+    """
+    Runs elements in parallel in order of decreasing cost, so that long
+    ones don't start last while other threads have nothing to do. Results
+    are finished in the original order of elements. Elements in running
+    order could be prepared by function, ie pipelined. Costs are computed
+    by function from list of all elements, only first limit elements are
+    run. Element is released once it is finished, so data it holds is not
+    kept until the end.
+    """
+    def __init__(self, functor, elements, estimateCosts, threads, prepare=None, limit=None):
+        Executor.__init__(self, functor, elements)
+        self.estimateCosts = estimateCosts
+        self.threads = threads
+        self.prepare = prepare
+        self.limit = limit
+        # Set if some elements were left out because of limit.
+        self.limited = False
+
+    def process(self):
+        if self.limit is None:
+            elements = list(self.iterable)
+        else:
+            elements = list(itertools.islice(self.iterable, self.limit + 1))
+            self.limited = len(elements) > self.limit
+            del elements[self.limit:]
+        costs = self.estimateCosts(elements)
+        order = sorted(range(len(elements)), key=lambda position: -costs[position])
+        scheduled = (elements[position] for position in order)
+        if self.prepare is not None:
+            scheduled = self.prepare(scheduled)
+        # Function preparing elements keeps their order.
+        scheduled = zip(order, scheduled)
+
+        pool = ThreadPoolExecutor(self.threads)
+        running = dict()
+        results = dict()
+        nextPosition = 0
+        try:
+            while True:
+                while len(running) < self.threads and self.functor.is_good():
+                    position, element = next(scheduled, (None, None))
+                    if position is None:
+                        break
+                    running[pool.submit(self.functor.execute, element)] = position
+                if len(running) == 0:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for work in done:
+                    results[running.pop(work)] = work
+                while nextPosition in results and self.functor.is_good():
+                    self.functor.finish(elements[nextPosition], results.pop(nextPosition).result())
+                    elements[nextPosition] = None
+                    nextPosition += 1
+                if not self.functor.is_good():
+                    # Like in ParallelExecutor, work started before testing stopped is dropped.
+                    break
+        finally:
+            for work in running:
+                work.cancel()
+            pool.shutdown()
+
+
+def prefetch(iterable, function, workers, depth):
+    """
+    Yields elements of iterable in their order, each after function was
+    called on it by one of worker threads. At most depth elements are
+    processed ahead of the consumer. Exception raised by function is raised
+    when its element would be yielded; no new elements are taken after it.
+    Exception raised by iterable is raised after elements taken before it.
+    """
+    pool = ThreadPoolExecutor(workers)
+    queue = deque()
+    elements = iter(iterable)
+    iterableError = None
+    try:
+        while True:
+            if len(queue) >= depth:
+                ready, work = queue.popleft()
+                work.result()
+                yield ready
+
+            try:
+                element = next(elements)
+            except StopIteration:
+                break
+            except Exception as error:
+                iterableError = error
+                break
+
+            queue.append((element, pool.submit(function, element)))
+            if any(work.done() and work.exception() is not None for _, work in queue):
                 break
 
-            if len(self.queue) >= 2 * self.threads:
-                self.queue[0].result()
-                self.queue.popleft()
+        while len(queue) > 0:
+            ready, work = queue.popleft()
+            work.result()
+            yield ready
+        if iterableError is not None:
+            raise iterableError
+    finally:
+        for _, work in queue:
+            work.cancel()
+        pool.shutdown()
 
-            work = self.pool.submit(self.functor.execute, data)
-            self.queue.append(work)
 
-            while len(self.queue) > 0 and self.queue[0].done():
-                self.queue.popleft()
+def pipelineTests(tests, depth, modelOutputs=True):
+    """
+    Prepares tests in background stages, first input data and then model
+    outputs, so they overlap with running tested program on earlier tests.
+    Each stage works on at most depth tests at once.
+    """
+    tests = prefetch(tests, lambda test: test.prefetchInputData(), depth, depth)
+    if modelOutputs:
+        tests = prefetch(tests, lambda test: test.prefetchModelOutputData(), depth, depth)
+    return tests
 
-        while len(self.queue) > 0 and self.queue[0].result():
-            self.queue.popleft()
+
+class CriticalError(Exception):
+    """Error after which testing can't continue, ie crash of input generator."""
+    pass
+
+
+class Profiler:
+    """
+    Measures time spent in phases of testing, ie running generator or
+    tested program, in all threads. Phases could be nested, time of phase
+    includes time of phases inside it.
+    """
+    def __init__(self, keepEvents=False):
+        self.lock = threading.Lock()
+        self.startTime = time.perf_counter()
+        self.totals = dict()
+        self.events = list() if keepEvents else None
+        self.threadNames = dict()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, startTime, time.perf_counter())
+
+    def record(self, name, startTime, endTime):
+        with self.lock:
+            total = self.totals.setdefault(name, [0, 0.0])
+            total[0] += 1
+            total[1] += endTime - startTime
+            if self.events is not None:
+                thread = threading.current_thread()
+                self.threadNames[thread.ident] = thread.name
+                self.events.append((name, startTime, endTime, thread.ident))
+
+    def printReport(self):
+        print("Time by phase (%.2f s of wall time):" % (time.perf_counter() - self.startTime))
+        print("  %-16s %10s %8s %12s" % ("phase", "seconds", "calls", "ms per call"))
+        for name, (calls, seconds) in sorted(self.totals.items(), key=lambda item: -item[1][1]):
+            print("  %-16s %10.2f %8d %12.2f" % (name, seconds, calls, seconds * 1000 / calls))
+
+    def saveTrace(self, filename):
+        """Saves phases in Chrome trace format, for chrome://tracing or Perfetto."""
+        processId = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": processId, "tid": threadId, "args": {"name": name}}
+                  for threadId, name in self.threadNames.items()]
+        for name, startTime, endTime, threadId in self.events:
+            events.append({"name": name, "ph": "X", "pid": processId, "tid": threadId,
+                           "ts": (startTime - self.startTime) * 1e6, "dur": (endTime - startTime) * 1e6})
+        with open(filename, "w") as traceFile:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, traceFile)
+
+
+# Profiler of testing phases, or None if profiling is disabled.
+profiler = None
+_noPhase = contextlib.nullcontext()
+
+
+def profilePhase(name):
+    """Returns context manager measuring time of phase, if profiling is enabled."""
+    if profiler is None:
+        return _noPhase
+    return profiler.phase(name)
 
 
 class Test:
@@ -323,6 +1510,7 @@ class Test:
         self.testName = testName
         self._inputData = None
         self._modelOutputData = None
+        self._temporaryFiles = dict()
 
     @property
     def haveModelOutput(self):
@@ -371,6 +1559,49 @@ class Test:
         """
         raise NotImplementedError()
 
+    def prefetchInputData(self):
+        """
+        Called in background before test is run, so input data costly
+        to get (ie generated) could be ready in advance.
+        """
+        pass
+
+    def prefetchModelOutputData(self):
+        """Called in background after prefetchInputData, like it."""
+        pass
+
+    def _temporaryFile(self, kind, getData):
+        if kind not in self._temporaryFiles:
+            handle, filename = tempfile.mkstemp(prefix="ultima", suffix="." + kind)
+            with os.fdopen(handle, "wb") as fileHandle:
+                fileHandle.write(getData())
+            self._temporaryFiles[kind] = filename
+        return self._temporaryFiles[kind]
+
+    def inputFile(self):
+        """Returns name of file with input data, temporary if test is not stored in file."""
+        return self._temporaryFile("in", lambda: self.inputData)
+
+    def modelOutputFile(self):
+        """Returns name of file with model output data, temporary if test is not stored in file."""
+        return self._temporaryFile("out", lambda: self.modelOutputData)
+
+    def __del__(self):
+        for filename in self._temporaryFiles.values():
+            tryDeleteFile(filename)
+
+    def inputSize(self):
+        """Returns size of input data."""
+        return len(self.inputData)
+
+    def inputDigest(self):
+        """Returns hash of input data, which identifies test together with its name."""
+        digest = hashlib.sha256()
+        with self.inputStream as inputStream:
+            for chunk in iter(lambda: inputStream.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
     def saveInputData(self, folder="."):
         assertFolderExist(folder)
         filename = "%s.in" % self.testName
@@ -386,14 +1617,18 @@ class TestProvider:
     def getTests(self):
         raise NotImplementedError()
 
+    _IN_FOLDER = re.compile(r'(?:^|(?<=[/\\]))in(?=[/\\])')
+
+    @staticmethod
+    def testSortKey(testName):
+        name = splitTestName(os.path.basename(testName))
+        # Example tests ("ocen") go first.
+        return not name[2] == "ocen", name
+
     @staticmethod
     def sortTests(testList):
         assert isinstance(testList, list)
-
-        def splitTestPath(testName):
-            return splitTestName(os.path.basename(testName))
-        testList.sort(key=lambda testName: splitTestPath(testName))
-        testList.sort(key=lambda testName: not splitTestPath(testName)[2] == "ocen")
+        testList.sort(key=TestProvider.testSortKey)
 
     @staticmethod
     def onlyWithExtension(testList, extension):
@@ -403,12 +1638,36 @@ class TestProvider:
 
     @staticmethod
     def getOutFilePath(inFilePath):
-        modelOutFilePath = re.sub(r'\.in$', r'.out', inFilePath, flags=re.IGNORECASE)
-        modelOutFilePath = re.sub(r'^in(?=[/\\])', r'out', modelOutFilePath)
-        modelOutFilePath = re.sub(r'([/\\])in(?=[/\\])', r'\1out', modelOutFilePath) 
-        return modelOutFilePath
+        modelOutFilePath = inFilePath
+        if modelOutFilePath[-3:].lower() == '.in':
+            modelOutFilePath = modelOutFilePath[:-3] + '.out'
+        return TestProvider._IN_FOLDER.sub('out', modelOutFilePath)
         
  
+def parseShard(text):
+    """Returns couple (index, count) from shard given as i/N, with i from 1 to N."""
+    try:
+        index, count = [int(number) for number in text.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must be given as i/N, ie 2/4")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("shard number must be between 1 and %s" % count)
+    return index, count
+
+
+def shardTests(tests, shard):
+    """
+    Yields tests which belong to shard (index, count). Tests are assigned to
+    shards by hash of their names, so each test of every source is in exactly
+    one shard, whichever machine computes it.
+    """
+    index, count = shard
+    for test in tests:
+        digest = hashlib.sha256(test.testName.encode()).digest()
+        if int.from_bytes(digest[:8], "big") % count == index - 1:
+            yield test
+
+
 class TestFromFolder(Test):
     def __init__(self, inFilename, modelOutFilename):
         self.inFilename = inFilename
@@ -422,29 +1681,329 @@ class TestFromFolder(Test):
         return self.modelOutFilename is not None
     
     def _generateInputData(self):
-        with open(self.inFilename, 'rb') as inFile:
+        with profilePhase("folder read"), open(self.inFilename, 'rb') as inFile:
             return inFile.read()
     
     def _generateModelOutputData(self):
-        with open(self.modelOutFilename, 'rb') as modelOutFile:
+        with profilePhase("folder read"), open(self.modelOutFilename, 'rb') as modelOutFile:
             return modelOutFile.read()
+
+    @property
+    def inputStream(self):
+        return open(self.inFilename, 'rb')
+
+    @property
+    def modelOutputStream(self):
+        return open(self.modelOutFilename, 'rb')
+
+    def inputFile(self):
+        return self.inFilename
+
+    def modelOutputFile(self):
+        return self.modelOutFilename
+
+    def inputSize(self):
+        return os.path.getsize(self.inFilename)
   
 
+def scanDirectory(path, withStatus=False):
+    """
+    Returns listing of directory: dictionary of its files, with their size
+    and modification time if withStatus is set, and list of subdirectories.
+    Like os.walk, symbolic links to directories are not followed.
+    """
+    files = dict()
+    directories = list()
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        directories.append(entry.name)
+                elif entry.is_file():
+                    if withStatus:
+                        status = entry.stat()
+                        files[entry.name] = [status.st_size, status.st_mtime_ns]
+                    else:
+                        files[entry.name] = None
+            except OSError:
+                continue
+    return {"files": files, "directories": directories}
+
+
+def scanFolderTree(folder, previousListings=None, trustedBefore=0, withStatus=False):
+    """
+    Returns couple (listings of folder and its subdirectories by relative
+    path, whether they differ from previous listings). Previous listing of
+    directory is reused if its modification time didn't change since it
+    was made, and it was made after trustedBefore (in nanoseconds).
+    """
+    previousListings = previousListings or dict()
+    listings = dict()
+    changed = False
+    pending = [""]
+    while pending:
+        relativePath = pending.pop()
+        path = os.path.join(folder, relativePath)
+        try:
+            modificationTime = os.stat(path).st_mtime_ns
+        except OSError:
+            changed = True
+            continue
+
+        listing = previousListings.get(relativePath)
+        if listing is None or listing["mtime"] != modificationTime or modificationTime >= trustedBefore:
+            try:
+                listing = scanDirectory(path, withStatus)
+            except OSError:
+                changed = True
+                continue
+            listing["mtime"] = modificationTime
+            changed = True
+        listings[relativePath] = listing
+        # Directories are visited in the same order as by os.walk.
+        pending.extend(os.path.join(relativePath, name) for name in reversed(listing["directories"]))
+
+    if set(listings) != set(previousListings):
+        changed = True
+    return listings, changed
+
+
+class FolderIndex:
+    """
+    Index of tests in folder, kept on disk, with listings of all its
+    directories (file names, sizes and modification times) and pairs of
+    input and model output files. On next run only modification times of
+    directories are checked, and only changed directories are read again.
+    """
+    defaultFolder = os.path.join(os.path.expanduser("~"), ".cache", "ultima-index")
+    # Directory changed in the same second as it was read could keep its modification time.
+    racyInterval = 2 * 10 ** 9
+    version = 1
+
+    def __init__(self, folderPath, indexFolder=None):
+        self.folderPath = folderPath
+        indexFolder = indexFolder if indexFolder is not None else self.defaultFolder
+        key = hashlib.sha256(os.path.abspath(folderPath).encode()).hexdigest()
+        self.filename = os.path.join(indexFolder, key[:32] + ".json")
+
+    def load(self):
+        try:
+            with open(self.filename) as indexFile:
+                index = json.load(indexFile)
+        except (OSError, ValueError):
+            return None
+        return index if index.get("version") == self.version else None
+
+    def save(self, index):
+        folder = os.path.dirname(self.filename)
+        os.makedirs(folder, exist_ok=True)
+        handle, temporaryPath = tempfile.mkstemp(dir=folder, prefix=".")
+        with os.fdopen(handle, "w") as indexFile:
+            json.dump(index, indexFile)
+        os.replace(temporaryPath, self.filename)
+
+    def getTests(self):
+        """Returns list of couples (input file, model output file or None)."""
+        index = self.load()
+        if index is None:
+            index = {"time": 0, "directories": dict(), "tests": list()}
+
+        scanTime = time.time_ns()
+        listings, changed = scanFolderTree(self.folderPath, index["directories"],
+                                           index["time"] - self.racyInterval, withStatus=True)
+        if changed:
+            tests = findFolderTests(self.folderPath, listings)
+            index = {"version": self.version, "time": scanTime, "directories": listings, "tests": [
+                [os.path.relpath(inFile, self.folderPath), modelOutFile is not None] for inFile, modelOutFile in tests]}
+            try:
+                self.save(index)
+            except OSError as error:
+                print("Could not save index of %s: %s" % (self.folderPath, error))
+            return tests
+
+        tests = list()
+        prefixLength = len(os.path.join(self.folderPath, ""))
+        for inFile, modelOutExists in index["tests"]:
+            inFile = os.path.join(self.folderPath, inFile)
+            modelOutFile = TestProvider.getOutFilePath(inFile)
+            if modelOutFile[:prefixLength] != inFile[:prefixLength]:
+                # Only files in indexed folder are known.
+                modelOutExists = os.path.isfile(modelOutFile)
+            tests.append((inFile, modelOutFile if modelOutExists else None))
+        return tests
+
+
+def findFolderTests(folderPath, listings):
+    """Returns sorted list of couples (input file, model output file or None) from listings of folder."""
+    inFiles = list()
+    files = set()
+    for relativePath, listing in listings.items():
+        directory = os.path.join(folderPath, relativePath, "")
+        for name in listing["files"]:
+            path = directory + name
+            files.add(path)
+            # Same as getFileNameExtension(name) == "in", without splitting name.
+            if name[-3:].lower() == ".in" and name[:-3].lstrip("."):
+                inFiles.append(path)
+    TestProvider.sortTests(inFiles)
+
+    tests = list()
+    prefixLength = len(os.path.join(folderPath, ""))
+    for inFile in inFiles:
+        modelOutFile = TestProvider.getOutFilePath(inFile)
+        if modelOutFile[:prefixLength] == inFile[:prefixLength]:
+            modelOutExists = modelOutFile in files
+        else:
+            modelOutExists = os.path.isfile(modelOutFile)
+        tests.append((inFile, modelOutFile if modelOutExists else None))
+    return tests
+
+
+# Folder with indexes of test folders, or None if they are not indexed.
+folderIndexFolder = None
+
+
 class TestFromFolderProvider(TestProvider):
     def __init__(self, folderPath):
         self.folderPath = folderPath
-        self.fileInList = getFilesFromFolder(folderPath, "in", subdirectories=True)
-              
-        self.sortTests(self.fileInList)
+        if folderIndexFolder is not None:
+            self.tests = FolderIndex(folderPath, folderIndexFolder).getTests()
+        else:
+            self.tests = findFolderTests(folderPath, scanFolderTree(folderPath)[0])
     
     def getTests(self):
-        for inFile in self.fileInList:
-            modelOutFile = self.getOutFilePath(inFile)
-            
-            if not os.path.isfile(modelOutFile):
-                modelOutFile = None
-                
-            yield TestFromFolder(inFile, modelOutFile)      
+        for inFile, modelOutFile in self.tests:
+            yield TestFromFolder(inFile, modelOutFile)
+
+
+class TestDataCache:
+    """
+    On-disk cache of generated inputs and model outputs. Entries are
+    addressed by hash of everything they depend on: contents of generator,
+    test number and suffix for inputs, contents of model solution and input
+    for model outputs. When cache grows over sizeLimit bytes, least recently
+    used entries are removed.
+    """
+    defaultFolder = os.path.join(os.path.expanduser("~"), ".cache", "ultima")
+
+    def __init__(self, folder=None, sizeLimit=None):
+        self.folder = folder if folder is not None else self.defaultFolder
+        self.sizeLimit = sizeLimit
+        self.lock = threading.Lock()
+        self.fileHashes = dict()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.folder, exist_ok=True)
+        self.size = sum(size for _, size, _ in self.entries())
+
+    def fileHash(self, filename):
+        """Returns hash of file contents, computed once for each version of file."""
+        status = os.stat(filename)
+        fileKey = (os.path.abspath(filename), status.st_size, status.st_mtime_ns)
+        with self.lock:
+            if fileKey in self.fileHashes:
+                return self.fileHashes[fileKey]
+
+        digest = hashlib.sha256()
+        with open(filename, "rb") as fileHandle:
+            for chunk in iter(lambda: fileHandle.read(1024 * 1024), b""):
+                digest.update(chunk)
+        with self.lock:
+            self.fileHashes[fileKey] = digest.hexdigest()
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def inputKey(self, generatorPath, testNumber, testNameSuffix):
+        return self.key("in", self.fileHash(generatorPath), testNumber, testNameSuffix)
+
+    def modelOutputKey(self, modelSolutionPath, inputData):
+        return self.key("out", self.fileHash(modelSolutionPath), hashlib.sha256(inputData).hexdigest())
+
+    def entryPath(self, key):
+        return os.path.join(self.folder, key[:2], key)
+
+    def get(self, key):
+        """Returns cached data, or None if there is no entry for key."""
+        path = self.entryPath(key)
+        try:
+            with open(path, "rb") as entry:
+                data = entry.read()
+            # Modification time marks last use.
+            os.utime(path)
+        except OSError:
+            data = None
+
+        with self.lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put(self, key, data):
+        folder = os.path.dirname(self.entryPath(key))
+        os.makedirs(folder, exist_ok=True)
+        # Entry appears at once, other ultima processes could read cache meanwhile.
+        handle, temporaryPath = tempfile.mkstemp(dir=folder, prefix=".")
+        with os.fdopen(handle, "wb") as fileHandle:
+            fileHandle.write(data)
+        os.replace(temporaryPath, self.entryPath(key))
+
+        with self.lock:
+            self.size += len(data)
+            overLimit = self.sizeLimit is not None and self.size > self.sizeLimit
+        if overLimit:
+            # Some space is freed in advance, so cache isn't pruned after every test.
+            self.prune(self.sizeLimit * 9 // 10)
+
+    def getOrCreate(self, key, create):
+        """Returns cached data, calling create and caching its result if there is none."""
+        data = self.get(key)
+        if data is None:
+            data = create()
+            self.put(key, data)
+        return data
+
+    def entries(self):
+        """Yields triples (path, size, time of last use) for all entries."""
+        for directory in os.scandir(self.folder):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    status = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, status.st_size, status.st_mtime
+
+    def prune(self, sizeLimit):
+        """
+        Removes least recently used entries until cache size is at most
+        sizeLimit bytes. Returns number of removed entries.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        size = sum(entrySize for _, entrySize, _ in entries)
+        removed = 0
+        for path, entrySize, _ in entries:
+            if size <= sizeLimit:
+                break
+            if tryDeleteFile(path):
+                removed += 1
+            size -= entrySize
+
+        with self.lock:
+            self.size = size
+        return removed
+
+
+# Cache used by random tests, set by --cache.
+testDataCache = None
 
 
 class RandomTest(Test):
@@ -465,36 +2024,53 @@ class RandomTest(Test):
         return self.modelSolutionPath is not None
     
     def _generateInputData(self):
+        if testDataCache is None:
+            return self._runGenerator()
+        key = testDataCache.inputKey(self.generatorPath, self.testNumber, self.testNameSuffix)
+        return testDataCache.getOrCreate(key, self._runGenerator)
+
+    def _generateModelOutputData(self):
+        if testDataCache is None:
+            return self._runModelSolution()
+        key = testDataCache.modelOutputKey(self.modelSolutionPath, self.inputData)
+        return testDataCache.getOrCreate(key, self._runModelSolution)
+
+    def _runGenerator(self):
         inputStream = io.BytesIO()
         generatorInput = "%s %s" % (self.testNumber, self.testNameSuffix)
         generatorArgsStream = io.BytesIO(generatorInput.encode())
-        code, _ = callProcess(self.generatorPath, generatorArgsStream, inputStream)
+        with profilePhase("generator"):
+            processResult = callProcess(self.generatorPath, generatorArgsStream, inputStream)
         
-        if code != 0:
-            print("\nCritical Error. Input generator crash. Exiting.")
-            exit()
+        if processResult.returnCode != 0:
+            raise CriticalError("Input generator crash.")
             
         inputData = inputStream.getvalue()
         if len(inputData) == 0:
-            print("\nCritical Error. Input generator wrote no output. Exiting.")
-            exit()
+            raise CriticalError("Input generator wrote no output.")
 
         return inputData
             
-    def _generateModelOutputData(self):
+    def _runModelSolution(self):
         modelOutputStream = io.BytesIO()
-        code, _ = callProcess(self.modelSolutionPath, self.inputStream, modelOutputStream)
+        with profilePhase("model solution"):
+            processResult = callProcess(self.modelSolutionPath, self.inputStream, modelOutputStream)
         
-        if code != 0:
-            print("\nCritical Error. Model solution crash. Exiting.")
-            exit()
+        if processResult.returnCode != 0:
+            raise CriticalError("Model solution crash.")
         
         modelOutputData = modelOutputStream.getvalue()
         if len(modelOutputData) == 0:
-            print("\nCritical Error. Model solution wrote no output. Exiting.")
-            exit()
+            raise CriticalError("Model solution wrote no output.")
 
         return modelOutputData
+
+    def prefetchInputData(self):
+        return self.inputData
+
+    def prefetchModelOutputData(self):
+        if self.haveModelOutput:
+            return self.modelOutputData
     
     
 class RandomTestProvider(TestProvider):
@@ -517,12 +2093,73 @@ class RandomTestProvider(TestProvider):
                 break 
 
 
+# Zstandard compression method of zip format, zipfile doesn't support it.
+ZIP_ZSTANDARD = 93
+
+# Errors raised when reading corrupt zip member.
+_ZIP_ERRORS = (zipfile.BadZipFile, zlib.error, EOFError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+class ZipReader:
+    """
+    Reads files from zip archive, from many threads at once. Central directory
+    is parsed once, file data is taken from memory map of archive, so threads
+    don't share file position, and decompressed by zlib, which releases GIL.
+    Zstandard compressed files are supported if zstandard module is installed.
+    Files compressed otherwise are read by zipfile, with handle per thread.
+    """
+    _LOCAL_HEADER = struct.Struct("<4s22xHH")
+    _METHODS = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) + ((ZIP_ZSTANDARD,) if zstandard is not None else ())
+
+    def __init__(self, filename):
+        self.filename = filename
+        with zipfile.ZipFile(filename) as zipFile:
+            self.infos = dict((info.filename, info) for info in zipFile.infolist())
+        with open(filename, 'rb') as fileHandle:
+            self.map = mmap.mmap(fileHandle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.local = threading.local()
+
+    def namelist(self):
+        return list(self.infos)
+
+    def read(self, name):
+        """Returns contents of file, raises zipfile.BadZipFile if it is corrupt."""
+        info = self.infos[name]
+        encrypted = info.flag_bits & 0x1
+        if encrypted or info.compress_type not in self._METHODS:
+            return self._zipFile().read(name)
+
+        _, data = self.readCompressed(name)
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS, max(info.file_size, 1))
+        elif info.compress_type == ZIP_ZSTANDARD:
+            data = zstandard.ZstdDecompressor().decompress(data, max_output_size=max(info.file_size, 1))
+        if len(data) != info.file_size or zlib.crc32(data) != info.CRC:
+            raise zipfile.BadZipFile("Bad CRC-32 for file %s" % name)
+        return data
+
+    def readCompressed(self, name):
+        """Returns couple (ZipInfo, data) for file, with data as stored in archive."""
+        info = self.infos[name]
+        headerEnd = info.header_offset + self._LOCAL_HEADER.size
+        signature, nameLength, extraLength = self._LOCAL_HEADER.unpack(self.map[info.header_offset:headerEnd])
+        if signature != b"PK\x03\x04":
+            raise zipfile.BadZipFile("Bad local header of file %s" % name)
+        dataStart = headerEnd + nameLength + extraLength
+        return info, self.map[dataStart:dataStart + info.compress_size]
+
+    def _zipFile(self):
+        if not hasattr(self.local, 'zipFile'):
+            self.local.zipFile = zipfile.ZipFile(self.filename)
+        return self.local.zipFile
+
+
 class TestFromZip(Test):
-    def __init__(self, zipFile, inFilename, modelOutFilename):
+    def __init__(self, zipReader, inFilename, modelOutFilename):
         testBaseName = os.path.basename(inFilename)
         testName = os.path.splitext(testBaseName)[0]
         Test.__init__(self, testName)
-        self.zipFile = zipFile
+        self.zipReader = zipReader
         self.inFilename = inFilename
         self.modelOutFilename = modelOutFilename
 
@@ -531,22 +2168,64 @@ class TestFromZip(Test):
         return self.modelOutFilename is not None
     
     def _generateInputData(self):
-        with self.zipFile.open(self.inFilename, 'r') as fileInputData:
-            return fileInputData.read()
+        return self._readMember(self.inFilename)
+
+    def inputSize(self):
+        return self.zipReader.infos[self.inFilename].file_size
         
     def _generateModelOutputData(self):
-        with self.zipFile.open(self.modelOutFilename, 'r') as fileModelOutputData:
-            return fileModelOutputData.read()
+        return self._readMember(self.modelOutFilename)
+
+    def prefetchInputData(self):
+        return self.inputData
+
+    def prefetchModelOutputData(self):
+        if self.haveModelOutput:
+            return self.modelOutputData
+
+    def _readMember(self, name):
+        """Reads file from archive, checking its CRC."""
+        try:
+            with profilePhase("zip read"):
+                return self.zipReader.read(name)
+        except _ZIP_ERRORS:
+            raise CriticalError("Corrupt file %s in zip archive." % name)
+
+
+class ZipVerifier(threading.Thread):
+    """Checks integrity of all files in zip archive in background, reporting corrupt ones."""
+    def __init__(self, filename):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.filename = filename
+        self.corruptFiles = list()
+
+    def run(self):
+        with zipfile.ZipFile(self.filename) as zipFile:
+            for info in zipFile.infolist():
+                try:
+                    with zipFile.open(info) as member:
+                        while member.read(1024 * 1024):
+                            pass
+                except _ZIP_ERRORS:
+                    self.corruptFiles.append(info.filename)
+                    print("\nCorrupt file %s in %s" % (info.filename, self.filename))
+
+
+# Set by --verify_zip.
+verifyZipInBackground = False
 
 
 class TestFromZipProvider(TestProvider):
     def __init__(self, filename):
         assertFileExist(filename)
-        self.zipFile = zipfile.ZipFile(filename)
-        if self.zipFile.testzip() is not None:
-            raise zipfile.BadZipfile()
+        # Archive is not tested as a whole before tests start, each file
+        # is checked when it is read.
+        self.zipReader = ZipReader(filename)
+        if verifyZipInBackground:
+            ZipVerifier(filename).start()
         
-        namelist = self.zipFile.namelist()
+        namelist = self.zipReader.namelist()
            
         self.fileInList = self.onlyWithExtension(namelist, "in")
         self.fileOutList = self.onlyWithExtension(namelist, "out")                
@@ -560,19 +2239,68 @@ class TestFromZipProvider(TestProvider):
             if modelOutFile not in self.fileOutList:
                 modelOutFile = None
                 
-            yield TestFromZip(self.zipFile, filename, modelOutFile)   
+            yield TestFromZip(self.zipReader, filename, modelOutFile)   
+
+
+_checkerModule = None
+
+
+def _importCheckerModule(moduleName, modulePath):
+    global _checkerModule
+    sys.path[:0] = modulePath
+    _checkerModule = importlib.import_module(moduleName)
+
+
+def _checkFiles(inputFilename, outputFilename, modelOutputFilename):
+    with open(inputFilename, "rb") as inS, open(outputFilename, "rb") as outS, open(modelOutputFilename, "rb") as modelS:
+        return _checkerModule.check(inS, outS, modelS)
+
+
+class CheckerPool:
+    """
+    Runs check function of checker module in worker processes.
+    Each worker imports module once, tests are passed to it as file names.
+    """
+    def __init__(self, moduleName, processes):
+        self.pool = ProcessPoolExecutor(processes, initializer=_importCheckerModule,
+                                        initargs=(moduleName, sys.path))
+
+    def fullResultCheck(self, test, runResult):
+        """Returns couple (is_correct, message)."""
+        message = self.pool.submit(_checkFiles, test.inputFile(), runResult.output.outputFile(),
+                                   test.modelOutputFile()).result()
+        return message == "OK", message
+
+    def shutdown(self):
+        self.pool.shutdown()
 
 
 class RunResult:
     def __init__(self):
         self.returnCode = None
         self.processTime = None
+        self.wallTime = None
+        self.userTime = None
+        self.systemTime = None
+        self.peakMemory = None
         self.result = None
-        self.outputData = b""
+        self.message = None
+        self.inputHash = None
+        self.cpuTimes = list()
+        self.cpus = None
+        self.output = OutputBuffer()
+
+    @property
+    def outputData(self):
+        return self.output.getvalue()
+
+    @property
+    def outputSize(self):
+        return self.output.size
         
     @property
     def outputStream(self):
-        return io.BytesIO(self.outputData)
+        return self.output.openStream()
     
 
 class BasicRunner:
@@ -580,32 +2308,118 @@ class BasicRunner:
         assertFileExist(programName)            
         self.programName = programName
         self.timeLimit = 10
+        self.wallTimeLimit = None
+        self.memoryLimit = None
+        self.addressSpaceLimit = None
         self.ignoreOutput = False
+        self.outputSpillSize = 16 * 1024 * 1024
+        self.outputLimit = None
+        # Output is written by program straight to temporary file if set, or, if None,
+        # once some output was larger than outputSpillSize and would be spilled anyway.
+        self.directOutput = None
+        self.largeOutputs = False
+        self.checkerPool = None
+        self.repeat = 1
+        self.warmup = 0
+        self.cpuSlots = None
+        self.cluster = None
     
     def run(self, test):
         return self.doRun(self.programName, test)
+
+    def getWallTimeLimit(self):
+        """Programs are killed after wallTimeLimit, by default twice the CPU time limit."""
+        if self.wallTimeLimit is not None:
+            return self.wallTimeLimit
+        return 2 * self.timeLimit
     
     def doRun(self, command, test):
-        runResult = RunResult()
-        outputStream = io.BytesIO()
-        runResult.returnCode, runResult.processTime = callProcess(command, test.inputStream, outputStream, self.timeLimit)
-        runResult.outputData = outputStream.getvalue()
-        
+        if self.cpuSlots is None:
+            runResult = self.measure(command, test)
+        else:
+            cpus = self.cpuSlots.get()
+            try:
+                runResult = self.measure(command, test, cpus)
+                runResult.cpus = cpus
+            finally:
+                self.cpuSlots.put(cpus)
+        if runResult.result is not None:
+            return runResult
+
         runResult.result = "OK"
-        if runResult.processTime >= self.timeLimit:
-            runResult.result = "TLE"
-        elif runResult.returnCode != 0:
-            runResult.result = "RE"
-        elif self.ignoreOutput:
+        if self.ignoreOutput:
             runResult.result = "IGNORE"
-        elif len(runResult.outputData) == 0:
+        elif runResult.outputSize == 0:
             runResult.result = "NF"
         elif not test.haveModelOutput:
             runResult.result = "NOMODEL"        
-        elif not resultCheck(test.inputStream, runResult.outputStream, test.modelOutputStream):
-            runResult.result = "WA"                  
+        else:
+            with profilePhase("check"):
+                correct, runResult.message = self.checkOutput(test, runResult)
+            if not correct:
+                runResult.result = "WA"
                     
         return runResult
+
+    def measure(self, command, test, cpus=None):
+        """Runs program on test as many times as set, returns result of first run with times of all."""
+        if self.cluster is not None:
+            return self.cluster.measure(test)
+        for _ in range(self.warmup):
+            self.runProcess(command, test, cpus).output.close()
+
+        runResult = self.runProcess(command, test, cpus)
+        runResult.cpuTimes = [runResult.processTime]
+        # Program is run again only to measure time, its output is checked once.
+        while runResult.result is None and len(runResult.cpuTimes) < self.repeat:
+            repeatedResult = self.runProcess(command, test, cpus)
+            runResult.cpuTimes.append(repeatedResult.processTime)
+            if repeatedResult.result is not None:
+                repeatedResult.cpuTimes = runResult.cpuTimes
+                runResult.output.close()
+                runResult = repeatedResult
+            else:
+                repeatedResult.output.close()
+        return runResult
+
+    def runProcess(self, command, test, cpus=None):
+        """Runs program on test once. Result is set only if program failed, ie exceeded time limit."""
+        runResult = RunResult()
+        runResult.output = OutputBuffer(self.outputSpillSize, self.outputLimit)
+        directOutput = self.directOutput if self.directOutput is not None else self.largeOutputs
+        # Output limit of program writing directly to file is enforced by system.
+        directOutput = directOutput and (self.outputLimit is None or resource is not None)
+        outputStream = runResult.output.directFile() if directOutput else runResult.output
+        with test.inputStream as inputStream, profilePhase("program"):
+            processResult = callProcess(command, inputStream, outputStream, self.getWallTimeLimit(),
+                                        self.timeLimit, self.addressSpaceLimit, self.outputLimit, cpus)
+        runResult.output.updateSize()
+        if runResult.output.size > self.outputSpillSize:
+            self.largeOutputs = True
+        runResult.returnCode = processResult.returnCode
+        runResult.processTime = processResult.cpuTime
+        runResult.wallTime = processResult.wallTime
+        runResult.userTime = processResult.userTime
+        runResult.systemTime = processResult.systemTime
+        runResult.peakMemory = processResult.peakMemory
+        
+        if processResult.timedOut or runResult.processTime >= self.timeLimit:
+            runResult.result = "TLE"
+        elif self.memoryLimit is not None and runResult.peakMemory is not None and runResult.peakMemory > self.memoryLimit:
+            runResult.result = "MLE"
+        elif runResult.output.overflow:
+            runResult.result = "OLE"
+        elif runResult.returnCode != 0:
+            runResult.result = "RE"
+        return runResult
+
+    def checkOutput(self, test, runResult):
+        """Returns couple (is_correct, message)."""
+        if self.checkerPool is not None:
+            return self.checkerPool.fullResultCheck(test, runResult)
+        with test.inputStream as inputStream, runResult.outputStream as outputStream, \
+                test.modelOutputStream as modelOutputStream:
+            return fullResultCheck(inputStream, outputStream, modelOutputStream)
     
      
 class OITimeToolRunner(BasicRunner):
@@ -688,56 +2502,708 @@ def getRunnerFromArgs(args):
     runner.ignoreOutput = args.ignore_out
     if args.time_limit is not None:
         runner.timeLimit = args.time_limit
+    if args.wall_time_limit is not None:
+        runner.wallTimeLimit = args.wall_time_limit
+    if args.memory_limit is not None:
+        runner.memoryLimit = int(args.memory_limit * 1024 * 1024)
+    if args.address_space_limit is not None:
+        runner.addressSpaceLimit = int(args.address_space_limit * 1024 * 1024)
+    if args.output_limit is not None:
+        runner.outputLimit = int(args.output_limit * 1024 * 1024)
+    if args.spill_after is not None:
+        runner.outputSpillSize = int(args.spill_after * 1024 * 1024)
+    if args.direct_output:
+        runner.directOutput = True
+    runner.repeat = args.repeat
+    runner.warmup = args.warmup
+    if args.cpu_affinity:
+        runner.cpuSlots = CpuSlots(args.threads, args.reserve_cpu)
+    if args.serve is not None:
+        runner.cluster = Cluster(args.serve, runner)
         
     return runner
 
 
-def testingLoop(testProviderList, runner, args):    
-    number_of_fails = 0
-    number_of_tests = 0
-    number_of_ignored = 0
-    for testProviderArgs in testProviderList:    
-        TestProviderClass = testProviderArgs[0]
-        testProviderArgs = testProviderArgs[1]
-        print("Processing tests from \"%s\"" % (testProviderArgs,))
-        testProvider = TestProviderClass(*testProviderArgs)
-        for test in testProvider.getTests():
-            if args.break_after is not None and number_of_fails >= args.break_after:
+class CpuSlots:
+    """
+    Disjoint sets of CPUs, one for each parallel worker. Program is pinned
+    to set taken for its test, so programs run at once don't share cores.
+    First CPU could be left for ultima itself.
+    """
+    def __init__(self, workers, reserveCpu=False):
+        cpus = sorted(os.sched_getaffinity(0))
+        if reserveCpu:
+            cpus = cpus[1:]
+        if len(cpus) < workers:
+            raise ValueError("%s CPUs available for %s workers" % (len(cpus), workers))
+        self.slots = queue.Queue()
+        size = len(cpus) // workers
+        for worker in range(workers):
+            self.slots.put(cpus[worker * size:(worker + 1) * size])
+
+    def get(self):
+        return self.slots.get()
+
+    def put(self, cpus):
+        self.slots.put(cpus)
+
+
+def parseAddress(text):
+    """Returns couple (host, port) from address given as [HOST:]PORT, host is empty if not given."""
+    host, _, port = text.rpartition(":")
+    if not port.isdigit() or int(port) > 65535:
+        raise argparse.ArgumentTypeError("address must be given as [HOST:]PORT, ie localhost:4000")
+    return host.strip("[]"), int(port)
+
+
+def configureConnection(connection):
+    """Disables delay of small messages, lost peers are detected by keep-alive probes."""
+    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (("TCP_KEEPIDLE", 10), ("TCP_KEEPINTVL", 5), ("TCP_KEEPCNT", 3)):
+        if hasattr(socket, option):
+            connection.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+class Channel:
+    """
+    Messages exchanged by coordinator and workers. Message is JSON object,
+    optionally followed by stream of data, ie test input or program output,
+    compressed with zlib and sent in frames, so it is never whole in memory.
+    Lost connection raises ConnectionError.
+    """
+    _FRAME = struct.Struct("<I")
+    chunkSize = 1024 * 1024
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.file = connection.makefile("rb")
+
+    def send(self, message, stream=None):
+        self._sendFrame(json.dumps(dict(message, data=stream is not None)).encode())
+        if stream is None:
+            return
+        compressor = zlib.compressobj(1)
+        for chunk in iter(lambda: stream.read(self.chunkSize), b""):
+            compressed = compressor.compress(chunk)
+            if compressed:
+                self._sendFrame(compressed)
+        compressed = compressor.flush()
+        if compressed:
+            self._sendFrame(compressed)
+        # Empty frame ends the stream.
+        self._sendFrame(b"")
+
+    def receive(self, sink=None):
+        """Returns message, data which follows it is written to sink."""
+        message = json.loads(self._receiveFrame().decode())
+        if message["data"]:
+            decompressor = zlib.decompressobj()
+            frame = self._receiveFrame()
+            while frame:
+                # Output of decompression is bounded, data could be highly compressed.
+                while frame:
+                    chunk = decompressor.decompress(frame, self.chunkSize)
+                    if sink is not None:
+                        sink.write(chunk)
+                    frame = decompressor.unconsumed_tail
+                frame = self._receiveFrame()
+        return message
+
+    def _sendFrame(self, data):
+        self.connection.sendall(self._FRAME.pack(len(data)) + data)
+
+    def _receiveFrame(self):
+        header = self.file.read(self._FRAME.size)
+        if len(header) < self._FRAME.size:
+            raise ConnectionError("connection closed")
+        length, = self._FRAME.unpack(header)
+        data = self.file.read(length)
+        if len(data) < length:
+            raise ConnectionError("connection closed")
+        return data
+
+    def close(self):
+        self.file.close()
+        self.connection.close()
+
+
+class _ClusterTask:
+    def __init__(self, test):
+        self.test = test
+        self.done = threading.Event()
+        self.runResult = None
+        self.error = None
+
+
+class Cluster:
+    """
+    Coordinator of workers (worker.py) connected over TCP. Each connection
+    is a slot which runs program on one test at a time, with limits of
+    runner; output is sent back and checked here. Tests wait in queue, from
+    which idle slots take them, each test is run by one slot only, so its
+    time is measured on one machine. Test of slot which disconnected or did
+    not reply in time goes back to queue.
+    """
+    maxSlots = 256
+    # Time for sending input and output, besides runs of program.
+    replyMargin = 60.0
+    resultFields = ("result", "returnCode", "processTime", "wallTime", "userTime", "systemTime", "peakMemory",
+                    "cpuTimes")
+
+    def __init__(self, address, runner):
+        self.runner = runner
+        with open(runner.programName, "rb") as programFile:
+            self.program = programFile.read()
+        self.setup = {"type": "setup", "program": os.path.basename(runner.programName),
+                      "digest": hashlib.sha256(self.program).hexdigest(), "timeLimit": runner.timeLimit,
+                      "wallTimeLimit": runner.getWallTimeLimit(), "memoryLimit": runner.memoryLimit,
+                      "addressSpaceLimit": runner.addressSpaceLimit, "outputLimit": runner.outputLimit,
+                      "outputSpillSize": runner.outputSpillSize, "repeat": runner.repeat, "warmup": runner.warmup}
+        self.replyTimeout = (runner.repeat + runner.warmup) * runner.getWallTimeLimit() + self.replyMargin
+        self.condition = threading.Condition()
+        self.pending = deque()
+        self.running = set()
+        self.slots = 0
+        self.closed = False
+        # Anyone who connects gets program and tests, other machines are let in only with explicit host.
+        host, port = address
+        self.server = socket.create_server((host or "127.0.0.1", port), backlog=self.maxSlots)
+        self.address = self.server.getsockname()[:2]
+        print("Waiting for workers on %s:%s" % self.address)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def measure(self, test):
+        """Returns result of program run on test by one of workers, without verdict on output."""
+        task = _ClusterTask(test)
+        with self.condition:
+            self.pending.append(task)
+            self.condition.notify()
+        with profilePhase("worker"):
+            task.done.wait()
+        if task.error is not None:
+            raise task.error
+        return task.runResult
+
+    def cancel(self):
+        """Ends waiting for all tests given to measure."""
+        with self.condition:
+            for task in itertools.chain(self.pending, self.running):
+                if not task.done.is_set():
+                    task.error = CriticalError("Test %s was cancelled." % task.test.testName)
+                    task.done.set()
+            self.pending.clear()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, address = self.server.accept()
+            except OSError:
                 return
-            
-            if args.tests_limit is not None and number_of_tests >= args.tests_limit:
+            threading.Thread(target=self._serve, args=(connection, "%s:%s" % address[:2]), daemon=True).start()
+
+    def _serve(self, connection, name):
+        channel = Channel(connection)
+        try:
+            configureConnection(connection)
+            connection.settimeout(self.replyTimeout)
+            channel.send(self.setup, io.BytesIO(self.program))
+            channel.receive()
+        except (OSError, ValueError):
+            channel.close()
+            return
+        with self.condition:
+            if self.slots >= self.maxSlots:
+                channel.close()
                 return
-            
-            if args.keyword is not None and test.testName.find(args.keyword) == -1:
+            self.slots += 1
+            self.condition.notify_all()
+
+        task = None
+        try:
+            while True:
+                task = self._nextTask()
+                if task is None:
+                    break
+                try:
+                    inputStream = task.test.inputStream
+                except Exception as error:
+                    # Ie generator crashed, test could not be run anywhere.
+                    self._complete(task, None, error)
+                    continue
+                with inputStream:
+                    runResult = self._run(channel, task.test.testName, inputStream)
+                self._complete(task, runResult)
+                task = None
+        except socket.timeout:
+            print("Worker %s did not reply in time%s" % (name, ", test %s is run again" % task.test.testName
+                                                          if task else ""))
+        except (OSError, ValueError, zlib.error):
+            print("Worker %s disconnected%s" % (name, ", test %s is run again" % task.test.testName if task else ""))
+        finally:
+            with self.condition:
+                self.slots -= 1
+                if task is not None:
+                    self._requeue(task)
+            channel.close()
+
+    def _run(self, channel, testName, inputStream):
+        channel.send({"type": "test", "name": testName}, inputStream)
+        runResult = RunResult()
+        runResult.output = OutputBuffer(self.runner.outputSpillSize)
+        reply = channel.receive(runResult.output)
+        for field in self.resultFields:
+            setattr(runResult, field, reply[field])
+        return runResult
+
+    def _nextTask(self):
+        with self.condition:
+            while not self.closed:
+                if self.pending:
+                    task = self.pending.popleft()
+                    self.running.add(task)
+                    return task
+                self.condition.wait()
+        return None
+
+    def _complete(self, task, runResult, error=None):
+        with self.condition:
+            self.running.discard(task)
+            if task.done.is_set():
+                # Test was cancelled.
+                if runResult is not None:
+                    runResult.output.close()
+                return
+            task.runResult = runResult
+            task.error = error
+            task.done.set()
+
+    def _requeue(self, task):
+        self.running.discard(task)
+        if task.done.is_set():
+            return
+        self.pending.appendleft(task)
+        self.condition.notify()
+
+
+class RunHistory:
+    """
+    SQLite database of testing runs, with CPU time, wall time and peak
+    memory of each test. Programs are identified by hash of their file,
+    tests by name and hash of input, so runs of different versions of
+    program on the same tests could be compared.
+    """
+    defaultFilename = os.path.join(os.path.expanduser("~"), ".cache", "ultima-history.sqlite")
+    # Verdicts of runs which time is comparable.
+    timedVerdicts = ("OK", "IGNORE", "NOMODEL")
+    # Differences of CPU time below this are treated as noise.
+    noiseSeconds = 0.01
+
+    def __init__(self, filename=None):
+        self.filename = filename if filename is not None else self.defaultFilename
+        if os.path.dirname(self.filename):
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.filename, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, time REAL, program TEXT, programHash TEXT);
+            CREATE TABLE IF NOT EXISTS results (run INTEGER, test TEXT, inputHash TEXT, verdict TEXT,
+                                                cpuTime REAL, wallTime REAL, peakMemory INTEGER, cpuTimes TEXT);
+            CREATE INDEX IF NOT EXISTS resultsRun ON results (run);
+        """)
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(results)")]
+        if "cpuTimes" not in columns:
+            with self.connection:
+                self.connection.execute("ALTER TABLE results ADD COLUMN cpuTimes TEXT")
+        self.runId = None
+
+    def startRun(self, programPath):
+        """Starts recording run of program, returns its id."""
+        digest = hashlib.sha256()
+        with open(programPath, "rb") as programFile:
+            for chunk in iter(lambda: programFile.read(1024 * 1024), b""):
+                digest.update(chunk)
+        with self.lock, self.connection:
+            cursor = self.connection.execute("INSERT INTO runs (time, program, programHash) VALUES (?, ?, ?)",
+                                             (time.time(), os.path.abspath(programPath), digest.hexdigest()))
+        self.runId = cursor.lastrowid
+        return self.runId
+
+    def addResult(self, testName, inputHash, runResult):
+        """
+        Adds result of test. If program was run several times, median CPU
+        time is saved, together with all CPU times.
+        """
+        cpuTime = runResult.processTime
+        cpuTimes = None
+        if len(runResult.cpuTimes) > 1:
+            cpuTime = statistics.median(runResult.cpuTimes)
+            cpuTimes = json.dumps(runResult.cpuTimes)
+        with self.lock, self.connection:
+            self.connection.execute("INSERT INTO results (run, test, inputHash, verdict, cpuTime, wallTime, peakMemory, "
+                                    "cpuTimes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (self.runId, testName, inputHash, runResult.result, cpuTime, runResult.wallTime,
+                                     runResult.peakMemory, cpuTimes))
+
+    def runs(self, limit=None):
+        """Returns rows (id, time, program, program hash, tests, failures, CPU time), newest first."""
+        query = """SELECT runs.id, runs.time, runs.program, runs.programHash, COUNT(results.run),
+                          SUM(results.verdict NOT IN ('OK', 'IGNORE')), SUM(results.cpuTime)
+                   FROM runs LEFT JOIN results ON results.run = runs.id GROUP BY runs.id ORDER BY runs.id DESC"""
+        if limit is not None:
+            query += " LIMIT %d" % limit
+        with self.lock:
+            return self.connection.execute(query).fetchall()
+
+    def run(self, runId):
+        """Returns row (id, time, program, program hash) of run, or None."""
+        with self.lock:
+            return self.connection.execute("SELECT * FROM runs WHERE id = ?", (runId,)).fetchone()
+
+    def previousRun(self, runId):
+        """Returns id of last run of the same program file before given one, or None."""
+        with self.lock:
+            row = self.connection.execute("SELECT id FROM runs WHERE id < ? AND program = "
+                                          "(SELECT program FROM runs WHERE id = ?) ORDER BY id DESC LIMIT 1",
+                                          (runId, runId)).fetchone()
+        return row[0] if row is not None else None
+
+    def recordedTimes(self, programPath):
+        """Returns dictionary from test name to median wall time in last run of program with that test."""
+        with self.lock:
+            rows = self.connection.execute("SELECT results.run, results.test, results.verdict, results.wallTime "
+                                           "FROM results JOIN runs ON results.run = runs.id WHERE runs.program = ? "
+                                           "ORDER BY results.run", (os.path.abspath(programPath),)).fetchall()
+        times = dict()
+        for runId, test, verdict, wallTime in rows:
+            if verdict not in self.timedVerdicts and verdict != "TLE":
                 continue
-                        
+            if test not in times or times[test][0] != runId:
+                times[test] = (runId, list())
+            times[test][1].append(wallTime)
+        return dict((test, statistics.median(testTimes)) for test, (_, testTimes) in times.items())
+
+    def samples(self, runId):
+        """Returns dictionary from (test, input hash) to list of CPU times of runs with comparable time."""
+        samples = collections.OrderedDict()
+        with self.lock:
+            rows = self.connection.execute("SELECT test, inputHash, verdict, cpuTime, cpuTimes FROM results "
+                                           "WHERE run = ? ORDER BY rowid", (runId,)).fetchall()
+        for test, inputHash, verdict, cpuTime, cpuTimes in rows:
+            if verdict in self.timedVerdicts:
+                times = json.loads(cpuTimes) if cpuTimes is not None else [cpuTime]
+                samples.setdefault((test, inputHash), list()).extend(times)
+        return samples
+
+    @staticmethod
+    def signTestPValue(slower, faster):
+        """Probability of at least slower of slower + faster tests being slower if programs are equally fast."""
+        tests = slower + faster
+        tail = 0
+        term = math.comb(tests, slower)
+        for count in range(slower, tests + 1):
+            tail += term
+            term = term * (tests - count) // (count + 1)
+        # Integers are divided exactly, 2.0 ** tests overflows over about 1000 tests.
+        return tail / 2 ** tests
+
+    def compare(self, runId, baselineId, tolerance=0.1):
+        """
+        Compares CPU times of tests in run with baseline run. Returns couple
+        (list of slowed down tests, summary dictionary). Test is slowed down
+        if its median time grew more than tolerance (fraction) and noise,
+        and, if both runs have several times of test, if all its times are
+        over all baseline times. Whole run is compared by sign test.
+        """
+        baseline = self.samples(baselineId)
+        slowdowns = list()
+        compared = slower = faster = 0
+        totalTime = baselineTime = 0.0
+        for key, times in self.samples(runId).items():
+            if key not in baseline:
+                continue
+            baseTimes = baseline[key]
+            median = statistics.median(times)
+            baseMedian = statistics.median(baseTimes)
+            compared += 1
+            totalTime += median
+            baselineTime += baseMedian
+
+            if abs(median - baseMedian) <= self.noiseSeconds:
+                continue
+            if median > baseMedian:
+                slower += 1
+            else:
+                faster += 1
+            significant = median > baseMedian * (1 + tolerance)
+            if len(times) > 1 and len(baseTimes) > 1:
+                significant = significant and min(times) > max(baseTimes)
+            if significant:
+                slowdowns.append((key[0], baseMedian, median))
+
+        summary = {"compared": compared, "slower": slower, "faster": faster,
+                   "pValue": self.signTestPValue(slower, faster), "time": totalTime, "baselineTime": baselineTime}
+        return slowdowns, summary
+
+    def printComparison(self, runId, baselineId, tolerance=0.1):
+        baselineRun = self.run(baselineId)
+        if baselineRun is None:
+            print("There is no run %s in history." % baselineId)
+            return
+        print("Comparison with run %s of %s from %s:" % (baselineId, baselineRun[2],
+                                                          time.strftime("%Y-%m-%d %H:%M", time.localtime(baselineRun[1]))))
+        slowdowns, summary = self.compare(runId, baselineId, tolerance)
+        for testName, baseMedian, median in slowdowns:
+            print("  %s slower: %.2f sec -> %.2f sec (%+.0f%%)" % (testName, baseMedian, median,
+                                                                   100.0 * (median / max(baseMedian, 1e-9) - 1)))
+        print("Common tests: %s, slower: %s, faster: %s, sign test p-value: %.3g" % (
+            summary["compared"], summary["slower"], summary["faster"], summary["pValue"]))
+        if summary["baselineTime"] > 0:
+            print("Total CPU time of common tests: %.2f sec -> %.2f sec (%+.1f%%)" % (
+                summary["baselineTime"], summary["time"], 100.0 * (summary["time"] / summary["baselineTime"] - 1)))
+
+
+# History of runs, set by --history.
+runHistory = None
+
+
+class TestReport:
+    """
+    Writes results of tests to file as JSON lines, record of each test when
+    it finishes and summary record at the end. File is flushed after each
+    record, so it could be read while testing goes on.
+    """
+    def __init__(self, filename):
+        self.lock = threading.Lock()
+        self.file = open(filename, "w")
+
+    def write(self, record):
+        line = json.dumps(record, default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def writeTest(self, test, runResult):
+        self.write({"type": "test", "name": test.testName, "verdict": runResult.result,
+                    "cpuTime": runResult.processTime, "wallTime": runResult.wallTime,
+                    "cpuTimes": runResult.cpuTimes, "cpus": runResult.cpus, "peakMemory": runResult.peakMemory,
+                    "outputSize": runResult.outputSize, "message": runResult.message})
+
+    def writeSummary(self, functor, completed):
+        shard = functor.args.shard
+        self.write({"type": "summary", "total": functor.number_of_tests, "ignored": functor.number_of_ignored,
+                    "failures": functor.number_of_fails, "stopped": functor.stopped, "completed": completed,
+                    "shard": "%s/%s" % shard if shard is not None else None})
+
+    def close(self):
+        self.file.close()
+
+
+class TestingFunctor(Functor):
+    def __init__(self, runner, args):
+        Functor.__init__(self)
+        self.runner = runner
+        self.args = args
+        self.announce = args.threads == 1 and args.serve is None
+        self.stopped = False
+        self.number_of_fails = 0
+        self.number_of_tests = 0
+        self.number_of_ignored = 0
+        self.report = TestReport(args.report) if args.report is not None else None
+        # Set by limitTests if there were tests over tests limit.
+        self.overLimit = False
+        # Couples (minimum, median) of CPU times, and relative standard deviations, of repeated tests.
+        self.cpuTimeStats = list()
+        self.relativeDeviations = list()
+
+    def should_stop(self):
+        if self.args.break_after is not None and self.number_of_fails >= self.args.break_after:
+            return True
+
+        if self.args.tests_limit is not None and self.number_of_tests >= self.args.tests_limit:
+            return True
+
+        return False
+
+    def selectTests(self, tests):
+        for test in tests:
+            if self.should_stop():
+                self.stopped = True
+                return
+
+            if self.args.keyword is not None and test.testName.find(self.args.keyword) == -1:
+                continue
+
+            yield test
+
+    def limitTests(self, tests):
+        """
+        Yields tests up to tests limit, counting tests run before. Tests
+        are taken ahead of running them, ie by pipeline or parallel tasks,
+        so tests over limit are not yielded at all; only one more is taken,
+        to learn whether testing stops after these tests.
+        """
+        if self.args.tests_limit is None:
+            yield from tests
+            return
+        tests = iter(tests)
+        yield from itertools.islice(tests, max(self.args.tests_limit - self.number_of_tests, 0))
+        if next(tests, None) is not None:
+            self.overLimit = True
+
+    def work(self, test):
+        if self.announce:
             sys.stdout.write("%s " % test.testName)
             sys.stdout.flush()
-            runResult = runner.run(test)         
-    
-            print("%s, time: %.2f sec" % (runResult.result, runResult.processTime))
-            
-            number_of_tests += 1
-            if runResult.result not in ("OK", "IGNORE"):
-                number_of_fails += 1
-                print(advancedResultCheck(test.inputStream, runResult.outputStream, test.modelOutputStream))
-                
-                if args.wrong_folder is not None:
-                    createFolder(args.wrong_folder)
-                    test.saveInputData(folder=args.wrong_folder)
-                    test.saveModelOutputData(folder=args.wrong_folder)
-                    
-                if args.wait_after_error:
-                    waitForKey()
 
-            elif runResult.result == "IGNORE":
-                number_of_ignored += 1
+        runResult = self.runner.run(test)
+        if runResult.result not in ("OK", "IGNORE", "WA") and test.haveModelOutput:
+            runResult.message = self.runner.checkOutput(test, runResult)[1]
+        if runHistory is not None:
+            runResult.inputHash = test.inputDigest()
+        return runResult
+
+    def finish(self, test, runResult):
+        if runResult is None:
+            return
 
-    print("Total tests: " + str(number_of_tests))
-    print("Ignored: " + str(number_of_ignored))
-    print("Run: " + str(number_of_tests - number_of_ignored))
-    print("Successes: " + str(number_of_tests - number_of_ignored - number_of_fails))
-    print("Failures: " + str(number_of_fails))
+        # Tests started in parallel after the limit was reached are dropped,
+        # just like they would never be started in sequential mode.
+        if self.should_stop():
+            self.stopped = True
+            return
+
+        if not self.announce:
+            sys.stdout.write("%s " % test.testName)
+        line = "%s, time: %.2f sec" % (runResult.result, runResult.processTime)
+        if len(runResult.cpuTimes) > 1:
+            cpuTimes = runResult.cpuTimes
+            median = statistics.median(cpuTimes)
+            deviation = statistics.stdev(cpuTimes)
+            line += " (min: %.3f, median: %.3f, stddev: %.3f of %s runs)" % (min(cpuTimes), median, deviation,
+                                                                             len(cpuTimes))
+            self.cpuTimeStats.append((min(cpuTimes), median))
+            if median > 0:
+                self.relativeDeviations.append(deviation / median)
+        if runResult.peakMemory is not None:
+            line += ", memory: %.1f MB" % (runResult.peakMemory / 1024.0 / 1024.0)
+        print(line)
+        if self.report is not None:
+            self.report.writeTest(test, runResult)
+        if runHistory is not None:
+            runHistory.addResult(test.testName, runResult.inputHash, runResult)
+
+        self.number_of_tests += 1
+        if runResult.result not in ("OK", "IGNORE"):
+            self.number_of_fails += 1
+            if runResult.message is not None:
+                print(runResult.message)
+
+            if self.args.wrong_folder is not None:
+                createFolder(self.args.wrong_folder)
+                test.saveInputData(folder=self.args.wrong_folder)
+                test.saveModelOutputData(folder=self.args.wrong_folder)
+                outputFilename = os.path.join(self.args.wrong_folder, "%s.res" % test.testName)
+                runResult.output.saveToFile(outputFilename)
+
+            if self.args.wait_after_error:
+                waitForKey()
+
+        elif runResult.result == "IGNORE":
+            self.number_of_ignored += 1
+
+    def keyboard_interrupt(self):
+        raise KeyboardInterrupt()
+
+    def is_good(self):
+        return not self.stopped
+
+
+def estimateTestCosts(tests, recordedTimes):
+    """
+    Returns list of expected wall times of tests. Tests without recorded time
+    are estimated from size of input, at time per byte of recorded tests,
+    or, if no test has recorded time, their input size is used as cost.
+    """
+    sizes = [test.inputSize() for test in tests]
+    times = [recordedTimes.get(test.testName) for test in tests]
+    knownTime = sum(testTime for testTime, size in zip(times, sizes) if testTime is not None)
+    knownSize = sum(size for testTime, size in zip(times, sizes) if testTime is not None)
+    timePerByte = knownTime / knownSize if knownSize > 0 else 1.0
+    return [testTime if testTime is not None else size * timePerByte for testTime, size in zip(times, sizes)]
+
+
+def testingLoop(testProviderList, runner, args):
+    functor = TestingFunctor(runner, args)
+    completed = False
+    try:
+        for testProviderArgs in testProviderList:
+            TestProviderClass = testProviderArgs[0]
+            testProviderArgs = testProviderArgs[1]
+            print("Processing tests from \"%s\"" % (testProviderArgs,))
+            with profilePhase("test discovery"):
+                testProvider = TestProviderClass(*testProviderArgs)
+            tests = testProvider.getTests()
+            if args.shard is not None:
+                tests = shardTests(tests, args.shard)
+            # Random tests are generated as they go, so their number and sizes are not known in advance.
+            if args.longest_first and args.threads > 1 and not isinstance(testProvider, RandomTestProvider):
+                limit = None
+                if args.tests_limit is not None:
+                    # Tests are started out of order, only those which would be run in order are scheduled.
+                    limit = max(args.tests_limit - functor.number_of_tests, 0)
+                recordedTimes = runHistory.recordedTimes(args.program) if runHistory is not None else dict()
+                prepare = None
+                if args.pipeline is not None:
+                    prepare = lambda scheduled: pipelineTests(scheduled, args.pipeline, modelOutputs=not args.ignore_out)
+                executor = ScheduledExecutor(functor, functor.selectTests(tests),
+                                             lambda tests: estimateTestCosts(tests, recordedTimes), args.threads,
+                                             prepare, limit)
+            else:
+                # Tests are selected before pipeline, so only tests which will be run are prepared.
+                tests = functor.limitTests(functor.selectTests(tests))
+                if args.pipeline is not None:
+                    tests = pipelineTests(tests, args.pipeline, modelOutputs=not args.ignore_out)
+                if runner.cluster is not None:
+                    executor = DistributedExecutor(functor, tests, runner.cluster)
+                elif args.threads == 1:
+                    executor = SequentialExecutor(functor, tests)
+                else:
+                    executor = ParallelExecutor(functor, tests, args.threads)
+            executor.process()
+            if functor.overLimit or isinstance(executor, ScheduledExecutor) and executor.limited:
+                functor.stopped = True
+
+            if functor.stopped:
+                break
+        completed = True
+    finally:
+        # Summary is written also when testing was interrupted, with completed set to false.
+        if functor.report is not None:
+            functor.report.writeSummary(functor, completed)
+            functor.report.close()
+
+    if functor.stopped:
+        return
+
+    print("Total tests: " + str(functor.number_of_tests))
+    print("Ignored: " + str(functor.number_of_ignored))
+    print("Run: " + str(functor.number_of_tests - functor.number_of_ignored))
+    print("Successes: " + str(functor.number_of_tests - functor.number_of_ignored - functor.number_of_fails))
+    print("Failures: " + str(functor.number_of_fails))
+    if functor.cpuTimeStats:
+        print("Repeated tests: %s" % len(functor.cpuTimeStats))
+        print("Sum of minimum CPU times: %.3f sec" % sum(minimum for minimum, _ in functor.cpuTimeStats))
+        print("Sum of median CPU times: %.3f sec" % sum(median for _, median in functor.cpuTimeStats))
+        if functor.relativeDeviations:
+            print("Mean relative stddev: %.1f%%" % (100.0 * statistics.mean(functor.relativeDeviations)))
 
 
 def main():
@@ -751,21 +3217,100 @@ def main():
     sourcesGroup.add_argument('--generator2', '-g2', help='test generator, tests suffix and model solution as test source', nargs=3, metavar=("GEN", "SUF", "WZO"))
 
     parser.add_argument('--checker', '-c', help='provide your own checking function by python script, file must be in the same folder as ultima script')
+    parser.add_argument('--checker_processes', help='run checking function in N worker processes', type=int, metavar='N')
+    parser.add_argument('--float_eps', help='compare numbers in output with absolute error EPS', type=float, metavar='EPS')
+    parser.add_argument('--rel_eps', help='compare numbers in output with relative error EPS', type=float, metavar='EPS')
     parser.add_argument('--wait_after_error', '-w', help='wait for key after failed test', action='store_true', default=False)
-    parser.add_argument('--save_to_folder', '-s', help='save failed tests to specified folder', metavar="FOLDER", dest="wrong_folder")
+    parser.add_argument('--save_to_folder', '-s', help='save failed tests and program outputs (as .res) to specified folder', metavar="FOLDER", dest="wrong_folder")
     parser.add_argument('--ignore_out', '-i', help='ignore program out', action='store_true', default=False)
-    parser.add_argument('--time_limit', '-t', help='set execution time limit', type=float)
+    parser.add_argument('--time_limit', '-t', help='set CPU time limit', type=float)
+    parser.add_argument('--wall_time_limit', help='kill program after SEC seconds of real time, '
+                                                  'twice the CPU time limit by default', type=float, metavar='SEC')
+    parser.add_argument('--memory_limit', '-m', help='set memory (peak resident set size) limit (MLE)', type=float, metavar='MB')
+    parser.add_argument('--address_space_limit', help='limit address space of program, '
+                                                      'allocations over limit fail', type=float, metavar='MB')
+    parser.add_argument('--output_limit', help='kill program writing more than MB megabytes (OLE)', type=float, metavar='MB')
+    parser.add_argument('--spill_after', help='keep at most MB megabytes of program output in memory, '
+                                              'larger output goes to temporary file', type=float, metavar='MB')
+    parser.add_argument('--direct_output', help='let program write output straight to temporary file, by '
+                                                'default done after output larger than --spill_after',
+                        action='store_true', default=False)
     parser.add_argument('--oitimetool', '-o', help='use oitimetool, optionally path to oitimetool folder', nargs='?', const="")
     parser.add_argument('--keyword', '-k', help='run only tests with specified keyword in name')
     parser.add_argument('--break_after', '-b', help='break testing after N fails', type=int, metavar='N')
     parser.add_argument('--tests_limit', '-n', help='run only N first tests', type=int, metavar='N')
+    parser.add_argument('--shard', help='run only i-th of N parts of tests, divided by hash of test name',
+                        type=parseShard, metavar='i/N')
+    parser.add_argument('--repeat', help='run program K times on each test and report statistics of CPU time, '
+                                         'output is checked once', type=int, default=1, metavar='K')
+    parser.add_argument('--warmup', help='run program W times on each test before measured runs',
+                        type=int, default=0, metavar='W')
     parser.add_argument('--threads', '-p', help='number of parallel tasks', type=int, default=1)
+    parser.add_argument('--longest_first', help='with --threads, start tests expected to take longest first, by '
+                                               'times recorded in --history or by input size; results are '
+                                               'still reported in order', action='store_true', default=False)
+    parser.add_argument('--cpu_affinity', help='pin programs run by each parallel task to its own CPUs',
+                        action='store_true', default=False)
+    parser.add_argument('--reserve_cpu', help='with --cpu_affinity, leave first CPU for ultima',
+                        action='store_true', default=False)
+    parser.add_argument('--serve', help='run tests on workers (worker.py) connecting to [HOST:]PORT, '
+                                        'as many at once as they have slots; inputs and outputs are sent '
+                                        'compressed, outputs are checked here. Workers are not authenticated, '
+                                        'so only local ones are accepted unless HOST (ie 0.0.0.0) is given',
+                        type=parseAddress, metavar='[HOST:]PORT')
+    parser.add_argument('--pipeline', help='generate or unpack inputs and model outputs of up to N tests ahead, '
+                                           'in background', type=int, metavar='N')
+    parser.add_argument('--verify_zip', help='check integrity of whole zip archives in background, '
+                                             'reporting corrupt files', action='store_true', default=False)
+    parser.add_argument('--cache', help='reuse generated inputs and model outputs stored in FOLDER '
+                                        '(%s by default); generator must be deterministic' % TestDataCache.defaultFolder,
+                        nargs='?', const=TestDataCache.defaultFolder, metavar='FOLDER')
+    parser.add_argument('--folder_index', help='keep index of test folders in FOLDER (%s by default), so '
+                                               'only changed directories are read again' % FolderIndex.defaultFolder,
+                        nargs='?', const=FolderIndex.defaultFolder, metavar='FOLDER')
+    parser.add_argument('--report', help='write result of each test and summary to FILE as JSON lines, '
+                                         'as tests finish', metavar='FILE')
+    parser.add_argument('--history', help='save times and memory of tests to SQLite database FILE '
+                                          '(%s by default)' % RunHistory.defaultFilename,
+                        nargs='?', const=RunHistory.defaultFilename, metavar='FILE')
+    parser.add_argument('--baseline', help='with --history, report tests slower than in run RUN of history, '
+                                           'by default previous run of the same program', nargs='?', const='last',
+                        metavar='RUN')
+    parser.add_argument('--slowdown', help='report tests which got slower by more than PERCENT (default 10)',
+                        type=float, default=10, metavar='PERCENT')
+    parser.add_argument('--profile', help='print time spent in phases of testing, ie generator, program, check',
+                        action='store_true', default=False)
+    parser.add_argument('--profile_trace', help='save phases of testing to FILE in Chrome trace format, '
+                                                'implies --profile', metavar='FILE')
+    parser.add_argument('--cache_size', help='keep cache below MB megabytes, removing least recently used data',
+                        type=float, default=1024, metavar='MB')
 
     args = parser.parse_args()    
     assertFileExist(args.program)
+    if args.cpu_affinity:
+        if not hasattr(os, 'sched_setaffinity'):
+            parser.error("--cpu_affinity is not supported on this system")
+        availableCpus = len(os.sched_getaffinity(0)) - (1 if args.reserve_cpu else 0)
+        if availableCpus < args.threads:
+            parser.error("--cpu_affinity needs CPU for each of %s tasks, %s available" % (args.threads, availableCpus))
+    elif args.reserve_cpu:
+        parser.error("--reserve_cpu requires --cpu_affinity")
+    if args.serve is not None and (args.oitimetool is not None or args.cpu_affinity or args.longest_first):
+        parser.error("--serve can't be used with --oitimetool, --cpu_affinity or --longest_first")
     testProviderList = getProviderListFromArgs(args, parser)
     runner = getRunnerFromArgs(args)
     
+    if args.checker is not None and (args.float_eps is not None or args.rel_eps is not None):
+        parser.error("--checker can't be used together with --float_eps or --rel_eps")
+
+    if args.float_eps is not None or args.rel_eps is not None:
+        absoluteEps = args.float_eps or 0.0
+        relativeEps = args.rel_eps or 0.0
+        useComparator(lambda outS, modelS: compareFloatOutputs(outS, modelS, absoluteEps, relativeEps))
+
+    if args.checker_processes is not None and args.checker is None:
+        parser.error("--checker_processes requires --checker")
+
     if args.checker is not None:
         try:
             if getFileNameExtension(args.checker) == 'py':
@@ -777,16 +3322,73 @@ def main():
                 print("Module %s don't have check function!" % args.checker)
                 exit()
 
+            def checkerFullResultCheck(inS, outS, modelS):
+                message = checker.check(inS, outS, modelS)
+                return message == "OK", message
+
             global resultCheck
             global advancedResultCheck
+            global fullResultCheck
             resultCheck = lambda inS, outS, modelS: checker.check(inS, outS, modelS) == "OK"
             advancedResultCheck = lambda inS, outS, modelS: checker.check(inS, outS, modelS)
+            fullResultCheck = checkerFullResultCheck
+
+            if args.checker_processes is not None:
+                runner.checkerPool = CheckerPool(args.checker, args.checker_processes)
             
         except ImportError:
             print("Could not import %s!" % args.checker)
             exit()
 
-    testingLoop(testProviderList, runner, args)    
+    global verifyZipInBackground
+    verifyZipInBackground = args.verify_zip
+
+    global folderIndexFolder
+    folderIndexFolder = args.folder_index
+
+    if args.cache is not None:
+        global testDataCache
+        testDataCache = TestDataCache(args.cache, int(args.cache_size * 1024 * 1024))
+
+    if args.baseline is not None and args.history is None:
+        parser.error("--baseline requires --history")
+    if args.baseline not in (None, 'last') and not args.baseline.isdigit():
+        parser.error("--baseline must be number of run or 'last'")
+    if args.history is not None:
+        if sqlite3 is None:
+            parser.error("--history requires sqlite3 module")
+        global runHistory
+        runHistory = RunHistory(args.history)
+        runHistory.startRun(args.program)
+
+    if args.profile or args.profile_trace is not None:
+        global profiler
+        profiler = Profiler(keepEvents=args.profile_trace is not None)
+
+    try:
+        testingLoop(testProviderList, runner, args)
+        if testDataCache is not None:
+            print("Cache hits: %s, misses: %s" % (testDataCache.hits, testDataCache.misses))
+        if profiler is not None:
+            profiler.printReport()
+            if args.profile_trace is not None:
+                profiler.saveTrace(args.profile_trace)
+        if runHistory is not None:
+            print("Saved as run %s in %s" % (runHistory.runId, runHistory.filename))
+            if args.baseline is not None:
+                if args.baseline == 'last':
+                    baselineId = runHistory.previousRun(runHistory.runId)
+                else:
+                    baselineId = int(args.baseline)
+                if baselineId is None:
+                    print("There is no previous run of %s in history." % args.program)
+                else:
+                    runHistory.printComparison(runHistory.runId, baselineId, args.slowdown / 100.0)
+    finally:
+        if runner.checkerPool is not None:
+            runner.checkerPool.shutdown()
+        if runner.cluster is not None:
+            runner.cluster.close()
 
 
 if __name__ == "__main__":
@@ -794,5 +3396,7 @@ if __name__ == "__main__":
         main()
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt - Exiting...")
+    except CriticalError as error:
+        print("\nCritical Error. %s Exiting." % error)
         
 
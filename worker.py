@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+try:
+    from ultima import *
+except ImportError:
+    print("worker.py requires ultima.py to run!")
+    exit()
+
+
+class ReceivedTest(Test):
+    """Test sent by coordinator, its input is kept in memory or, if large, in temporary file."""
+    def __init__(self, testName, inputBuffer):
+        Test.__init__(self, testName)
+        self.inputBuffer = inputBuffer
+
+    @property
+    def inputStream(self):
+        return self.inputBuffer.openStream()
+
+    @property
+    def haveModelOutput(self):
+        # Output is checked by coordinator.
+        return False
+
+
+class ProgramStore:
+    """Programs received from coordinator, saved once for all slots of worker."""
+    def __init__(self):
+        self.folder = tempfile.mkdtemp(prefix="ultima-worker")
+        self.lock = threading.Lock()
+
+    def save(self, setup, data):
+        path = os.path.join(self.folder, setup["digest"][:16], setup["program"])
+        with self.lock:
+            if not os.path.isfile(path):
+                createFolder(os.path.dirname(path))
+                saveToFile(data, path)
+                os.chmod(path, 0o755)
+        return path
+
+    def remove(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def connect(address, retryTime):
+    """Returns connection to coordinator, trying for retryTime seconds if it is not listening yet."""
+    deadline = time.time() + retryTime
+    while True:
+        try:
+            return socket.create_connection(address)
+        except OSError:
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.5)
+
+
+def runSlot(address, programs, args):
+    """Runs tests sent by coordinator through one connection, until coordinator closes it."""
+    try:
+        connection = connect(address, args.retry)
+    except OSError as error:
+        print("Could not connect to %s:%s, %s" % (address[0], address[1], error))
+        return
+    configureConnection(connection)
+    channel = Channel(connection)
+    try:
+        programData = io.BytesIO()
+        setup = channel.receive(programData)
+        runner = BasicRunner(programs.save(setup, programData.getvalue()))
+        for setting in ("timeLimit", "wallTimeLimit", "memoryLimit", "addressSpaceLimit", "outputLimit",
+                        "outputSpillSize", "repeat", "warmup"):
+            setattr(runner, setting, setup[setting])
+        channel.send({"type": "ready"})
+
+        while True:
+            inputBuffer = OutputBuffer(runner.outputSpillSize)
+            message = channel.receive(inputBuffer)
+            test = ReceivedTest(message["name"], inputBuffer)
+            if args.verbose:
+                print("Running %s" % test.testName)
+            runResult = runner.measure(runner.programName, test)
+            inputBuffer.close()
+            reply = dict((field, getattr(runResult, field)) for field in Cluster.resultFields)
+            with runResult.output.openStream() as outputStream:
+                channel.send(dict(reply, type="result"), outputStream)
+            runResult.output.close()
+    except ConnectionError:
+        # Coordinator finished testing.
+        pass
+    except (OSError, ValueError, zlib.error) as error:
+        print("Connection to coordinator lost, %s" % error)
+    finally:
+        channel.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs tests sent by ultima --serve, on this machine.')
+    parser.add_argument('address', help='address of coordinator', type=parseAddress, metavar='HOST:PORT')
+    parser.add_argument('--threads', '-p', help='number of tests run at once', type=int, default=1)
+    parser.add_argument('--retry', help='try to connect for SEC seconds, if coordinator is not listening yet',
+                        type=float, default=30, metavar='SEC')
+    parser.add_argument('--verbose', '-v', help='print names of run tests', action='store_true', default=False)
+    args = parser.parse_args()
+    address = (args.address[0] or "localhost", args.address[1])
+
+    programs = ProgramStore()
+    try:
+        slots = [threading.Thread(target=runSlot, args=(address, programs, args), daemon=True)
+                 for _ in range(args.threads)]
+        for slot in slots:
+            slot.start()
+        # Threads are joined with timeout, so KeyboardInterrupt is not delayed.
+        for slot in slots:
+            while slot.is_alive():
+                slot.join(1)
+    finally:
+        programs.remove()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nKeyboardInterrupt - Exiting...")